@@ -1,13 +1,63 @@
 from django.contrib import admin
-from .models import Category, Seller, Product, Cart, CartItem, Address, Enquiry, Order, OrderItem, Profile
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import Category, Seller, Product, Cart, CartItem, Address, Enquiry, Order, OrderItem, Profile, PaymentOutbox, SalesRollup
 from django.contrib.auth.models import User
+from . import exports, facets, search
 
 # Register your models here.
 
 
+def estimated_count(model, using):
+    """ The database's estimate of the number of rows of ``model``'s table, None when it has none. """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [connection.ops.quote_name(table)])
+        elif connection.vendor == 'sqlite':
+            # Kept by ANALYZE (PRAGMA optimize), the first number is the table's row count
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    # Postgres reports -1 for a table never analyzed
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Changelist paginator counting the unfiltered list from the table
+    statistics instead of a COUNT(*) over every row. Filtered lists, and
+    tables estimated under EXACT_BELOW rows, are counted exactly.
+    """
+    EXACT_BELOW = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.EXACT_BELOW:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """ Changelist settings for tables with millions of rows. """
+    paginator = EstimatedCountPaginator
+    # No second COUNT(*) of the whole table under filtered lists
+    show_full_result_count = False
+
+
 class ProductInlineAdmin(admin.TabularInline):
     model = Product
     extra=0
+    autocomplete_fields = ['user', 'category', 'seller']
 
 class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
@@ -55,19 +105,12 @@ class PriceRangeFilter(admin.SimpleListFilter):
     parameter_name = 'price_range'  # Query parameter in the URL
 
     def lookups(self, request, model_admin):
-        return [
-            ('low', 'Low (Under 500)'),
-            ('mid', 'Mid (500 - 1000)'),
-            ('high', 'High (Above 1500)'),
-        ]
+        return [(key, label) for key, label, *_ in facets.PRICE_BUCKETS]
 
     def queryset(self, request, queryset):
-        if self.value() == 'low':
-            return queryset.filter(price__lt=500)
-        elif self.value() == 'mid':
-            return queryset.filter(price__gte=50, price__lte=1000)
-        elif self.value() == 'high':
-            return queryset.filter(price__gt=1500)
+        price_filter = facets.price_bucket_filter(self.value())
+        if price_filter is not None:
+            return queryset.filter(price_filter)
         
 
 class CategoryDropdownFilter(admin.SimpleListFilter):
@@ -88,12 +131,14 @@ class CategoryDropdownFilter(admin.SimpleListFilter):
     
         
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     prepopulated_fields = {'slug': ('name',)}
     list_display = ('name', 'slug', 'price', 'image', 'category_name', 'seller_name')
+    list_select_related = ('category', 'seller')
     search_fields = ('name',)
     # readonly_fields = ('slug', )
-    list_filter = (CategoryDropdownFilter, 'seller', PriceRangeFilter)
+    list_filter = (CategoryDropdownFilter, ('seller', admin.RelatedOnlyFieldListFilter), PriceRangeFilter)
+    autocomplete_fields = ['user', 'category', 'seller']
 
     fieldsets = (
         ('Basic Information', {
@@ -103,31 +148,49 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('description', 'price', 'category', 'seller')
         }),
     )
+    actions = exports.admin_actions('products')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of LIKE '%term%' scans. Every match,
+        # the changelist paginates them
+        if not search_term or not search.is_enabled():
+            return super().get_search_results(request, queryset, search_term)
+        matching = search.matching(search_term)
+        if matching is None:
+            return queryset.none(), False
+        return queryset.filter(id__in=matching), False
 
     def category_name(self, obj):
         return obj.category.name
     
     category_name.short_description = 'Category'
+    category_name.admin_order_field = 'category__name'
 
     def seller_name(self, obj):
         return obj.seller.name
     
     seller_name.short_description = 'Seller'
+    seller_name.admin_order_field = 'seller__name'
     
 
 
 class OrderItemInlineAdmin(admin.TabularInline):
     model = OrderItem
     extra = 0
+    autocomplete_fields = ['product']
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ('user', 'address', 'date', 'total', 'payment_mode', 'amount_paid', 'amount_due', 'razorpay_order_id', 'razorpay_payment_id', 'razorpay_signature', 'status')
-    search_fields = ('user', 'status')
+    list_select_related = ('user', 'address__user')
+    # Exact matches on indexed columns, a customer's orders are found by username
+    search_fields = ('user__username__exact', 'razorpay_order_id__exact')
     readonly_fields = ('user', 'date', 'total', 'payment_mode', 'amount_paid', 'amount_due', 'razorpay_order_id', 'razorpay_payment_id', 'razorpay_signature',)
-    list_filter = ('status', 'user')
+    list_filter = ('status', 'payment_mode')
+    autocomplete_fields = ['address']
 
     inlines = [OrderItemInlineAdmin]
+    actions = exports.admin_actions('orders')
 
 
     # def has_add_permission(self, request):
@@ -144,9 +207,13 @@ class ProfileInlineAdmin(admin.TabularInline):
 
 admin.site.unregister(User)
 
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(LargeTableAdmin):
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'is_active', 'date_joined', 'get_dob')
-    search_fields = ('username', 'email', 'first_name', 'last_name')
+    list_select_related = ('profile',)
+    # Exact matches on indexed columns (email, see migration 0013), also
+    # behind the user autocompletes. A prefix LIKE could not use the username
+    # index on SQLite, where LIKE is case-insensitive.
+    search_fields = ('username__exact', 'email__exact')
     readonly_fields = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'is_active', 'date_joined')
     fieldsets = (
         ('Basic Information', {
@@ -173,10 +240,10 @@ admin.site.register(User, UserAdmin)
 
 
 
-class AddressAdmin(admin.ModelAdmin):
+class AddressAdmin(LargeTableAdmin):
     list_display = ('user', 'address', 'city', 'state', 'country', 'pincode', 'phone')
-    search_fields = ('user__email', 'address', 'city', 'state', 'country', 'pincode', 'phone')
-    list_filter = (('user', admin.RelatedOnlyFieldListFilter), 'city')
+    list_select_related = ('user',)
+    search_fields = ('user__username__exact', 'pincode__exact', 'phone__exact')
 
     autocomplete_fields = ['user']
 
@@ -185,12 +252,40 @@ admin.site.register(Address, AddressAdmin)
 
 class EnquiryAdmin(admin.ModelAdmin):
     list_display = ('user', 'subject', 'message', 'date')
+    list_select_related = ('user',)
     search_fields = ('user__email', 'subject', 'message')
     list_filter = (('user', admin.RelatedOnlyFieldListFilter), 'date')
     readonly_fields = ('user', 'subject', 'message', 'date')
 
     autocomplete_fields = ['user']
+    actions = exports.admin_actions('enquiries')
 
 admin.site.register(Enquiry, EnquiryAdmin)
 
 
+
+
+class PaymentOutboxAdmin(admin.ModelAdmin):
+    list_display = ('order', 'status', 'attempts', 'next_attempt_at', 'updated_at', 'last_error')
+    # Order.__str__ shows the username: join only that, not every foreign key
+    list_select_related = ('order__user',)
+    list_filter = ('status',)
+    readonly_fields = ('order', 'created_at', 'updated_at')
+
+admin.site.register(PaymentOutbox, PaymentOutboxAdmin)
+
+
+class SalesRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'dimension', 'key', 'status', 'orders', 'lines', 'units', 'revenue')
+    list_filter = ('dimension', 'status')
+    date_hierarchy = 'day'
+
+    # Maintained by app.analytics, rebuild with manage.py rebuild_sales_rollups
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+admin.site.register(SalesRollup, SalesRollupAdmin)
+
@@ -0,0 +1,309 @@
+# analytics.py
+#
+# Daily sales rollups. SalesRollup holds one row per (dimension, key, day,
+# order status) with the number of orders, order lines, units and revenue,
+# so sales reports read a few hundred rollup rows instead of scanning the
+# order tables.
+#
+# Rows are updated incrementally, by adding deltas in a single upsert:
+#   - checkout records the order lines it bulk inserts (record_items),
+#   - the Order signals count orders in and out and move an order's sales
+#     to its new status or payment mode,
+#   - the OrderItem signals follow lines added, edited or deleted one by one
+#     (the admin inline).
+# Inside ``batch_rollups()`` the deltas are summed and written once at the end.
+# ``manage.py rebuild_sales_rollups`` recomputes everything from the orders.
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Category, Order, OrderItem, Product, SalesRollup, Seller
+
+# Dimensions with one row per order line key, and the OrderItem lookup of their key
+LINE_DIMENSIONS = {
+    'all': None,
+    'payment_mode': 'order__payment_mode',
+    'category': 'product__category_id',
+    'seller': 'product__seller_id',
+    'product': 'product_id',
+}
+
+LABELS = {'category': Category, 'seller': Seller, 'product': Product}
+
+INTERVALS = ('day', 'week', 'month')
+
+# Measures, in the order of the delta lists
+MEASURES = ('orders', 'lines', 'units', 'revenue')
+
+# Rows per upsert statement, 8 parameters each
+UPSERT_BATCH = 100
+
+
+def day_of(date):
+    return timezone.localdate(date)
+
+
+class Deltas:
+    """ Changes to apply to the rollups, summed per row. """
+
+    def __init__(self):
+        self.cells = defaultdict(lambda: [0, 0, 0, 0.0])
+
+    def add_order(self, day, status, payment_mode, count=1):
+        for dimension, key in (('all', ''), ('payment_mode', payment_mode)):
+            self.cells[(dimension, key, day, status)][0] += count
+
+    def add_line(self, day, status, payment_mode, product_id, category_id, seller_id, quantity, total, sign=1):
+        keys = {'all': '', 'payment_mode': payment_mode, 'category': category_id, 'seller': seller_id, 'product': product_id}
+        for dimension, key in keys.items():
+            cell = self.cells[(dimension, str(key), day, status)]
+            cell[1] += sign
+            cell[2] += sign * quantity
+            cell[3] += sign * total
+
+    def merge(self, other):
+        for key, cell in other.cells.items():
+            for n, value in enumerate(cell):
+                self.cells[key][n] += value
+
+    def apply(self):
+        pending = getattr(_local, 'pending', None)
+        if pending is not None:
+            pending.merge(self)
+            return
+        cells = [(key, cell) for key, cell in self.cells.items() if any(cell)]
+        if not cells:
+            return
+        if connection.vendor in ('sqlite', 'postgresql'):
+            for start in range(0, len(cells), UPSERT_BATCH):
+                _upsert(cells[start:start + UPSERT_BATCH])
+        else:
+            for key, cell in cells:
+                _update_or_create(key, cell)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def batch_rollups():
+    """ Write the rollup changes made inside the block with one upsert when it exits. """
+    if getattr(_local, 'pending', None) is not None:
+        # Nested, the outermost block writes
+        yield
+        return
+
+    _local.pending = Deltas()
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+
+    pending.apply()
+
+
+def _upsert(cells):
+    table = connection.ops.quote_name(SalesRollup._meta.db_table)
+    columns = ('dimension', 'key', 'day', 'status') + MEASURES
+    quoted = [connection.ops.quote_name(column) for column in columns]
+    placeholders = ', '.join(['(%s)' % ', '.join(['%s'] * len(columns))] * len(cells))
+    updates = ', '.join(f"{column} = {table}.{column} + excluded.{column}" for column in quoted[4:])
+    params = []
+    for (dimension, key, day, status), cell in cells:
+        params += [dimension, key, connection.ops.adapt_datefield_value(day), status, *cell]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(quoted)}) VALUES {placeholders} "
+            f"ON CONFLICT ({', '.join(quoted[:4])}) DO UPDATE SET {updates}",
+            params,
+        )
+
+
+def _update_or_create(key, cell):
+    dimension, key, day, status = key
+    rows = SalesRollup.objects.filter(dimension=dimension, key=key, day=day, status=status)
+    changes = {measure: F(measure) + value for measure, value in zip(MEASURES, cell)}
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            SalesRollup.objects.create(dimension=dimension, key=key, day=day, status=status, **dict(zip(MEASURES, cell)))
+    except IntegrityError:
+        # Created concurrently
+        rows.update(**changes)
+
+
+def _order_lines(order_id):
+    return OrderItem.objects.filter(order_id=order_id).values_list(
+        'product_id', 'product__category_id', 'product__seller_id', 'quantity', 'total',
+    )
+
+
+# Incremental updates
+
+def order_created(order):
+    deltas = Deltas()
+    deltas.add_order(day_of(order.date), order.status, order.payment_mode)
+    deltas.apply()
+
+
+def order_deleted(order, status, payment_mode):
+    # The lines are counted out by their own delete signals
+    deltas = Deltas()
+    deltas.add_order(day_of(order.date), status, payment_mode, count=-1)
+    deltas.apply()
+
+
+def order_moved(order, status, payment_mode):
+    """ Move the sales of ``order`` from ``status`` and ``payment_mode`` to its current ones. """
+    day = day_of(order.date)
+    deltas = Deltas()
+    deltas.add_order(day, status, payment_mode, count=-1)
+    deltas.add_order(day, order.status, order.payment_mode)
+    for line in _order_lines(order.pk):
+        deltas.add_line(day, status, payment_mode, *line, sign=-1)
+        deltas.add_line(day, order.status, order.payment_mode, *line)
+    deltas.apply()
+
+
+def record_items(order, lines):
+    """ Count in lines bulk inserted for ``order``: (product_id, category_id, seller_id, quantity, total) tuples. """
+    deltas = Deltas()
+    for line in lines:
+        deltas.add_line(day_of(order.date), order.status, order.payment_mode, *line)
+    deltas.apply()
+
+
+def item_changed(item, previous=None, sign=1):
+    """ Count in ``item`` (out with ``sign=-1``), and out its ``previous`` (product_id, quantity, total) on edits. """
+    order = item.order
+    day = day_of(order.date)
+    deltas = Deltas()
+    if previous:
+        product_id, quantity, total = previous
+        category_id, seller_id = Product.objects.filter(pk=product_id).values_list('category_id', 'seller_id').first() or (None, None)
+        deltas.add_line(day, order.status, order.payment_mode, product_id, category_id, seller_id, quantity, total, sign=-1)
+    product = item.product
+    deltas.add_line(day, order.status, order.payment_mode, product.pk, product.category_id, product.seller_id, item.quantity, item.total, sign=sign)
+    deltas.apply()
+
+
+# Rebuild
+
+def rebuild(chunk_size=50000):
+    """
+    Recompute every rollup from the orders, ``chunk_size`` orders at a time,
+    in one transaction. Yields the number of orders processed so far.
+    """
+    day = TruncDate('date', tzinfo=timezone.get_current_timezone())
+    line_day = TruncDate('order__date', tzinfo=timezone.get_current_timezone())
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        processed, last_id = 0, 0
+        while True:
+            ids = list(Order.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            deltas = Deltas()
+
+            orders = (
+                Order.objects.filter(id__gte=ids[0], id__lte=ids[-1]).order_by()
+                .values('status', 'payment_mode', day=day).annotate(n=Count('id'))
+            )
+            for row in orders:
+                deltas.add_order(row['day'], row['status'], row['payment_mode'], count=row['n'])
+
+            lines = OrderItem.objects.filter(order_id__gte=ids[0], order_id__lte=ids[-1]).order_by()
+            for dimension, lookup in LINE_DIMENSIONS.items():
+                group = {'day': line_day, 'status': F('order__status')}
+                if lookup:
+                    group['key'] = F(lookup)
+                rows = lines.values(**group).annotate(lines=Count('id'), units=Sum('quantity'), revenue=Sum('total'))
+                for row in rows:
+                    cell = deltas.cells[(dimension, str(row.get('key', '')), row['day'], row['status'])]
+                    cell[1] += row['lines']
+                    cell[2] += row['units']
+                    cell[3] += row['revenue']
+
+            deltas.apply()
+            processed, last_id = processed + len(ids), ids[-1]
+            yield processed
+
+
+# Reporting
+
+def periods(start, end, interval):
+    """ First day of every ``interval`` period between ``start`` and ``end``. """
+    if interval == 'week':
+        current = start - timedelta(days=start.weekday())
+    elif interval == 'month':
+        current = start.replace(day=1)
+    else:
+        current = start
+    while current <= end:
+        yield current
+        if interval == 'month':
+            current = (current + timedelta(days=32)).replace(day=1)
+        else:
+            current += timedelta(days=7 if interval == 'week' else 1)
+
+
+def series(dimension, start, end, interval='day', statuses=None, keys=None, limit=10):
+    """
+    Sales time series of ``dimension`` between the ``start`` and ``end``
+    dates. Without ``keys``, the ``limit`` keys with the most revenue are
+    reported. Missing periods are filled with zeros.
+    """
+    rows = SalesRollup.objects.filter(dimension=dimension, day__gte=start, day__lte=end)
+    if statuses:
+        rows = rows.filter(status__in=statuses)
+
+    if keys is None:
+        top = rows.values('key').annotate(total=Sum('revenue')).order_by('-total', 'key')
+        keys = [row['key'] for row in (top[:limit] if dimension in LABELS else top)]
+    else:
+        keys = [str(key) for key in keys]
+    if not keys:
+        return []
+
+    period = {'day': F('day'), 'week': TruncWeek('day'), 'month': TruncMonth('day')}[interval]
+    points = defaultdict(dict)
+    grouped = (
+        rows.filter(key__in=keys).values('key', period=period)
+        .annotate(orders=Sum('orders'), lines=Sum('lines'), units=Sum('units'), revenue=Sum('revenue'))
+        .order_by()
+    )
+    for row in grouped:
+        points[row['key']][row['period']] = row
+
+    labels = {key: key for key in keys}
+    if dimension in LABELS:
+        labels.update({str(pk): name for pk, name in LABELS[dimension].objects.filter(pk__in=keys).values_list('pk', 'name')})
+
+    empty = {'orders': 0, 'lines': 0, 'units': 0, 'revenue': 0}
+    result = []
+    for key in keys:
+        key_points = []
+        for first_day in periods(start, end, interval):
+            row = points[key].get(first_day, empty)
+            key_points.append({
+                'period': first_day.isoformat(),
+                'orders': row['orders'],
+                'lines': row['lines'],
+                'units': row['units'],
+                'revenue': round(row['revenue'], 2),
+            })
+        result.append({
+            'key': key,
+            'label': labels[key] or 'All',
+            'totals': {measure: round(sum(point[measure] for point in key_points), 2) for measure in MEASURES},
+            'points': key_points,
+        })
+    return result
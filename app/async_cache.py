@@ -0,0 +1,37 @@
+# async_cache.py
+#
+# Async access to the default cache, for the async views. Django's cache
+# backends implement their async methods by running the sync ones in the
+# thread shared by every sync_to_async call, so each cache read waits behind
+# the ORM work of the other requests. The local memory cache does no I/O, it
+# is called directly instead.
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def _in_process():
+    return isinstance(caches['default'], LocMemCache)
+
+
+async def aget(key, default=None):
+    if _in_process():
+        return cache.get(key, default)
+    return await cache.aget(key, default)
+
+
+async def aget_many(keys):
+    if _in_process():
+        return cache.get_many(keys)
+    return await cache.aget_many(keys)
+
+
+async def aadd(key, value, timeout):
+    if _in_process():
+        return cache.add(key, value, timeout)
+    return await cache.aadd(key, value, timeout)
+
+
+async def aset(key, value, timeout):
+    if _in_process():
+        return cache.set(key, value, timeout)
+    return await cache.aset(key, value, timeout)
@@ -0,0 +1,259 @@
+# benchmark.py
+#
+# HTTP load replay against the app_api endpoints, used by `manage.py bench_api`.
+# Virtual users log in with JWT and loop over weighted scenarios (browse,
+# add to cart, checkout, order history) for a fixed duration. Every request is
+# recorded per endpoint with its latency, status and, when the server reports
+# it in the X-SQL-Queries header, its number of SQL queries.
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+SQL_QUERIES_HEADER = 'X-SQL-Queries'
+
+DEFAULT_MIX = {'browse': 60, 'cart': 20, 'checkout': 5, 'orders': 15}
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def parse_mix(value):
+    """ "browse=60,cart=20" -> {'browse': 60, 'cart': 20} """
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise BenchmarkError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise BenchmarkError(f"Invalid weight for '{name}': {weight!r}")
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)  # endpoint -> [(latency seconds, status, sql queries or None)]
+        self.exceptions = Counter()  # scenario -> exceptions raised by the client side, e.g. an unexpected reply
+        self.recording = True
+
+    def add(self, endpoint, latency, status, queries):
+        if self.recording:
+            with self.lock:
+                self.samples[endpoint].append((latency, status, queries))
+
+    def add_exception(self, scenario):
+        if self.recording:
+            with self.lock:
+                self.exceptions[scenario] += 1
+
+
+class VirtualUser:
+    """ One authenticated API client with its own keep-alive session. """
+
+    def __init__(self, base_url, username, password, recorder, rng, payment_mode, token=None):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.recorder = recorder
+        self.rng = rng
+        self.payment_mode = payment_mode
+        self.categories = {}
+        self.products = []
+        self.address_id = None
+
+        if token is None:
+            response = self.request('token', 'post', '/api/token/', json={'username': username, 'password': password})
+            if response is None or response.status_code != 200:
+                raise BenchmarkError(f"Could not log in as {username}")
+            token = response.json()['access']
+        self.token = token
+        self.session.headers['Authorization'] = f"Bearer {token}"
+
+    def request(self, endpoint, method, path, **kwargs):
+        url = path if path.startswith('http') else self.base_url + path
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, timeout=30, **kwargs)
+        except requests.RequestException:
+            self.recorder.add(endpoint, time.perf_counter() - started, 0, None)
+            return None
+        latency = time.perf_counter() - started
+        queries = response.headers.get(SQL_QUERIES_HEADER)
+        self.recorder.add(endpoint, latency, response.status_code, int(queries) if queries else None)
+        return response
+
+    def json(self, response, default=None):
+        if response is None or response.status_code >= 400:
+            return default
+        return response.json()
+
+    def load_catalog(self):
+        categories = self.json(self.request('categories', 'get', '/api/categories/'), [])
+        self.categories = {category['id']: category['slug'] for category in categories}
+
+        page = self.json(self.request('products', 'get', '/api/products/', params={'page_size': 20}), {})
+        self.products = page.get('results', [])
+        if page.get('next'):
+            page = self.json(self.request('products', 'get', page['next']), {})
+            self.products += page.get('results', [])
+
+    def pick_product(self):
+        if not self.products:
+            self.load_catalog()
+        return self.rng.choice(self.products) if self.products else None
+
+    # Scenarios
+
+    def browse(self):
+        self.load_catalog()
+        product = self.pick_product()
+        if product and product['category'] in self.categories:
+            self.request('product', 'get', f"/api/products/{self.categories[product['category']]}/{product['slug']}")
+
+    def cart(self):
+        product = self.pick_product()
+        if product:
+            self.request('add_to_cart', 'post', '/api/add-to-cart/', json={'product_id': product['id'], 'quantity': self.rng.randint(1, 3)})
+        self.request('cart', 'get', '/api/cart/')
+
+    def checkout(self):
+        product = self.pick_product()
+        if product:
+            self.request('add_to_cart', 'post', '/api/add-to-cart/', json={'product_id': product['id'], 'quantity': 1})
+        if self.address_id is None:
+            addresses = self.json(self.request('profile_address', 'get', '/api/profile/addresses/'), [])
+            if not addresses:
+                return
+            self.address_id = addresses[0]['id']
+        self.request('checkout', 'post', '/api/checkout/', json={'address_id': self.address_id, 'payment_mode': self.payment_mode})
+
+    def orders(self):
+        self.request('profile_orders', 'get', '/api/profile/orders/')
+
+
+SCENARIOS = {
+    'browse': VirtualUser.browse,
+    'cart': VirtualUser.cart,
+    'checkout': VirtualUser.checkout,
+    'orders': VirtualUser.orders,
+}
+
+
+def percentile(sorted_values, fraction):
+    """ Nearest-rank percentile of an already sorted list. """
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples, elapsed, exceptions=None):
+    endpoints = {}
+    for endpoint, records in sorted(samples.items()):
+        latencies = sorted(latency * 1000 for latency, status, queries in records)
+        queries = [queries for latency, status, queries in records if queries is not None]
+        endpoints[endpoint] = {
+            'requests': len(records),
+            'errors': sum(1 for latency, status, queries in records if status == 0 or status >= 500),
+            'client_errors': sum(1 for latency, status, queries in records if 400 <= status < 500),
+            'requests_per_second': round(len(records) / elapsed, 2),
+            'latency_ms': {
+                'mean': round(statistics.fmean(latencies), 2),
+                'p50': round(percentile(latencies, 0.50), 2),
+                'p95': round(percentile(latencies, 0.95), 2),
+                'p99': round(percentile(latencies, 0.99), 2),
+                'max': round(latencies[-1], 2),
+            },
+            'sql_queries_per_request': round(statistics.fmean(queries), 2) if queries else None,
+        }
+
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    exceptions = dict(sorted((exceptions or {}).items()))
+    return {
+        'elapsed_seconds': round(elapsed, 2),
+        'requests': total,
+        'requests_per_second': round(total / elapsed, 2) if elapsed else None,
+        'errors': sum(endpoint['errors'] for endpoint in endpoints.values()) + sum(exceptions.values()),
+        'scenario_exceptions': exceptions,
+        'endpoints': endpoints,
+    }
+
+
+def run(base_url, credentials, mix, concurrency, duration, warmup=0, seed=0, payment_mode='Cash on Delivery'):
+    """
+    Replay ``mix`` with ``concurrency`` virtual users for ``duration``
+    seconds after ``warmup`` seconds, and return the summary.
+    """
+    if not credentials:
+        raise BenchmarkError("No user credentials to log in with")
+
+    recorder = Recorder()
+    recorder.recording = False
+    scenarios, weights = zip(*mix.items())
+    errors = []
+    start_barrier = threading.Barrier(concurrency + 1)
+    stop = threading.Event()
+
+    # Virtual users sharing credentials share the token of the first one, so
+    # high concurrencies do not start with as many (slow) password checks
+    tokens = {}
+    logged_in = [threading.Event() for credential in credentials]
+
+    def worker(n):
+        rng = random.Random(f"{seed}:{n}")
+        k = n % len(credentials)
+        username, password = credentials[k]
+        try:
+            if n >= len(credentials):
+                logged_in[k].wait()
+            user = VirtualUser(base_url, username, password, recorder, rng, payment_mode, token=tokens.get(k))
+            tokens[k] = user.token
+        except Exception as e:
+            # Any failure, not only BenchmarkError (e.g. a token reply that is not JSON): release everyone
+            errors.append(str(e) if isinstance(e, BenchmarkError) else f"Could not log in as {username}: {e!r}")
+            start_barrier.abort()
+            return
+        finally:
+            logged_in[k].set()
+        try:
+            start_barrier.wait()
+        except threading.BrokenBarrierError:
+            return
+        while not stop.is_set():
+            scenario = rng.choices(scenarios, weights)[0]
+            try:
+                SCENARIOS[scenario](user)
+            except Exception as e:
+                recorder.add_exception(scenario)
+                logger.warning("Scenario %s failed for %s: %r", scenario, username, e)
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        stop.set()
+        raise BenchmarkError(errors[0] if errors else "A virtual user failed to start")
+
+    time.sleep(warmup)
+    recorder.recording = True
+    started = time.perf_counter()
+    time.sleep(duration)
+    recorder.recording = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    return summarize(recorder.samples, elapsed, recorder.exceptions)
@@ -0,0 +1,154 @@
+# cart.py
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+
+from .models import Cart, CartItem, Product
+
+# Most lines a single batch may change
+MAX_BATCH_CHANGES = 100
+
+
+class CartError(Exception):
+    pass
+
+
+_local = threading.local()
+
+
+@contextmanager
+def batch_totals():
+    """
+    Refresh the denormalized cart totals once per cart when the block exits,
+    instead of once for every cart item saved or deleted inside it.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        # Nested, the outermost block does the refresh
+        yield
+        return
+
+    _local.pending = set()
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+
+    for cart_id in pending:
+        Cart(pk=cart_id).refresh_totals()
+
+
+def cart_items_changed(cart_id):
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        Cart(pk=cart_id).refresh_totals()
+    else:
+        pending.add(cart_id)
+
+
+def apply_changes(quantities, changes):
+    """
+    Apply cart ``changes`` to ``quantities`` ({product_id: quantity}) in
+    place. Each change is a dict with a ``product_id``, an ``action`` and a
+    ``quantity``:
+
+      - ``add``: add ``quantity`` to the line, creating it if needed,
+      - ``set``: set the line quantity, 0 removes it,
+      - ``remove``: remove the line.
+
+    Removed lines are left with a quantity of 0.
+    """
+    for change in changes:
+        product_id, action = change['product_id'], change['action']
+        if action == 'add':
+            quantities[product_id] = quantities.get(product_id, 0) + change['quantity']
+        elif action == 'set':
+            quantities[product_id] = change['quantity']
+        else:
+            quantities[product_id] = 0
+    return quantities
+
+
+def net_changes(changes):
+    """
+    Fold cart ``changes`` (see apply_changes) into one change per product:
+    ``{product_id: (quantity, increment)}``, the quantity the line is set to
+    (None when it is only added to) plus the quantity added after that.
+    """
+    lines = {}
+    for change in changes:
+        product_id, action = change['product_id'], change['action']
+        quantity, increment = lines.get(product_id, (None, 0))
+        if action == 'add':
+            lines[product_id] = (quantity, increment + change['quantity'])
+        elif action == 'set':
+            lines[product_id] = (change['quantity'], 0)
+        else:
+            lines[product_id] = (0, 0)
+    return lines
+
+
+def update_cart(user, changes):
+    """
+    Apply ``changes`` (see apply_changes) to the user's cart in one
+    transaction, in order.
+
+    The cart row is locked and the prices and current quantities of the
+    products involved are read with one query. Lines only added to are then
+    incremented by the database (``quantity + n``, after inserting the
+    missing ones empty), never from the quantity read: select_for_update()
+    locks nothing on SQLite. The other lines are written with one upsert on
+    (cart, product) and one delete, whatever the number of changes. Line
+    totals use the current product prices.
+    """
+    lines = net_changes(changes)
+
+    with transaction.atomic(), batch_totals():
+        cart = Cart.objects.select_for_update().filter(user=user).first()
+        if cart is None:
+            cart = Cart.objects.create(user=user)
+
+        in_cart = CartItem.objects.filter(cart=cart, product_id=OuterRef('pk')).values('quantity')
+        rows = Product.objects.filter(id__in=lines).values_list('id', 'price', Subquery(in_cart))
+        prices, existing = {}, set()
+        for product_id, price, quantity in rows:
+            prices[product_id] = price
+            if quantity is not None:
+                existing.add(product_id)
+        missing = lines.keys() - prices.keys()
+        if missing:
+            raise CartError(f"Product does not exist: {', '.join(str(id) for id in sorted(missing))}")
+
+        increments = {product_id: increment for product_id, (quantity, increment) in lines.items() if quantity is None}
+        new = [
+            CartItem(cart=cart, product_id=product_id, quantity=0, total=0)
+            for product_id in increments if product_id not in existing
+        ]
+        if new:
+            CartItem.objects.bulk_create(new, ignore_conflicts=True)
+        if increments:
+            increment = Case(*[When(product_id=product_id, then=Value(n)) for product_id, n in increments.items()])
+            price = Case(*[When(product_id=product_id, then=Value(prices[product_id])) for product_id in increments])
+            CartItem.objects.filter(cart=cart, product_id__in=increments).update(
+                quantity=F('quantity') + increment, total=(F('quantity') + increment) * price,
+            )
+
+        quantities = {
+            product_id: quantity + increment
+            for product_id, (quantity, increment) in lines.items() if quantity is not None
+        }
+        updated = [
+            CartItem(cart=cart, product_id=product_id, quantity=quantity, total=prices[product_id] * quantity)
+            for product_id, quantity in quantities.items() if quantity > 0
+        ]
+        if updated:
+            CartItem.objects.bulk_create(updated, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity', 'total'])
+        removed = [product_id for product_id, quantity in quantities.items() if quantity <= 0]
+        if removed:
+            CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+
+        # Neither bulk_create nor update send signals
+        cart_items_changed(cart.pk)
+    return cart
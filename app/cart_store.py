@@ -0,0 +1,238 @@
+# cart_store.py
+#
+# Where the cart API reads and writes carts, chosen with the CART_STORE
+# setting:
+#
+#   - DatabaseCartStore (default): every change is written to Cart/CartItem.
+#   - CacheCartStore: the live cart is kept in the CART_CACHE cache and
+#     changes are written behind, in one batch per cart: on the first change
+#     after CART_FLUSH_INTERVAL seconds, by ``manage.py flush_carts`` (shared
+#     caches only) and, durably, before checkout.
+#
+# With CacheCartStore, changes not flushed yet are lost if the cache loses
+# the entry (eviction, restart of a locmem cache). Size the cache so carts
+# are not culled, and keep the flush interval short.
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .cart import CartError, apply_changes, update_cart
+from .models import Cart, CartItem, Product
+
+logger = logging.getLogger(__name__)
+
+
+def get_store():
+    return import_string(settings.CART_STORE)()
+
+
+class DatabaseCartStore:
+
+    def items(self, user):
+        """ The cart lines, with their product, None without a cart. """
+        items = list(CartItem.objects.filter(cart__user=user).select_related('product'))
+        if not items and not Cart.objects.filter(user=user).exists():
+            return None
+        return items
+
+    def summary(self, user):
+        """ (item count, subtotal), None without a cart. """
+        return Cart.objects.filter(user=user).values_list('item_count', 'subtotal').first()
+
+    # Async versions of the reads, for the async views. Writes need
+    # transactions and run in a thread (sync_to_async).
+
+    async def aitems(self, user):
+        items = [item async for item in CartItem.objects.filter(cart__user=user).select_related('product')]
+        if not items and not await Cart.objects.filter(user=user).aexists():
+            return None
+        return items
+
+    async def asummary(self, user):
+        return await Cart.objects.filter(user=user).values_list('item_count', 'subtotal').afirst()
+
+    def update(self, user, changes):
+        update_cart(user, changes)
+
+    def remove(self, user, cartitem_id=None, product_id=None):
+        """ Remove a line, by id or product. Returns whether the cart had it. """
+        lines = CartItem.objects.filter(cart__user=user)
+        lines = lines.filter(id=cartitem_id) if cartitem_id is not None else lines.filter(product_id=product_id)
+        line = lines.first()
+        if line is None:
+            return False
+        line.delete()
+        return True
+
+    def checkout(self, user, place_order):
+        """ ``place_order()``, with the cart written to the database and, in the cache store, locked. """
+        return place_order()
+
+
+class CacheCartStore:
+    # Changes to a cart (load, modify, store) are made holding its lock, an
+    # entry added with cache.add(), which only one client can add. A lock left
+    # by a crashed process expires after LOCK_TIMEOUT seconds.
+    LOCK_TIMEOUT = 10
+    LOCK_POLL_INTERVAL = 0.01
+    # User ids of the carts changed since the last flush_pending(), changed
+    # holding the lock of the same name
+    DIRTY = 'cart:dirty'
+
+    def __init__(self):
+        self.cache = caches[settings.CART_CACHE]
+        self.flush_interval = settings.CART_FLUSH_INTERVAL
+
+    def key(self, user_id):
+        return f"cart:{user_id}"
+
+    @contextmanager
+    def lock(self, name):
+        key, token = f"cart:lock:{name}", uuid.uuid4().hex
+        while not self.cache.add(key, token, self.LOCK_TIMEOUT):
+            time.sleep(self.LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            if self.cache.get(key) == token:
+                self.cache.delete(key)
+
+    def load(self, user):
+        state = self.cache.get(self.key(user.pk))
+        if state is None:
+            cart = Cart.objects.filter(user=user).first() or Cart.objects.create(user=user)
+            state = {
+                'cart_id': cart.pk,
+                # product id -> [cart item id or None, quantity, total], a quantity of 0 is a removal not flushed yet
+                'lines': {
+                    product_id: [id, quantity, total]
+                    for id, product_id, quantity, total in CartItem.objects.filter(cart=cart).order_by('id').values_list('id', 'product_id', 'quantity', 'total')
+                },
+                'dirty': [],
+                'dirty_since': None,
+            }
+            # Reads load without the lock: never replace a state stored meanwhile
+            if not self.cache.add(self.key(user.pk), state, None):
+                state = self.cache.get(self.key(user.pk), state)
+        return state
+
+    def save(self, user, state, changed):
+        """ Store ``state`` after a change of the ``changed`` products, holding the cart's lock. """
+        if state['dirty_since'] is None:
+            state['dirty_since'] = time.time()
+            self.register_dirty(user.pk)
+        state['dirty'] = sorted(set(state['dirty']) | set(changed))
+        self.cache.set(self.key(user.pk), state, None)
+        if time.time() - state['dirty_since'] >= self.flush_interval:
+            self.write(user, state)
+
+    def register_dirty(self, user_id):
+        with self.lock(self.DIRTY):
+            self.cache.set(self.DIRTY, self.cache.get(self.DIRTY, set()) | {user_id}, None)
+
+    def items(self, user):
+        state = self.load(user)
+        lines = [(product_id, line) for product_id, line in state['lines'].items() if line[1] > 0]
+        products = Product.objects.in_bulk([product_id for product_id, line in lines])
+        return [
+            CartItem(id=id, cart_id=state['cart_id'], product=products[product_id], quantity=quantity, total=total)
+            for product_id, (id, quantity, total) in lines
+            if product_id in products
+        ]
+
+    def summary(self, user):
+        lines = self.load(user)['lines'].values()
+        return sum(quantity for id, quantity, total in lines), sum(total for id, quantity, total in lines)
+
+    # load() may create the cart, in a thread
+    async def aitems(self, user):
+        return await sync_to_async(self.items)(user)
+
+    async def asummary(self, user):
+        return await sync_to_async(self.summary)(user)
+
+    def update(self, user, changes):
+        product_ids = {change['product_id'] for change in changes}
+        prices = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'price'))
+        missing = product_ids - prices.keys()
+        if missing:
+            raise CartError(f"Product does not exist: {', '.join(str(id) for id in sorted(missing))}")
+
+        with self.lock(user.pk):
+            state = self.load(user)
+            lines = state['lines']
+            quantities = apply_changes({product_id: lines[product_id][1] for product_id in product_ids if product_id in lines}, changes)
+            for product_id, quantity in quantities.items():
+                id = lines[product_id][0] if product_id in lines else None
+                lines[product_id] = [id, quantity, prices[product_id] * quantity]
+            self.save(user, state, quantities)
+
+    def remove(self, user, cartitem_id=None, product_id=None):
+        with self.lock(user.pk):
+            state = self.load(user)
+            for line_product_id, line in state['lines'].items():
+                if line[1] > 0 and (line[0] == cartitem_id if cartitem_id is not None else line_product_id == product_id):
+                    line[1] = line[2] = 0
+                    self.save(user, state, [line_product_id])
+                    return True
+        return False
+
+    def flush(self, user):
+        """ Write the changes of the user's cart to the database with one update_cart. """
+        with self.lock(user.pk):
+            self.flush_locked(user)
+
+    def flush_locked(self, user):
+        # flush() for callers holding the cart's lock, which is not reentrant
+        state = self.cache.get(self.key(user.pk))
+        if state and state['dirty']:
+            self.write(user, state)
+
+    def write(self, user, state):
+        # Holding the cart's lock, so the state cannot change before it is dropped
+        lines = state['lines']
+        update_cart(user, [{'product_id': product_id, 'action': 'set', 'quantity': lines[product_id][1]} for product_id in state['dirty']])
+        # Reloaded from the database on next use, with the ids of new lines
+        self.cache.delete(self.key(user.pk))
+
+    def flush_pending(self):
+        """
+        Flush every cart changed since the last call. Returns the number of
+        carts flushed. Carts that fail to flush are logged and flushed again
+        on the next call.
+        """
+        with self.lock(self.DIRTY):
+            user_ids = self.cache.get(self.DIRTY, set())
+            self.cache.delete(self.DIRTY)
+        failed = set()
+        for user_id in user_ids:
+            try:
+                self.flush(User(pk=user_id))
+            except Exception:
+                logger.exception("Flushing the cart of user %s failed", user_id)
+                failed.add(user_id)
+        if failed:
+            # Their states keep dirty_since, save() would not register them again
+            with self.lock(self.DIRTY):
+                self.cache.set(self.DIRTY, self.cache.get(self.DIRTY, set()) | failed, None)
+        return len(user_ids) - len(failed)
+
+    def checkout(self, user, place_order):
+        """
+        ``place_order()`` holding the cart's lock, after writing the cart to
+        the database, then forget the cached cart emptied by the order. No
+        change can land in between, to be dropped with the cached cart or to
+        bring back the ordered lines.
+        """
+        with self.lock(user.pk):
+            self.flush_locked(user)
+            order = place_order()
+            self.cache.delete(self.key(user.pk))
+        return order
@@ -0,0 +1,166 @@
+# catalog_cache.py
+#
+# Versioned read-through cache for catalog payloads (categories, product
+# listings and product details).
+#
+# Every cached payload is stored under a key that embeds the current version
+# of each scope it depends on, e.g. ``category:<slug>`` or ``product:<slug>``.
+# Invalidation never deletes payloads, it only bumps the version of a scope,
+# so the next read computes a new key and stale entries simply age out.
+#
+# Versions are clock based (nanoseconds), so a version is never handed out
+# twice even when a scope is evicted. The payload's ETag is its cache key
+# digest (see etag()). There is no Last-Modified: a payload of several scopes
+# has no single change time, and one in whole seconds would answer 304 to a
+# client that read the previous version in the same second.
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import async_cache
+
+KEY_PREFIX = 'catalog'
+
+# Well known scopes
+CATEGORIES = 'categories'
+PRODUCTS = 'products'
+
+
+def category_scope(slug):
+    return f"category:{slug}"
+
+
+def product_scope(slug):
+    return f"product:{slug}"
+
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def stats():
+    """ Hit/miss counters of this process. """
+    with _stats_lock:
+        return {'hits': _stats['hits'], 'misses': _stats['misses']}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _version_key(scope):
+    return f"{KEY_PREFIX}:ver:{scope}"
+
+
+def _new_version():
+    # Seed versions from the clock so that a version key that was evicted never
+    # comes back with a number that still points at an old payload.
+    return time.time_ns()
+
+
+def get_versions(*scopes):
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = cache.get_many(keys.keys())
+    versions = {}
+    for key, scope in keys.items():
+        if key not in found:
+            version = _new_version()
+            cache.add(key, version, timeout=None)
+            found[key] = cache.get(key, version)
+        versions[scope] = found[key]
+    return versions
+
+
+async def aget_versions(*scopes):
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = await async_cache.aget_many(keys.keys())
+    versions = {}
+    for key, scope in keys.items():
+        if key not in found:
+            version = _new_version()
+            await async_cache.aadd(key, version, timeout=None)
+            found[key] = await async_cache.aget(key, version)
+        versions[scope] = found[key]
+    return versions
+
+
+def bump(*scopes):
+    """ Invalidate every payload depending on any of ``scopes``. """
+    for scope in set(scopes):
+        key = _version_key(scope)
+        # The time of the change, and always a new number even if clocks disagree
+        cache.set(key, max(cache.get(key, 0) + 1, _new_version()), timeout=None)
+
+
+def _digest(scopes, key, versions):
+    signature = '.'.join(f"{versions[scope]}" for scope in scopes)
+    return hashlib.md5(f"{key}|{signature}".encode()).hexdigest()
+
+
+def _data_key(scopes, key, versions):
+    return f"{KEY_PREFIX}:data:{_digest(scopes, key, versions)}"
+
+
+def changed_within(versions, seconds):
+    """ Whether any of ``versions`` was bumped (or first seen) less than ``seconds`` ago. """
+    return time.time_ns() - max(versions.values()) < seconds * 10**9
+
+
+def etag(scopes, key, versions):
+    """ The ETag of the payload of ``key`` at ``versions``. """
+    return f'"{_digest(scopes, key, versions)}"'
+
+
+def get_or_build(scopes, key, build, versions=None, store=True):
+    """
+    Return ``(payload, hit)`` for ``key``, building and storing the payload
+    with ``build()`` if there is no entry for the current scope versions
+    (``versions``, when the caller already has them). With ``store=False`` a
+    built payload is not stored.
+    """
+    data_key = _data_key(scopes, key, versions or get_versions(*scopes))
+
+    payload = cache.get(data_key)
+    if payload is not None:
+        _record('hits')
+        return payload, True
+
+    _record('misses')
+    payload = build()
+    if store:
+        cache.set(data_key, payload, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return payload, False
+
+
+async def aget(scopes, key, versions=None):
+    """ The cached payload for ``key``, or None. A miss is left to the caller to build and count. """
+    payload = await async_cache.aget(_data_key(scopes, key, versions or await aget_versions(*scopes)))
+    if payload is not None:
+        _record('hits')
+    return payload
+
+
+async def aget_or_build(scopes, key, build, versions=None, store=True):
+    """ get_or_build() for async views, ``build`` is a coroutine function. """
+    data_key = _data_key(scopes, key, versions or await aget_versions(*scopes))
+
+    payload = await async_cache.aget(data_key)
+    if payload is not None:
+        _record('hits')
+        return payload, True
+
+    _record('misses')
+    payload = await build()
+    if store:
+        await async_cache.aset(data_key, payload, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return payload, False
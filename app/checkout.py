@@ -0,0 +1,67 @@
+# checkout.py
+from django.db import transaction
+from django.db.models import F, Sum
+
+from . import analytics, payments
+from .cart import batch_totals
+from .models import Address, Cart, CartItem, Order, OrderItem
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def place_order(user, address_id, payment_mode):
+    """
+    Turn the user's cart into a pending order in one transaction.
+
+    The cart row is locked first, so a second submit of the same cart waits
+    for the first one and then finds the cart empty. Totals are computed by
+    the database and the order items are written with a single bulk insert,
+    so the number of queries does not depend on the number of cart lines.
+
+    Online payments get a payment outbox entry in the same transaction, the
+    gateway order is created later by the payment worker. The sales rollups
+    are updated with one upsert for the order and its lines.
+    """
+    with transaction.atomic(), batch_totals(), analytics.batch_rollups():
+        try:
+            cart = Cart.objects.select_for_update().get(user=user)
+        except Cart.DoesNotExist:
+            raise CheckoutError("Cart not found")
+
+        try:
+            address = Address.objects.get(id=address_id, user=user)
+        except Address.DoesNotExist:
+            raise CheckoutError("Select the address")
+
+        lines = CartItem.objects.filter(cart=cart).annotate(line_total=F('product__price') * F('quantity'))
+        grand_total = lines.aggregate(grand_total=Sum('line_total'))['grand_total']
+
+        if grand_total is None:
+            raise CheckoutError("Cart is empty")
+
+        order = Order.objects.create(
+            user=user,
+            total=grand_total,
+            status='Pending',  # Initial status
+            amount_due=grand_total,
+            amount_paid=0,
+            address=address,
+            payment_mode=payment_mode,
+        )
+
+        rows = list(lines.values_list('product_id', 'product__category_id', 'product__seller_id', 'quantity', 'line_total'))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, quantity=quantity, total=line_total)
+            for product_id, category_id, seller_id, quantity, line_total in rows
+        ])
+        # bulk_create sends no signals, count the lines in the sales rollups here
+        analytics.record_items(order, rows)
+
+        CartItem.objects.filter(cart=cart).delete()
+
+        if payment_mode == 'Online Payment':
+            payments.enqueue(order)
+
+    return order
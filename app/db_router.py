@@ -0,0 +1,84 @@
+# db_router.py
+#
+# Read/write splitting between the "default" database and an optional
+# "replica" alias (REPLICA_DATABASE_URL), a read-only copy of it.
+#
+#   - Writes always go to default.
+#   - Reads go to default too, except inside ``replica_reads()``, which the
+#     read-only API views enter for safe requests (ReplicaReadMixin).
+#   - Catalog pages read from the replica less than REPLICA_STICKY_SECONDS
+#     after a catalog change are not stored in the catalog cache, as the
+#     replica may not have the change yet (views.catalog_response).
+#   - A user who just wrote (any successful unsafe request) reads from default
+#     for REPLICA_STICKY_SECONDS, so they see their own writes despite the
+#     replication lag (ReplicaStickinessMiddleware).
+#
+# Without a replica alias everything runs on default.
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import async_cache
+
+REPLICA = 'replica'
+
+# A context variable rather than a thread local so async views route their own reads
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA in connections.settings
+
+
+@contextmanager
+def replica_reads():
+    """ Send the reads made inside the block to the replica, when there is one. """
+    token = _use_replica.set(replica_configured())
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def reading_replica():
+    """ Whether the reads of the current request go to the replica. """
+    return _use_replica.get()
+
+
+def _sticky_key(user_id):
+    return f"db:sticky:{user_id}"
+
+
+def mark_written(user):
+    """ Read ``user``'s requests from default for the next REPLICA_STICKY_SECONDS. """
+    cache.set(_sticky_key(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+
+
+async def amark_written(user):
+    await async_cache.aset(_sticky_key(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(user):
+    return user.is_authenticated and cache.get(_sticky_key(user.pk), False)
+
+
+async def ais_sticky(user):
+    return user.is_authenticated and await async_cache.aget(_sticky_key(user.pk), False)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if reading_replica():
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both aliases
+        return True
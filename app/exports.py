@@ -0,0 +1,190 @@
+# exports.py
+#
+# Streaming CSV and NDJSON exports of orders (with their items), products and
+# enquiries, for the admin actions and `manage.py export_data`.
+#
+# Rows are read with QuerySet.iterator(chunk_size), which fetches chunk_size
+# rows at a time (and, for orders, their items with one query per chunk), and
+# are written out one line at a time, so memory use does not depend on the
+# number of rows exported.
+import csv
+import json
+
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Enquiry, Order, OrderItem, Product
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+CHUNK_SIZE = 2000
+
+
+def _getter(path):
+    """ attrgetter(path), None when a relation on the way is empty (e.g. an enquiry without a user). """
+    names = path.split('.')
+
+    def get(obj):
+        for name in names:
+            if obj is None:
+                return None
+            obj = getattr(obj, name)
+        return obj
+
+    return get
+
+
+class Export:
+    """
+    An exportable model: its columns, as (name, attribute path) pairs, and
+    optionally child rows (``items``) exported with each row.
+    """
+
+    def __init__(self, model, columns, select_related=(), items=None):
+        self.model = model
+        self.columns = [(name, _getter(path)) for name, path in columns]
+        self.select_related = select_related
+        self.items = items
+
+    def queryset(self, queryset=None):
+        queryset = self.model.objects.all() if queryset is None else queryset
+        queryset = queryset.select_related(*self.select_related).order_by('id')
+        if self.items:
+            queryset = queryset.prefetch_related(Prefetch(self.items.relation, queryset=self.items.queryset()))
+        return queryset
+
+    def header(self):
+        names = [name for name, getter in self.columns]
+        if self.items:
+            names += [name for name, getter in self.items.columns]
+        return names
+
+    def row(self, obj):
+        return {name: getter(obj) for name, getter in self.columns}
+
+
+class Items(Export):
+    def __init__(self, model, relation, columns, select_related=()):
+        super().__init__(model, columns, select_related)
+        self.relation = relation
+
+    def queryset(self):
+        return self.model.objects.select_related(*self.select_related).order_by('id')
+
+
+EXPORTS = {
+    'orders': Export(
+        Order,
+        [
+            ('order_id', 'id'), ('date', 'date'), ('status', 'status'), ('payment_mode', 'payment_mode'),
+            ('username', 'user.username'), ('email', 'user.email'), ('city', 'address.city'), ('pincode', 'address.pincode'),
+            ('total', 'total'), ('amount_paid', 'amount_paid'), ('amount_due', 'amount_due'), ('razorpay_order_id', 'razorpay_order_id'),
+        ],
+        select_related=('user', 'address'),
+        items=Items(
+            OrderItem, 'orderitem_set',
+            [('item_id', 'id'), ('product_id', 'product_id'), ('product', 'product.name'), ('quantity', 'quantity'), ('item_total', 'total')],
+            select_related=('product',),
+        ),
+    ),
+    'products': Export(
+        Product,
+        [
+            ('id', 'id'), ('name', 'name'), ('slug', 'slug'), ('price', 'price'), ('category', 'category.name'),
+            ('seller', 'seller.name'), ('image', 'image.name'), ('description', 'description'),
+        ],
+        select_related=('category', 'seller'),
+    ),
+    'enquiries': Export(
+        Enquiry,
+        [
+            ('id', 'id'), ('date', 'date'), ('username', 'user.username'), ('name', 'name'), ('email', 'email'),
+            ('subject', 'subject'), ('message', 'message'),
+        ],
+        select_related=('user',),
+    ),
+}
+
+
+def _value(value):
+    if value is None:
+        return ''
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+# Cells starting with these are formulas for spreadsheet applications
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_value(value):
+    value = _value(value)
+    # User text (e.g. an enquiry message) that starts like a formula gets a
+    # leading quote, so a spreadsheet shows it instead of evaluating it
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class _Echo:
+    """ File-like object handing back what csv.writer writes to it. """
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(export, objects):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(export.header())
+    for obj in objects:
+        row = [_csv_value(value) for value in export.row(obj).values()]
+        if not export.items:
+            yield writer.writerow(row)
+            continue
+        # One line per item, the order columns repeated
+        items = getattr(obj, export.items.relation).all()
+        if not items:
+            yield writer.writerow(row + [''] * len(export.items.columns))
+        for item in items:
+            yield writer.writerow(row + [_csv_value(value) for value in export.items.row(item).values()])
+
+
+def _ndjson_lines(export, objects):
+    for obj in objects:
+        row = export.row(obj)
+        if export.items:
+            row['items'] = [export.items.row(item) for item in getattr(obj, export.items.relation).all()]
+        yield json.dumps(row, default=_value) + '\n'
+
+
+def lines(name, format, queryset=None, chunk_size=CHUNK_SIZE):
+    """ The lines of the ``format`` export of ``name`` (of ``queryset``, or every row). """
+    export = EXPORTS[name]
+    objects = export.queryset(queryset).iterator(chunk_size=chunk_size)
+    return _csv_lines(export, objects) if format == 'csv' else _ndjson_lines(export, objects)
+
+
+def filename(name, format):
+    return f"{name}-{timezone.localtime():%Y%m%d-%H%M%S}.{FORMATS[format][1]}"
+
+
+def streaming_response(name, format, queryset=None):
+    response = StreamingHttpResponse(lines(name, format, queryset), content_type=FORMATS[format][0])
+    response['Content-Disposition'] = f'attachment; filename="{filename(name, format)}"'
+    return response
+
+
+def admin_actions(name):
+    """ Admin actions exporting the selected rows as CSV and NDJSON. """
+    actions = []
+    for format in FORMATS:
+        def action(modeladmin, request, queryset, format=format):
+            return streaming_response(name, format, queryset)
+        action.__name__ = f"export_{format}"
+        action.short_description = f"Export selected {EXPORTS[name].model._meta.verbose_name_plural} as {format.upper()}"
+        action.allowed_permissions = ('view',)
+        actions.append(action)
+    return actions
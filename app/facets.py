@@ -0,0 +1,111 @@
+# facets.py
+#
+# Facet counts for the product listing. ProductFacet holds one row per
+# (category, seller, price bucket) with the number of products in it, kept
+# up to date by the Product signals. Counts for any combination of filters
+# are then grouped from that small table instead of the catalog.
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+
+from .models import Product, ProductFacet
+
+# (key, label, lower bound inclusive, upper bound exclusive)
+PRICE_BUCKETS = (
+    ('under-500', 'Under 500', None, 500),
+    ('500-1000', '500 - 1000', 500, 1000),
+    ('1000-1500', '1000 - 1500', 1000, 1500),
+    ('1500-plus', '1500 and above', 1500, None),
+)
+
+
+def price_bucket(price):
+    for key, label, lower, upper in PRICE_BUCKETS:
+        if (lower is None or price >= lower) and (upper is None or price < upper):
+            return key
+
+
+def price_bucket_filter(key, field='price'):
+    """ Q object selecting the prices of bucket ``key``, None for an unknown key. """
+    for bucket_key, label, lower, upper in PRICE_BUCKETS:
+        if bucket_key == key:
+            q = Q()
+            if lower is not None:
+                q &= Q(**{f'{field}__gte': lower})
+            if upper is not None:
+                q &= Q(**{f'{field}__lt': upper})
+            return q
+
+
+def price_bucket_expression(field='price'):
+    return Case(
+        *[When(price_bucket_filter(key, field), then=Value(key)) for key, *_ in PRICE_BUCKETS],
+        output_field=CharField(),
+    )
+
+
+def facet_key(category_id, seller_id, price):
+    return category_id, seller_id, price_bucket(price)
+
+
+def increment(category_id, seller_id, bucket):
+    cells = ProductFacet.objects.filter(category_id=category_id, seller_id=seller_id, price_bucket=bucket)
+    if cells.update(count=F('count') + 1):
+        return
+    try:
+        with transaction.atomic():
+            ProductFacet.objects.create(category_id=category_id, seller_id=seller_id, price_bucket=bucket, count=1)
+    except IntegrityError:
+        # Created concurrently
+        cells.update(count=F('count') + 1)
+
+
+def decrement(category_id, seller_id, bucket):
+    # Never creates a row, the category or seller may be in the middle of a cascade delete
+    ProductFacet.objects.filter(category_id=category_id, seller_id=seller_id, price_bucket=bucket).update(count=F('count') - 1)
+
+
+def rebuild():
+    """ Recount every facet from the catalog. """
+    with transaction.atomic():
+        ProductFacet.objects.all().delete()
+        rows = (
+            Product.objects.order_by()
+            .values('category_id', 'seller_id', bucket=price_bucket_expression())
+            .annotate(products=Count('id'))
+        )
+        ProductFacet.objects.bulk_create(
+            [ProductFacet(category_id=row['category_id'], seller_id=row['seller_id'], price_bucket=row['bucket'], count=row['products']) for row in rows],
+            batch_size=1000,
+        )
+    return ProductFacet.objects.count()
+
+
+def counts(category=None, seller=None, price=None):
+    """
+    Facet counts for the listing filtered on category slug, seller slug and
+    price bucket. Each facet is counted with the filters on the other facets
+    applied, so selecting a value does not hide its alternatives.
+    """
+    cells = ProductFacet.objects.filter(count__gt=0)
+    filters = {
+        'category': Q(category__slug=category) if category else Q(),
+        'seller': Q(seller__slug=seller) if seller else Q(),
+        'price': Q(price_bucket=price) if price else Q(),
+    }
+
+    def others(facet):
+        q = Q()
+        for name, condition in filters.items():
+            if name != facet:
+                q &= condition
+        return cells.filter(q)
+
+    category_counts = others('category').values('category__slug', 'category__name').annotate(products=Sum('count')).order_by('category__name')
+    seller_counts = others('seller').values('seller__slug', 'seller__name').annotate(products=Sum('count')).order_by('seller__name')
+    price_counts = dict(others('price').values_list('price_bucket').annotate(products=Sum('count')).order_by())
+
+    return {
+        'category': [{'value': row['category__slug'], 'label': row['category__name'], 'count': row['products']} for row in category_counts],
+        'seller': [{'value': row['seller__slug'], 'label': row['seller__name'], 'count': row['products']} for row in seller_counts],
+        'price': [{'value': key, 'label': label, 'count': price_counts.get(key, 0)} for key, label, *_ in PRICE_BUCKETS],
+    }
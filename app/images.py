@@ -0,0 +1,234 @@
+# images.py
+#
+# Precomputed image variants. Every uploaded image gets a thumb, card and
+# detail sized copy, each as JPEG and WebP, next to the original:
+#
+#   product_pics/shoe.png -> product_pics/variants/shoe_thumb.jpg
+#                            product_pics/variants/shoe_thumb.webp ...
+#
+# Variant names derive from the original name, so the API can link them
+# without storing anything. They are generated with Pillow in a process pool
+# after the upload is committed (see the image signals) and, for existing
+# media, by ``manage.py generate_image_variants``. The worker functions only
+# get file paths, never touch the database and do not need Django set up.
+#
+# The API links the variants only once they all exist, the original image
+# stands in for them until then (generation pending or failed, images not
+# uploaded through the API) and on storages without local files.
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# name -> bounding box, images are scaled down to fit and never scaled up
+VARIANTS = {
+    'thumb': (150, 150),
+    'card': (400, 400),
+    'detail': (1000, 1000),
+}
+
+# format -> (file extension, Pillow save options)
+FORMATS = {
+    'jpeg': ('jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+}
+
+
+def _variant_stem(name):
+    directory, filename = os.path.split(name)
+    return os.path.join(directory, 'variants', os.path.splitext(filename)[0])
+
+
+def variant_name(name, variant, format):
+    return f"{_variant_stem(name)}_{variant}.{FORMATS[format][0]}"
+
+
+def variant_names(name):
+    return [variant_name(name, variant, format) for variant in VARIANTS for format in FORMATS]
+
+
+def variant_urls(name, build_url=None, url=None):
+    """
+    {'thumb': {'jpeg': url, 'webp': url}, 'card': ..., 'detail': ...} for the
+    image ``name``, the URL of the original for every variant until they have
+    been generated. ``url`` maps a file name to its URL, default_storage.url()
+    (made absolute with ``build_url``) by default.
+    """
+    if not name:
+        return None
+    if url is None:
+        url = (lambda file: build_url(default_storage.url(file))) if build_url else default_storage.url
+    if not has_variants(name):
+        original = url(name)
+        return {variant: {format: original for format in FORMATS} for variant in VARIANTS}
+    stem = _variant_stem(name)
+    return {
+        variant: {format: url(f"{stem}_{variant}.{extension}") for format, (extension, options) in FORMATS.items()}
+        for variant in VARIANTS
+    }
+
+
+def _is_stale(path, variant_paths):
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return False  # no original, nothing to generate
+    for variant_path in variant_paths:
+        try:
+            if os.path.getmtime(variant_path) < modified:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def local_storage():
+    """ Whether the default storage keeps files on this machine: generating variants needs their paths. """
+    try:
+        default_storage.path('')
+    except NotImplementedError:
+        return False
+    return True
+
+
+def _paths(name):
+    return default_storage.path(name), [default_storage.path(variant) for variant in variant_names(name)]
+
+
+def needs_variants(name):
+    """ Whether the original exists and some of its variants are missing or older than it. """
+    if not name:
+        return False
+    return _is_stale(*_paths(name))
+
+
+# Originals (paths) whose variants all exist, they are never deleted
+_generated = set()
+MAX_GENERATED = 100000
+
+
+def has_variants(name):
+    """ Whether every variant of ``name`` has been generated. Always False on storages without local files. """
+    if not local_storage():
+        return False
+    path = default_storage.path(name)
+    if path in _generated:
+        return True
+    if not all(os.path.exists(default_storage.path(variant)) for variant in variant_names(name)):
+        return False
+    if len(_generated) >= MAX_GENERATED:
+        _generated.clear()
+    _generated.add(path)
+    return True
+
+
+def generate(path, variant_paths, force=False):
+    """
+    Write every variant of the image at ``path``. Runs in the worker
+    processes. Returns the number of files written, 0 when up to date.
+    """
+    from PIL import Image, ImageOps
+
+    if not force and not _is_stale(path, variant_paths):
+        return 0
+
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha channel: flatten transparent images on white
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        os.makedirs(os.path.dirname(variant_paths[0]), exist_ok=True)
+        written = iter(variant_paths)
+        for size in VARIANTS.values():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            for format, (extension, options) in FORMATS.items():
+                target = next(written)
+                # Write then rename, readers never see a half written file
+                resized.save(f"{target}.tmp", format=format.upper(), **options)
+                os.replace(f"{target}.tmp", target)
+    return len(variant_paths)
+
+
+def _generate_task(task):
+    path, variant_paths, force = task
+    try:
+        return generate(path, variant_paths, force)
+    except Exception as e:
+        # Corrupt or unsupported files must not stop a backfill
+        logger.warning("Could not generate variants of %s: %s", path, e)
+        return -1
+
+
+def create_pool(workers=None):
+    # spawn: the workers never inherit the server's threads, locks or database connections
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool(settings.IMAGE_WORKERS)
+        return _pool
+
+
+def _log_failure(future):
+    if future.exception():
+        logger.error("Image variant generation failed: %s", future.exception())
+
+
+def schedule(name, on_generated=None):
+    """
+    Generate the variants of ``name`` once the current transaction commits,
+    then call ``on_generated()`` (in a thread of this process) if given.
+    """
+    if not local_storage() or not needs_variants(name):
+        return
+
+    def done(written):
+        if written > 0 and on_generated is not None:
+            on_generated()
+
+    def submit():
+        task = (*_paths(name), False)
+        if settings.IMAGE_WORKERS:
+            future = get_pool().submit(_generate_task, task)
+            future.add_done_callback(_log_failure)
+            future.add_done_callback(lambda future: future.exception() or done(future.result()))
+        else:
+            done(_generate_task(task))
+
+    transaction.on_commit(submit)
+
+
+def backfill(names, workers=None, force=False, batch_size=1000):
+    """
+    Generate the variants of ``names`` in a process pool. Yields one result
+    per name: files written, 0 if up to date, -1 on error. Names are submitted
+    ``batch_size`` at a time so huge media libraries are not queued at once.
+    """
+    names = iter(names)
+    with create_pool(workers) as pool:
+        while True:
+            batch = [(*_paths(name), force) for _, name in zip(range(batch_size), names)]
+            if not batch:
+                break
+            yield from pool.map(_generate_task, batch, chunksize=max(len(batch) // (4 * (workers or os.cpu_count() or 1)), 1))
@@ -0,0 +1,131 @@
+import json
+import threading
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connection
+
+from app import benchmark
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def count_queries(application):
+    """ WSGI wrapper reporting the number of SQL queries of each request in a response header. """
+    def wrapped(environ, start_response):
+        counter = QueryCounter()
+
+        def counting_start_response(status, headers, exc_info=None):
+            if not any(name == benchmark.SQL_QUERIES_HEADER for name, value in headers):
+                headers = headers + [(benchmark.SQL_QUERIES_HEADER, str(counter.count))]
+            return start_response(status, headers, exc_info)
+
+        with connection.execute_wrapper(counter):
+            return application(environ, counting_start_response)
+    return wrapped
+
+
+def customer_credentials(count, password):
+    """ (username, password) of up to ``count`` seeded customers who can check out. """
+    usernames = list(
+        User.objects.filter(is_staff=False, seller__isnull=True, address__isnull=False)
+        .distinct().order_by('id').values_list('username', flat=True)[:count]
+    )
+    if not usernames:
+        raise CommandError("No customers with an address found, seed the database first (manage.py seed_data)")
+    return [(username, password) for username in usernames]
+
+
+class Command(BaseCommand):
+    help = "Replay a browse/cart/checkout/orders traffic mix against the API and report latency, throughput and SQL queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server. Without it an in-process server is started on this database")
+        parser.add_argument('--users', type=int, default=20, help="Seeded customers to log in as (password 'password123')")
+        parser.add_argument('--password', default='password123')
+        parser.add_argument('--concurrency', type=int, default=10, help="Virtual users sending requests in parallel")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds of measured traffic")
+        parser.add_argument('--warmup', type=float, default=5, help="Seconds of unmeasured traffic first")
+        parser.add_argument('--mix', default=','.join(f"{name}={weight}" for name, weight in benchmark.DEFAULT_MIX.items()),
+                            help="Scenario weights, e.g. browse=60,cart=20,checkout=5,orders=15")
+        parser.add_argument('--payment-mode', default='Cash on Delivery', choices=['Cash on Delivery', 'Online Payment'])
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        try:
+            mix = benchmark.parse_mix(options['mix'])
+        except benchmark.BenchmarkError as e:
+            raise CommandError(e)
+
+        credentials = customer_credentials(options['users'], options['password'])
+
+        server = None
+        base_url = options['url']
+        if not base_url:
+            server = ThreadedWSGIServer(('localhost', 0), QuietRequestHandler, allow_reuse_address=False)
+            server.set_app(count_queries(get_internal_wsgi_application()))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://localhost:{server.server_port}"
+            self.stdout.write(f"Started in-process server at {base_url}")
+
+        self.stdout.write(f"Replaying {options['mix']} with {options['concurrency']} virtual users for {options['duration']}s...")
+        try:
+            summary = benchmark.run(
+                base_url, credentials, mix, options['concurrency'], options['duration'],
+                warmup=options['warmup'], seed=options['seed'], payment_mode=options['payment_mode'],
+            )
+        except benchmark.BenchmarkError as e:
+            raise CommandError(e)
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+
+        results = {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'config': {
+                'url': options['url'] or 'in-process',
+                'mix': mix,
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+                'warmup': options['warmup'],
+                'users': len(credentials),
+                'payment_mode': options['payment_mode'],
+                'seed': options['seed'],
+            },
+            **summary,
+        }
+        self.print_summary(results)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def print_summary(self, results):
+        self.stdout.write(f"\n{'endpoint':<18}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'queries':>9}")
+        for name, endpoint in results['endpoints'].items():
+            latency = endpoint['latency_ms']
+            queries = endpoint['sql_queries_per_request']
+            self.stdout.write(
+                f"{name:<18}{endpoint['requests']:>9}{endpoint['requests_per_second']:>9}{latency['p50']:>9}"
+                f"{latency['p95']:>9}{latency['p99']:>9}{endpoint['errors']:>8}{'-' if queries is None else queries:>9}"
+            )
+        for scenario, count in results['scenario_exceptions'].items():
+            self.stdout.write(f"{scenario} scenario: {count} client side exceptions (see the log)")
+        self.stdout.write(f"\nTotal: {results['requests']} requests, {results['requests_per_second']} req/s, {results['errors']} errors")
@@ -0,0 +1,148 @@
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+SCHEMA = [
+    "CREATE TABLE bench_cart (id INTEGER PRIMARY KEY, item_count INTEGER NOT NULL)",
+    "CREATE TABLE bench_line (cart INTEGER NOT NULL, product INTEGER NOT NULL, quantity INTEGER NOT NULL, PRIMARY KEY (cart, product))",
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the concurrent write throughput of the SQLite storage profiles (settings.SQLITE_PROFILES). "
+        "Each profile gets a scratch database file, the project database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default=','.join(settings.SQLITE_PROFILES), help="Comma separated profiles to compare")
+        parser.add_argument('--writers', type=int, default=8, help="Threads running write transactions")
+        parser.add_argument('--readers', type=int, default=2, help="Threads running reads at the same time")
+        parser.add_argument('--transactions', type=int, default=200, help="Write transactions per writer")
+        parser.add_argument('--carts', type=int, default=20, help="Rows the writers compete for")
+
+    def handle(self, *args, **options):
+        profiles = [name.strip() for name in options['profiles'].split(',') if name.strip()]
+        unknown = [name for name in profiles if name not in settings.SQLITE_PROFILES]
+        if unknown:
+            raise CommandError(f"Unknown profile '{unknown[0]}', expected one of {', '.join(settings.SQLITE_PROFILES)}")
+
+        self.stdout.write(
+            f"{options['writers']} writers x {options['transactions']} transactions, {options['readers']} readers, "
+            f"{options['carts']} carts"
+        )
+        self.stdout.write(f"\n{'profile':<14}{'commits':>9}{'failed':>8}{'tx/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'reads':>9}{'read p95':>10}")
+        with tempfile.TemporaryDirectory() as directory:
+            for name in profiles:
+                result = self.run_profile(name, Path(directory) / f"{name}.sqlite3", options)
+                self.stdout.write(
+                    f"{name:<14}{result['commits']:>9}{result['failed']:>8}{result['tps']:>9}{result['p50']:>9}"
+                    f"{result['p95']:>9}{result['p99']:>9}{result['reads']:>9}{result['read_p95']:>10}"
+                )
+
+    def run_profile(self, name, path, options):
+        alias = f"bench-{name}"
+        connections.settings[alias] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {},
+            alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path), **settings.SQLITE_PROFILES[name]},
+        })[alias]
+        # Per request connections unless the profile keeps them open
+        persistent = connections.settings[alias]['CONN_MAX_AGE'] != 0
+
+        try:
+            with connections[alias].cursor() as cursor:
+                for statement in SCHEMA:
+                    cursor.execute(statement)
+                for cart in range(options['carts']):
+                    cursor.execute("INSERT INTO bench_cart (id, item_count) VALUES (%s, 0)", [cart])
+            connections[alias].close()
+
+            latencies, reads, failures = [], [], []
+            lock = threading.Lock()
+            writing = threading.Event()
+
+            def writer(seed):
+                samples, failed = [], 0
+                try:
+                    for n in range(options['transactions']):
+                        cart, product = (seed * 7919 + n) % options['carts'], n % 50
+                        started = time.perf_counter()
+                        try:
+                            # A cart change: read the line, write it, update the cart totals
+                            with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                                cursor.execute("SELECT quantity FROM bench_line WHERE cart = %s AND product = %s", [cart, product])
+                                if cursor.fetchone():
+                                    cursor.execute("UPDATE bench_line SET quantity = quantity + 1 WHERE cart = %s AND product = %s", [cart, product])
+                                else:
+                                    cursor.execute("INSERT INTO bench_line (cart, product, quantity) VALUES (%s, %s, 1)", [cart, product])
+                                cursor.execute("UPDATE bench_cart SET item_count = item_count + 1 WHERE id = %s", [cart])
+                            samples.append(time.perf_counter() - started)
+                        except OperationalError:
+                            # "database is locked"
+                            failed += 1
+                        if not persistent:
+                            connections[alias].close()
+                finally:
+                    connections[alias].close()
+                    with lock:
+                        latencies.extend(samples)
+                        failures.append(failed)
+
+            def reader():
+                samples = []
+                try:
+                    while writing.is_set():
+                        started = time.perf_counter()
+                        try:
+                            with connections[alias].cursor() as cursor:
+                                cursor.execute("SELECT SUM(item_count) FROM bench_cart")
+                                cursor.fetchone()
+                            samples.append(time.perf_counter() - started)
+                        except OperationalError:
+                            pass
+                        if not persistent:
+                            connections[alias].close()
+                finally:
+                    connections[alias].close()
+                    with lock:
+                        reads.extend(samples)
+
+            writing.set()
+            readers = [threading.Thread(target=reader) for n in range(options['readers'])]
+            writers = [threading.Thread(target=writer, args=(n,)) for n in range(options['writers'])]
+            started = time.perf_counter()
+            for thread in readers + writers:
+                thread.start()
+            for thread in writers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            writing.clear()
+            for thread in readers:
+                thread.join()
+        finally:
+            connections[alias].close()
+            del connections.settings[alias]
+
+        return {
+            'commits': len(latencies),
+            'failed': sum(failures),
+            'tps': round(len(latencies) / elapsed, 1),
+            'p50': round(statistics.median(latencies) * 1000, 1) if latencies else 0,
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'reads': len(reads),
+            'read_p95': percentile(reads, 0.95),
+        }
@@ -0,0 +1,133 @@
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app import benchmark
+from .bench_api import customer_credentials
+
+# name -> (module that must be installed, command line, extra environment)
+SERVERS = {
+    'wsgi': (
+        'gunicorn',
+        lambda port, options: [
+            sys.executable, '-m', 'gunicorn', 'ecommerce_django.wsgi:application', '--bind', f'127.0.0.1:{port}',
+            '--workers', str(options['workers']), '--threads', str(options['threads']), '--log-level', 'warning',
+        ],
+        {'ASYNC_API': 'False'},
+    ),
+    'asgi': (
+        'uvicorn',
+        lambda port, options: [
+            sys.executable, '-m', 'uvicorn', 'ecommerce_django.asgi:application', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(options['workers']), '--log-level', 'warning', '--no-access-log',
+        ],
+        {'ASYNC_API': 'True'},
+    ),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the bench_api traffic mix at high concurrency against gunicorn (WSGI, sync views) "
+        "and uvicorn (ASGI, ASYNC_API async views), one after the other, on this database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', default='wsgi,asgi', help="Comma separated servers to compare: wsgi, asgi")
+        parser.add_argument('--workers', type=int, default=2, help="Server worker processes")
+        parser.add_argument('--threads', type=int, default=8, help="Threads per gunicorn worker")
+        parser.add_argument('--users', type=int, default=50, help="Seeded customers to log in as (password 'password123')")
+        parser.add_argument('--password', default='password123')
+        parser.add_argument('--concurrency', type=int, default=200, help="Virtual users sending requests in parallel")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds of measured traffic per server")
+        parser.add_argument('--warmup', type=float, default=5, help="Seconds of unmeasured traffic first")
+        parser.add_argument('--mix', default='browse=60,cart=25,orders=15', help="Scenario weights, see bench_api")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['servers'].split(',') if name.strip()]
+        for name in names:
+            if name not in SERVERS:
+                raise CommandError(f"Unknown server '{name}', expected one of {', '.join(SERVERS)}")
+            if importlib.util.find_spec(SERVERS[name][0]) is None:
+                raise CommandError(f"{SERVERS[name][0]} is not installed (pip install {SERVERS[name][0]})")
+        if settings.DATABASES['default']['ENGINE'].endswith('sqlite3') and settings.DB_PROFILE == 'sqlite':
+            self.stderr.write("Concurrent writers fail on the default SQLite profile, consider DB_PROFILE=sqlite-wal")
+        try:
+            mix = benchmark.parse_mix(options['mix'])
+        except benchmark.BenchmarkError as e:
+            raise CommandError(e)
+        credentials = customer_credentials(options['users'], options['password'])
+
+        results = {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'config': {key: options[key] for key in ('workers', 'threads', 'concurrency', 'duration', 'warmup', 'seed')} | {'mix': mix},
+            'servers': {},
+        }
+        for name in names:
+            self.stdout.write(f"{name}: {options['concurrency']} virtual users for {options['duration']}s...")
+            results['servers'][name] = self.bench(name, credentials, mix, options)
+
+        self.stdout.write(f"\n{'server':<8}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for name, summary in results['servers'].items():
+            latencies = [endpoint['latency_ms'] for endpoint in summary['endpoints'].values()]
+            weights = [endpoint['requests'] for endpoint in summary['endpoints'].values()]
+            # Request weighted averages of the per endpoint percentiles
+            p50, p95, p99 = (
+                round(sum(latency[p] * weight for latency, weight in zip(latencies, weights)) / max(sum(weights), 1), 2)
+                for p in ('p50', 'p95', 'p99')
+            )
+            self.stdout.write(f"{name:<8}{summary['requests']:>10}{summary['requests_per_second']:>10}{p50:>10}{p95:>10}{p99:>10}{summary['errors']:>8}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def bench(self, name, credentials, mix, options):
+        module, command, environment = SERVERS[name]
+        port = free_port()
+        server = subprocess.Popen(command(port, options), env={**os.environ, **environment})
+        base_url = f"http://localhost:{port}"
+        try:
+            self.wait_until_up(server, base_url)
+            return benchmark.run(
+                base_url, credentials, mix, options['concurrency'], options['duration'],
+                warmup=options['warmup'], seed=options['seed'],
+            )
+        except benchmark.BenchmarkError as e:
+            raise CommandError(f"{name}: {e}")
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    def wait_until_up(self, server, base_url, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"The server exited with status {server.returncode}")
+            try:
+                requests.get(f"{base_url}/api/csrf-token/", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise CommandError(f"The server did not answer within {timeout}s")
@@ -0,0 +1,152 @@
+import json
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from app.models import Address, CartItem, Category, Order, Product, ProductFacet, Seller
+
+# url name -> (method, path, data), formatted with the sample rows of sample().
+# Every route in app_api/urls.py must have an entry (see app_api.tests).
+ENDPOINTS = {
+    'products': ('get', '/api/products/?price=under-500', None),
+    'product_search': ('get', '/api/products/search/?q={product.name}', None),
+    'category': ('get', '/api/products/{category.slug}?price=under-500', None),
+    'product': ('get', '/api/products/{product.category.slug}/{product.slug}', None),
+    'categories': ('get', '/api/categories/', None),
+    'register': ('post', '/api/register/', {'username': 'plan-check', 'email': 'plan-check@example.com', 'password': 'password123'}),
+    'add_to_cart': ('post', '/api/add-to-cart/', {'product_id': '{product.id}', 'quantity': 1}),
+    'remove_from_cart': ('post', '/api/remove-from-cart/', {'cartitem_id': '{cart_item.id}'}),
+    'cart': ('get', '/api/cart/', None),
+    'cart_summary': ('get', '/api/cart/summary/', None),
+    'cart_batch': ('post', '/api/cart/batch/', {'changes': [{'product_id': '{product.id}', 'quantity': 1}]}),
+    'checkout': ('post', '/api/checkout/', {'address_id': '{address.id}', 'payment_mode': 'Cash on Delivery'}),
+    'verify_payment': ('post', '/api/verify-payment/', {'razorpay_order_id': '{order.razorpay_order_id}', 'razorpay_payment_id': 'pay_plan', 'razorpay_signature': 'plan'}),
+    'payment_status': ('get', '/api/payment-status/{order.id}/', None),
+    'analytics': ('get', '/api/analytics/?dimension=product&interval=week', None),
+    'profile': ('get', '/api/profile/', None),
+    'profile_address': ('get', '/api/profile/addresses/', None),
+    'profile_orders': ('get', '/api/profile/orders/', None),
+    'csrf_token': ('get', '/api/csrf-token/', None),
+}
+# Requested as a staff user
+STAFF_ONLY = {'analytics'}
+
+# Tables small enough to read whole
+SMALL_TABLES = {model._meta.db_table for model in (Category, Seller, ProductFacet)}
+
+# SQLite: "SCAN app_order" (or "SCAN TABLE app_order AS U0" before 3.36), not "SCAN app_order USING INDEX ..."
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+# Django's table aliases in subqueries and repeated joins ("app_order" U0), which SQLite reports instead of the table
+TABLE_ALIAS = re.compile(r'"(\w+)" ([A-Z]\d+)\b')
+
+
+def sample():
+    """ Rows of the database to request the endpoints with: a customer with an address, a cart line and an order. """
+    cart_item = CartItem.objects.select_related('cart__user').filter(
+        cart__user__is_staff=False, cart__user__address__isnull=False, cart__user__order__isnull=False,
+    ).first()
+    if cart_item is None:
+        raise CommandError("No customer with an address, a cart and an order found, seed the database first (manage.py seed_data)")
+    user = cart_item.cart.user
+    product = Product.objects.select_related('category').order_by('id').first()
+    return {
+        'user': user,
+        # Unsaved if there is no staff user, the analytics view only checks is_staff
+        'staff': User.objects.filter(is_staff=True).first() or User(username='plan-check', is_staff=True),
+        'cart_item': cart_item,
+        'address': Address.objects.filter(user=user).first(),
+        'order': Order.objects.filter(user=user).exclude(razorpay_order_id=None).first() or Order.objects.filter(user=user).first(),
+        'product': product,
+        'category': product.category,
+    }
+
+
+def fill(value, rows):
+    if isinstance(value, str):
+        value = value.format(**rows)
+        return int(value) if value.isdigit() else value
+    if isinstance(value, dict):
+        return {key: fill(item, rows) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, rows) for item in value]
+    return value
+
+
+def full_scans(sql, params):
+    """ The tables ``sql`` reads whole, according to the database's plan. """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            matches = (SQLITE_SCAN.match(detail) for id, parent, notused, detail in cursor.fetchall())
+            aliases = {alias: table for table, alias in TABLE_ALIAS.findall(sql)}
+            return [aliases.get(match.group(1), match.group(1)) for match in matches if match]
+        if connection.vendor == 'postgresql':
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            return list(postgres_seq_scans(plan[0]['Plan']))
+    raise CommandError(f"Query plans of the {connection.vendor} backend are not supported")
+
+
+def postgres_seq_scans(node):
+    if node['Node Type'] == 'Seq Scan':
+        yield node['Relation Name']
+    for child in node.get('Plans', []):
+        yield from postgres_seq_scans(child)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every API endpoint (writes are rolled back) and EXPLAIN its SELECT queries. Fails when one "
+        "reads a whole table other than the small catalog tables. Run it on a production-sized database "
+        "(manage.py seed_data): planners rightly scan tiny tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', help="Comma separated url names to check, all by default")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['endpoints'].split(',')] if options['endpoints'] else list(ENDPOINTS)
+        for name in names:
+            if name not in ENDPOINTS:
+                raise CommandError(f"Unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+
+        rows = sample()
+        failures = []
+        # Dummy cache so cached pages do not hide their queries, no debug page (and its queries) on errors
+        dummy_cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with override_settings(ALLOWED_HOSTS=['testserver'], CACHES=dummy_cache, DEBUG=False):
+            for name in names:
+                method, path, data = ENDPOINTS[name]
+                recorder = QueryRecorder()
+                # The plans matter, not whether the sample request succeeds
+                client = APIClient(raise_request_exception=False)
+                client.force_authenticate(rows['staff'] if name in STAFF_ONLY else rows['user'])
+                with transaction.atomic():
+                    with connection.execute_wrapper(recorder):
+                        response = getattr(client, method)(fill(path, rows), fill(data, rows), format='json')
+                    scans = [(sql, table) for sql, params in recorder.queries for table in full_scans(sql, params) if table not in SMALL_TABLES]
+                    transaction.set_rollback(True)
+
+                status = 'ok' if not scans else 'FULL SCAN'
+                self.stdout.write(f"{name:<18}{method.upper():<6}{response.status_code:<5}{len(recorder.queries):>3} selects  {status}")
+                for sql, table in scans:
+                    failures.append(name)
+                    self.stdout.write(f"    {table}: {sql}")
+
+        if failures:
+            raise CommandError(f"Full table scans in: {', '.join(dict.fromkeys(failures))}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from app import exports
+
+
+class Command(BaseCommand):
+    help = "Stream an export of every order (with its items), product or enquiry as CSV or NDJSON, in constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=list(exports.EXPORTS))
+        parser.add_argument('--format', choices=list(exports.FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write, stdout by default")
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE, help="Rows fetched per query")
+
+    def handle(self, *args, **options):
+        lines = exports.lines(options['export'], options['format'], chunk_size=options['chunk_size'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        count = -1 if options['format'] == 'csv' else 0
+        with open(options['output'], 'w', newline='') as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+        self.stderr.write(f"Wrote {count} rows to {options['output']}")
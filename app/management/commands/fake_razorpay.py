@@ -0,0 +1,112 @@
+import base64
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class FakeRazorpayHandler(BaseHTTPRequestHandler):
+    """ Implements the subset of the Razorpay orders API used by the shop. """
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real gateway
+    orders = {}
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, code, description):
+        self.send_json(status, {'error': {'code': code, 'description': description}})
+
+    def authorized(self):
+        expected = base64.b64encode(f"{settings.RAZORPAY_KEY}:{settings.RAZORPAY_SECRET}".encode()).decode()
+        return self.headers.get('Authorization') == f"Basic {expected}"
+
+    def simulate(self):
+        """ Apply the configured latency and failure rate. Returns False if the request failed. """
+        time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            self.send_error_json(502, 'GATEWAY_ERROR', 'Simulated gateway failure')
+            return False
+        return True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.rstrip('/') != '/v1/orders':
+            return self.send_error_json(404, 'BAD_REQUEST_ERROR', 'The requested URL was not found on the server.')
+        if not self.authorized():
+            return self.send_error_json(401, 'BAD_REQUEST_ERROR', 'Authentication failed')
+        if not self.simulate():
+            return
+
+        try:
+            data = json.loads(body)
+            amount = int(data['amount'])
+        except (ValueError, KeyError, TypeError):
+            return self.send_error_json(400, 'BAD_REQUEST_ERROR', 'The amount field is required.')
+
+        order = {
+            'id': f"order_{uuid.uuid4().hex[:14]}",
+            'entity': 'order',
+            'amount': amount,
+            'amount_paid': 0,
+            'amount_due': amount,
+            'currency': data.get('currency', 'INR'),
+            'receipt': data.get('receipt'),
+            'status': 'created',
+            'attempts': 0,
+            'created_at': int(time.time()),
+        }
+        self.orders[order['id']] = order
+        self.send_json(200, order)
+
+    def do_GET(self):
+        prefix = '/v1/orders/'
+        if not self.path.startswith(prefix):
+            return self.send_error_json(404, 'BAD_REQUEST_ERROR', 'The requested URL was not found on the server.')
+        if not self.authorized():
+            return self.send_error_json(401, 'BAD_REQUEST_ERROR', 'Authentication failed')
+        if not self.simulate():
+            return
+
+        order = self.orders.get(self.path[len(prefix):].split('?')[0])
+        if order is None:
+            return self.send_error_json(400, 'BAD_REQUEST_ERROR', 'The id provided does not exist')
+        self.send_json(200, order)
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the Razorpay orders API (point RAZORPAY_BASE_URL at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9000)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of requests answered with a gateway error")
+        parser.add_argument('--verbose', action='store_true', help="Log every request")
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer((options['host'], options['port']), FakeRazorpayHandler)
+        server.daemon_threads = True
+        server.latency = options['latency']
+        server.failure_rate = options['failure_rate']
+        server.verbose = options['verbose']
+
+        self.stdout.write(f"Fake Razorpay listening on http://{options['host']}:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
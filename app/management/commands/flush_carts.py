@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.cart_store import CacheCartStore, get_store
+
+
+class Command(BaseCommand):
+    help = "Write the carts kept in the cache (CART_STORE=app.cart_store.CacheCartStore) to the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep flushing every CART_FLUSH_INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        store = get_store()
+        if not isinstance(store, CacheCartStore):
+            raise CommandError(f"CART_STORE is {settings.CART_STORE}, carts are already written to the database")
+
+        while True:
+            flushed = store.flush_pending()
+            self.stdout.write(f"Flushed {flushed} carts.")
+            if not options['loop']:
+                break
+            time.sleep(settings.CART_FLUSH_INTERVAL)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import images
+from app.models import Category, Product, Profile, Seller
+
+MODELS = {'products': Product, 'categories': Category, 'sellers': Seller, 'profiles': Profile}
+
+
+class Command(BaseCommand):
+    help = "Generate the thumb, card and detail variants (JPEG and WebP) of existing product, category, seller and profile images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=list(MODELS), action='append', help="Limit to these images, may be repeated")
+        parser.add_argument('--workers', type=int, default=None, help="Generator processes (defaults to the CPU count)")
+        parser.add_argument('--force', action='store_true', help="Regenerate variants that are already up to date")
+
+    def image_names(self, models):
+        # Many rows share an image (the defaults), generate each file once
+        seen = set()
+        for model in models:
+            for name in model.objects.exclude(image='').values_list('image', flat=True).distinct().iterator(chunk_size=5000):
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+    def handle(self, *args, **options):
+        if not images.local_storage():
+            raise CommandError("Image variants are generated from local files, the default storage has no local paths")
+        models = [MODELS[name] for name in options['only'] or MODELS]
+        generated = current = failed = 0
+        self.stdout.write("Generating image variants...")
+        for done, written in enumerate(images.backfill(self.image_names(models), workers=options['workers'], force=options['force']), 1):
+            if written > 0:
+                generated += 1
+            elif written == 0:
+                current += 1
+            else:
+                failed += 1
+            if done % 100 == 0:
+                self.stdout.write(f"  {done} images", ending='\r')
+        self.stdout.write(f"Image variants done: {generated} generated, {current} up to date or missing, {failed} failed.")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app import facets
+
+
+class Command(BaseCommand):
+    help = "Recount the product listing facets from the catalog"
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding facet counts...")
+        cells = facets.rebuild()
+        self.stdout.write(f"Facet counts rebuilt, {cells} cells.")
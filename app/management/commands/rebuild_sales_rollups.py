@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app import analytics
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups from the orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50000, help="Orders aggregated per round of queries")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding sales rollups...")
+        processed = 0
+        for processed in analytics.rebuild(chunk_size=options['chunk_size']):
+            self.stdout.write(f"  {processed} orders", ending='\r')
+        self.stdout.write(f"\nSales rollups rebuilt from {processed} orders.")
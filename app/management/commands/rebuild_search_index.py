@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help="Products indexed per statement")
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            self.stdout.write("The database backend has no full-text index, nothing to rebuild.")
+            return
+
+        self.stdout.write("Rebuilding search index...")
+        indexed = 0
+        for indexed in search.rebuild(chunk_size=options['chunk_size']):
+            self.stdout.write(f"  {indexed} products indexed")
+        self.stdout.write(f"Search index rebuilt, {indexed} products.")
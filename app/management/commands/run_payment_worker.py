@@ -0,0 +1,47 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app import payments
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Create pending gateway orders from the payment outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Outbox entries claimed per poll")
+        parser.add_argument('--concurrency', type=int, default=8, help="Gateway calls in flight")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the outbox is empty")
+        parser.add_argument('--once', action='store_true', help="Process the due entries once and exit")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Payment worker started")
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            while True:
+                close_old_connections()
+                entries = payments.claim_due(options['batch_size'])
+                if entries:
+                    results = list(pool.map(self.process, entries))
+                    self.stdout.write(f"Processed {len(results)} entries, {results.count(True)} succeeded")
+                if options['once']:
+                    break
+                if not entries:
+                    time.sleep(options['interval'])
+
+    @staticmethod
+    def process(entry):
+        # One entry failing (e.g. the database) does not stop the others or
+        # the worker, the entry is claimed again once its lease expires
+        try:
+            return payments.process(entry)
+        except Exception:
+            logger.exception("Processing payment outbox entry %s failed", entry.pk)
+            return False
+        finally:
+            close_old_connections()
@@ -1,70 +1,210 @@
-import os
-import random
-from django.core.files.base import ContentFile
-from django.core.management.base import BaseCommand
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from multiprocessing import Pool
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from app.models import Category, Seller, Product  # Replace 'myapp' with your app name
-from faker import Faker
-
-fake = Faker()
-
-def seed_categories(n=5):
-    categories = []
-    for _ in range(n):
-        name = fake.word().capitalize()
-        category = Category.objects.create(
-            name=name,
-            description=fake.text(max_nb_chars=200),
-        )
-        categories.append(category)
-    return categories
-
-def seed_sellers(n=5):
-    sellers = []
-    for _ in range(n):
-        user = User.objects.create_user(
-            username=fake.unique.user_name(),
-            email=fake.email(),
-            password="password123",
-        )
-        seller = Seller.objects.create(
-            user=user,
-            name=fake.company(),
-            description=fake.text(max_nb_chars=200),
-        )
-        sellers.append(seller)
-    return sellers
-
-def seed_products(categories, sellers, n=20):
-    products = []
-    for _ in range(n):
-        user = random.choice(User.objects.all())
-        product = Product.objects.create(
-            user=user,
-            name=fake.unique.word().capitalize(),
-            description=fake.text(max_nb_chars=300),
-            category=random.choice(categories),
-            seller=random.choice(sellers),
-            price=round(random.uniform(10.0, 500.0), 2),
-        )
-        products.append(product)
-    return products
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.text import slugify
+
+from app.models import Address, Cart, CartItem, Category, Order, OrderItem, Product, Profile, Seller
+from app.seeding import generate_chunk
+
+
+@contextmanager
+def explicit_order_dates():
+    # Order.date is auto_now_add, which would stamp every seeded order with now()
+    field = Order._meta.get_field('date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
 
 class Command(BaseCommand):
-    help = "Seed the database with sample data"
+    help = "Seed the database with sample data, from a handful of rows to production-sized datasets"
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write("Seeding data...")
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Customers, each with a profile, a cart and an address")
+        parser.add_argument('--categories', type=int, default=5)
+        parser.add_argument('--sellers', type=int, default=5)
+        parser.add_argument('--products', type=int, default=20)
+        parser.add_argument('--carts', type=int, default=5, help="Customer carts filled with 1 to 5 items")
+        parser.add_argument('--orders', type=int, default=20, help="Orders spread over the last two years")
+        parser.add_argument('--items-per-order', type=int, default=3, help="Maximum number of items per order")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per generated chunk and per INSERT batch")
+        parser.add_argument('--workers', type=int, default=None, help="Generator processes (defaults to the CPU count)")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, the same seed gives the same data")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['categories'] < 1 or options['sellers'] < 1 or options['products'] < 1:
+            self.stderr.write("At least one user, category, seller and product are required.")
+            return
 
-        # Clear existing data
-        # Product.objects.all().delete()
-        # Seller.objects.all().delete()
-        # Category.objects.all().delete()
-        # User.objects.filter(is_staff=False).delete()
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.params = {
+            'users': options['users'],
+            'categories': options['categories'],
+            'sellers': options['sellers'],
+            'products': options['products'],
+            'items_per_order': max(options['items_per_order'], 1),
+        }
+        self.password = make_password("password123")
+        # Generated names end with their position: start after the rows of an earlier run
+        users = User.objects.aggregate(n=Max('pk'))['n'] or 0
+        self.offsets = {
+            'users': users,
+            'seller-users': users,
+            'categories': Category.objects.aggregate(n=Max('pk'))['n'] or 0,
+            'sellers': Seller.objects.aggregate(n=Max('pk'))['n'] or 0,
+            'products': Product.objects.aggregate(n=Max('pk'))['n'] or 0,
+        }
 
-        # Seed new data
-        categories = seed_categories()
-        sellers = seed_sellers()
-        seed_products(categories, sellers)
+        self.stdout.write("Seeding data...")
+        with Pool(options['workers']) as self.pool:
+            user_ids = self.seed_users('users', options['users'])
+            cart_ids = self.seed_profiles_and_carts(user_ids)
+            address_ids = self.seed_addresses(user_ids)
+            category_ids = self.seed_categories()
+            seller_ids, seller_user_ids = self.seed_sellers()
+            product_ids, prices = self.seed_products(category_ids, seller_ids, seller_user_ids)
+            self.seed_carts(cart_ids, product_ids, prices)
+            self.seed_orders(user_ids, address_ids, product_ids, prices)
+
+        # bulk_create sends no signals, rebuild what they would have maintained
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('rebuild_facets', stdout=self.stdout)
+        call_command('rebuild_sales_rollups', stdout=self.stdout)
 
         self.stdout.write("Seeding completed!")
+
+    def chunks(self, kind, total):
+        """ Generated rows of ``kind``, chunk by chunk, in order. """
+        seed, offset = self.options['seed'], self.offsets.get(kind, 0)
+        tasks = [
+            (kind, offset + start, min(self.batch_size, total - start), seed, self.params)
+            for start in range(0, total, self.batch_size)
+        ]
+        done = 0
+        for rows in self.pool.imap(generate_chunk, tasks):
+            yield rows
+            done += len(rows)
+            self.stdout.write(f"  {kind}: {done}/{total}", ending='\r')
+        if total:
+            self.stdout.write('')
+
+    def insert(self, model, objects):
+        with transaction.atomic():
+            return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def seed_users(self, kind, total):
+        ids = array('q')
+        for rows in self.chunks(kind, total):
+            users = self.insert(User, [
+                User(username=username, email=email, first_name=first_name, last_name=last_name, password=self.password)
+                for username, email, first_name, last_name in rows
+            ])
+            ids.extend(user.pk for user in users)
+        return ids
+
+    def seed_profiles_and_carts(self, user_ids):
+        # What the User post_save signal does for every new user
+        cart_ids = array('q')
+        for start in range(0, len(user_ids), self.batch_size):
+            batch = user_ids[start:start + self.batch_size]
+            self.insert(Profile, [Profile(user_id=user_id) for user_id in batch])
+            carts = self.insert(Cart, [Cart(user_id=user_id) for user_id in batch])
+            cart_ids.extend(cart.pk for cart in carts)
+        return cart_ids
+
+    def seed_addresses(self, user_ids):
+        ids, position = array('q'), 0
+        for rows in self.chunks('addresses', len(user_ids)):
+            addresses = self.insert(Address, [
+                Address(user_id=user_ids[position + n], address=address, city=city, state=state, country=country, pincode=pincode, phone=phone)
+                for n, (address, city, state, country, pincode, phone) in enumerate(rows)
+            ])
+            position += len(rows)
+            ids.extend(address.pk for address in addresses)
+        return ids
+
+    def seed_categories(self):
+        ids = array('q')
+        for rows in self.chunks('categories', self.params['categories']):
+            categories = self.insert(Category, [Category(name=name, slug=slugify(name), description=description) for name, description in rows])
+            ids.extend(category.pk for category in categories)
+        return ids
+
+    def seed_sellers(self):
+        seller_user_ids = self.seed_users('seller-users', self.params['sellers'])
+        self.seed_profiles_and_carts(seller_user_ids)
+
+        ids, position = array('q'), 0
+        for rows in self.chunks('sellers', self.params['sellers']):
+            sellers = self.insert(Seller, [
+                Seller(user_id=seller_user_ids[position + n], name=name, slug=slugify(name), description=description)
+                for n, (name, description) in enumerate(rows)
+            ])
+            position += len(rows)
+            ids.extend(seller.pk for seller in sellers)
+        return ids, seller_user_ids
+
+    def seed_products(self, category_ids, seller_ids, seller_user_ids):
+        ids, prices = array('q'), array('d')
+        for rows in self.chunks('products', self.params['products']):
+            products = self.insert(Product, [
+                Product(
+                    user_id=seller_user_ids[seller], name=name, slug=slugify(name), description=description,
+                    category_id=category_ids[category], seller_id=seller_ids[seller], price=price,
+                )
+                for name, description, category, seller, price in rows
+            ])
+            ids.extend(product.pk for product in products)
+            prices.extend(product.price for product in products)
+        return ids, prices
+
+    def seed_carts(self, cart_ids, product_ids, prices):
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        for rows in self.chunks('carts', min(self.options['carts'], len(cart_ids))):
+            self.insert(CartItem, [
+                CartItem(cart_id=cart_ids[user], product_id=product_ids[product], quantity=quantity, total=round(prices[product] * quantity, 2))
+                for user, lines in rows
+                for product, quantity in lines
+            ])
+            Cart.objects.filter(id__in=[cart_ids[user] for user, lines in rows]).update(
+                item_count=Coalesce(Subquery(items.annotate(n=Sum('quantity')).values('n')), Value(0)),
+                subtotal=Coalesce(Subquery(items.annotate(s=Sum('total')).values('s')), Value(0.0)),
+            )
+
+    def seed_orders(self, user_ids, address_ids, product_ids, prices):
+        now = timezone.now()
+        with explicit_order_dates():
+            for rows in self.chunks('orders', self.options['orders']):
+                orders, items = [], []
+                for user, age, status, payment_mode, lines in rows:
+                    order_items = [
+                        OrderItem(product_id=product_ids[product], quantity=quantity, total=round(prices[product] * quantity, 2))
+                        for product, quantity in lines
+                    ]
+                    total = round(sum(item.total for item in order_items), 2)
+                    paid = total if status == 'Delivered' or payment_mode == 'Online Payment' else 0
+                    orders.append(Order(
+                        user_id=user_ids[user], address_id=address_ids[user], date=now - timedelta(seconds=age),
+                        total=total, payment_mode=payment_mode, amount_paid=paid, amount_due=total - paid, status=status,
+                    ))
+                    items.append(order_items)
+
+                with transaction.atomic():
+                    Order.objects.bulk_create(orders, batch_size=self.batch_size)
+                    for order, order_items in zip(orders, items):
+                        for item in order_items:
+                            item.order_id = order.pk
+                    OrderItem.objects.bulk_create([item for order_items in items for item in order_items], batch_size=self.batch_size)
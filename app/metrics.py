@@ -0,0 +1,114 @@
+# metrics.py
+#
+# In-process request metrics, filled by app.middleware.RequestMetricsMiddleware
+# and rendered in the Prometheus text format at /metrics. Metrics are per
+# process: with several worker processes, scrape each of them or aggregate.
+import threading
+from bisect import bisect_left
+
+from . import catalog_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ViewMetrics:
+    __slots__ = ('latency', 'queries', 'sql_seconds', 'response_bytes', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_seconds = 0.0
+        self.response_bytes = 0
+        self.statuses = {}
+
+
+_lock = threading.Lock()
+_views = {}
+
+
+def record(view, route, method, status, seconds, queries, sql_seconds, response_bytes):
+    key = (view, route, method)
+    with _lock:
+        metrics = _views.get(key)
+        if metrics is None:
+            metrics = _views[key] = ViewMetrics()
+        metrics.latency.observe(seconds)
+        # None for async requests, their queries run in other threads
+        if queries is not None:
+            metrics.queries.observe(queries)
+            metrics.sql_seconds += sql_seconds
+        metrics.response_bytes += response_bytes
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name, histogram, labels):
+    lines, cumulative = [], 0
+    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+def render():
+    """ All metrics in the Prometheus text exposition format. """
+    with _lock:
+        snapshot = [(key, metrics) for key, metrics in sorted(_views.items())]
+        families = {
+            'http_requests_total': ('counter', 'Requests by view, method and status.', []),
+            'http_request_duration_seconds': ('histogram', 'Request latency in seconds.', []),
+            'http_request_sql_queries': ('histogram', 'SQL queries per request.', []),
+            'http_request_sql_seconds_total': ('counter', 'Time spent in SQL queries in seconds.', []),
+            'http_response_size_bytes_total': ('counter', 'Response body size in bytes.', []),
+        }
+        for (view, route, method), metrics in snapshot:
+            labels = _labels(view=view, route=route, method=method)
+            for status, count in sorted(metrics.statuses.items()):
+                families['http_requests_total'][2].append(f'http_requests_total{{{labels},status="{status}"}} {count}')
+            families['http_request_duration_seconds'][2].extend(_histogram_lines('http_request_duration_seconds', metrics.latency, labels))
+            families['http_request_sql_queries'][2].extend(_histogram_lines('http_request_sql_queries', metrics.queries, labels))
+            families['http_request_sql_seconds_total'][2].append(f'http_request_sql_seconds_total{{{labels}}} {metrics.sql_seconds}')
+            families['http_response_size_bytes_total'][2].append(f'http_response_size_bytes_total{{{labels}}} {metrics.response_bytes}')
+
+    cache_stats = catalog_cache.stats()
+    families['catalog_cache_requests_total'] = ('counter', 'Catalog cache lookups by result.', [
+        f'catalog_cache_requests_total{{result="hit"}} {cache_stats["hits"]}',
+        f'catalog_cache_requests_total{{result="miss"}} {cache_stats["misses"]}',
+    ])
+
+    output = []
+    for name, (kind, help_text, lines) in families.items():
+        output.append(f'# HELP {name} {help_text}')
+        output.append(f'# TYPE {name} {kind}')
+        output.extend(lines)
+    return '\n'.join(output) + '\n'
@@ -0,0 +1,121 @@
+# middleware.py
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import db_router, metrics
+
+
+class SQLTimer:
+    """ Database execute wrapper counting queries and the time spent in them. """
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, SQL queries, SQL time and response size per resolved
+    URL, for the Prometheus endpoint at /metrics (see app/metrics.py).
+    Keep it first in MIDDLEWARE so the whole stack is measured.
+
+    Under ASGI it runs asynchronously, so async views keep their requests off
+    threads. SQL queries are not counted then: the async ORM runs them in
+    threads shared by the requests.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = SQLTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, None)
+        return response
+
+    def record(self, request, response, elapsed, timer):
+        match = request.resolver_match
+        if match is not None:
+            view, route = match.url_name or match.view_name, match.route
+        else:
+            view, route = '', '<unmatched>'
+        size = 0 if response.streaming else len(response.content)
+        if timer is None:
+            metrics.record(view, route, request.method, response.status_code, elapsed, None, 0, size)
+            return
+        metrics.record(view, route, request.method, response.status_code, elapsed, timer.queries, timer.seconds, size)
+
+        if settings.METRICS_EXPOSE_HEADERS:
+            response['X-SQL-Queries'] = str(timer.queries)
+            response['X-SQL-Time'] = f"{timer.seconds * 1000:.2f}ms"
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Keeps a user's reads on the default database for a few seconds after a
+    successful unsafe request, so the read-only views do not serve them a
+    replica that has not caught up with their own write (see app/db_router.py).
+    Place it after AuthenticationMiddleware. DRF views, and the async views,
+    set the authenticated user on the request too, so JWT authenticated
+    writes are seen.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not db_router.replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def wrote(self, request, response):
+        user = getattr(request, 'user', None)
+        return request.method not in self.SAFE_METHODS and response.status_code < 400 and user is not None and user.is_authenticated
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.wrote(request, response):
+            db_router.mark_written(request.user)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.wrote(request, response):
+            await db_router.amark_written(request.user)
+        return response
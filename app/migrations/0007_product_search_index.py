@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only, other backends search with LIKE (see app/search.py)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS app_product_search USING fts5("
+        "name, description, category, seller, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO app_product_search (rowid, name, description, category, seller) "
+        "SELECT p.id, p.name, p.description, c.name, s.name FROM app_product p "
+        "JOIN app_category c ON c.id = p.category_id JOIN app_seller s ON s.id = p.seller_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS app_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_payment_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1 on 2026-10-18 19:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+
+def count_facets(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    ProductFacet = apps.get_model('app', 'ProductFacet')
+    # Same buckets as app.facets.PRICE_BUCKETS at the time of this migration
+    bucket = Case(
+        When(Q(price__lt=500), then=Value('under-500')),
+        When(Q(price__gte=500, price__lt=1000), then=Value('500-1000')),
+        When(Q(price__gte=1000, price__lt=1500), then=Value('1000-1500')),
+        When(Q(price__gte=1500), then=Value('1500-plus')),
+        output_field=CharField(),
+    )
+    rows = Product.objects.order_by().values('category_id', 'seller_id', bucket=bucket).annotate(products=Count('id'))
+    ProductFacet.objects.bulk_create(
+        [ProductFacet(category_id=row['category_id'], seller_id=row['seller_id'], price_bucket=row['bucket'], count=row['products']) for row in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('price_bucket', models.CharField(max_length=32)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.category')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.seller')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'seller', 'price_bucket'), name='unique_product_facet')],
+            },
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
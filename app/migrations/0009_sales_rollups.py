@@ -0,0 +1,72 @@
+# Generated by Django 5.1 on 2026-10-18 19:40
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from zoneinfo import ZoneInfo
+
+
+def build_rollups(apps, schema_editor):
+    Order = apps.get_model('app', 'Order')
+    OrderItem = apps.get_model('app', 'OrderItem')
+    SalesRollup = apps.get_model('app', 'SalesRollup')
+    # Same cells as app.analytics.rebuild at the time of this migration
+    tz = ZoneInfo(settings.TIME_ZONE)
+    cells = defaultdict(lambda: [0, 0, 0, 0.0])
+
+    orders = Order.objects.order_by().values('status', 'payment_mode', day=TruncDate('date', tzinfo=tz)).annotate(n=Count('id'))
+    for row in orders:
+        for dimension, key in (('all', ''), ('payment_mode', row['payment_mode'])):
+            cells[(dimension, key, row['day'], row['status'])][0] += row['n']
+
+    lookups = {'all': None, 'payment_mode': 'order__payment_mode', 'category': 'product__category_id', 'seller': 'product__seller_id', 'product': 'product_id'}
+    for dimension, lookup in lookups.items():
+        group = {'day': TruncDate('order__date', tzinfo=tz), 'status': F('order__status')}
+        if lookup:
+            group['key'] = F(lookup)
+        rows = OrderItem.objects.order_by().values(**group).annotate(lines=Count('id'), units=Sum('quantity'), revenue=Sum('total'))
+        for row in rows:
+            cell = cells[(dimension, str(row.get('key', '')), row['day'], row['status'])]
+            cell[1] += row['lines']
+            cell[2] += row['units']
+            cell[3] += row['revenue']
+
+    SalesRollup.objects.bulk_create(
+        [
+            SalesRollup(dimension=dimension, key=key, day=day, status=status, orders=orders, lines=lines, units=units, revenue=revenue)
+            for (dimension, key, day, status), (orders, lines, units, revenue) in cells.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_product_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('dimension', models.CharField(choices=[('all', 'All'), ('payment_mode', 'Payment mode'), ('category', 'Category'), ('seller', 'Seller'), ('product', 'Product')], max_length=16)),
+                ('key', models.CharField(blank=True, default='', max_length=255)),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Delivered', 'Delivered'), ('Cancelled', 'Cancelled')], max_length=255)),
+                ('orders', models.IntegerField(default=0)),
+                ('lines', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dimension', 'day'], name='sales_rollup_dimension_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key', 'day', 'status'), name='unique_sales_rollup')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
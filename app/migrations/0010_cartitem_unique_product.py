@@ -0,0 +1,33 @@
+# Generated by Django 5.1 on 2026-10-18 19:44
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Add to cart used to create a second line for a product in some races,
+    # fold them into the first one (quantities and totals added up)
+    CartItem = apps.get_model('app', 'CartItem')
+    duplicates = (
+        CartItem.objects.order_by().values('cart_id', 'product_id')
+        .annotate(lines=Count('id'), first_id=Min('id'), quantity=Sum('quantity'), total=Sum('total'))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates:
+        CartItem.objects.filter(id=row['first_id']).update(quantity=row['quantity'], total=row['total'])
+        CartItem.objects.filter(cart_id=row['cart_id'], product_id=row['product_id']).exclude(id=row['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db import migrations, models
+
+# The admin finds users by email, which auth.User does not index. The user
+# model belongs to another app, so the index is added on its table here but
+# is not part of any model state: the schema editor names and quotes the
+# table of whatever AUTH_USER_MODEL is, and a model without an email field
+# is left alone. SQLite rebuilds a table to alter it, keeping only the
+# indexes in model state, hence the dependency on the latest auth migration
+# (later ones altering the user table have to be followed by this again).
+EMAIL_INDEX = models.Index(fields=['email'], name='auth_user_email_idx')
+
+
+def user_model(apps):
+    model = apps.get_model(settings.AUTH_USER_MODEL)
+    if not any(field.name == 'email' for field in model._meta.local_fields):
+        return None
+    return model
+
+
+def create_email_index(apps, schema_editor):
+    model = user_model(apps)
+    if model is not None:
+        schema_editor.add_index(model, EMAIL_INDEX)
+
+
+def drop_email_index(apps, schema_editor):
+    model = user_model(apps)
+    if model is not None:
+        schema_editor.remove_index(model, EMAIL_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_catalog_updated_at'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+from app import search
+
+INDEX_NAME = 'product_search_vector_idx'
+
+
+def create_search_index(apps, schema_editor):
+    # Postgres only, over the expression app/search.py queries, see 0007 for SQLite
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.indexes import GinIndex
+
+    schema_editor.add_index(apps.get_model('app', 'Product'), GinIndex(search.search_vector(), name=INDEX_NAME))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.indexes import GinIndex
+
+    schema_editor.remove_index(apps.get_model('app', 'Product'), GinIndex(search.search_vector(), name=INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_user_email_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
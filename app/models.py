@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.text import slugify
 
 # Create your models here.
@@ -23,6 +26,7 @@ class Category(models.Model):
     slug = models.SlugField(max_length=255, unique=True, blank=True, default="")
     description = models.TextField()
     image = models.ImageField(default='default-category.jpg', upload_to='category_pics')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -53,6 +57,14 @@ class Seller(models.Model):
 
 
 class Product(models.Model):
+    class Meta:
+        indexes = [
+            # Keyset pagination of the product listing
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            # Category listings filtered by price bucket, in the same order
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+        ]
+
     id = models.BigAutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=255, unique=True)
@@ -62,6 +74,7 @@ class Product(models.Model):
     seller = models.ForeignKey(Seller, on_delete=models.CASCADE)
     price = models.FloatField()
     image = models.ImageField(default='default.jpg', upload_to='product_pics')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -73,15 +86,54 @@ class Product(models.Model):
         return self.name
 
 
+class ProductFacet(models.Model):
+    """
+    Number of products per (category, seller, price bucket), maintained by the
+    Product signals so facet counts never need a GROUP BY over the catalog.
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'seller', 'price_bucket'], name='unique_product_facet'),
+        ]
+
+    id = models.BigAutoField(primary_key=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE)
+    price_bucket = models.CharField(max_length=32)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.category_id}/{self.seller_id}/{self.price_bucket}: {self.count}"
+
+
 class Cart(models.Model):
     id = models.BigAutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Denormalized from the cart items (sum of quantities and of item totals),
+    # kept up to date by the CartItem signals
+    item_count = models.IntegerField(default=0)
+    subtotal = models.FloatField(default=0)
+
+    def refresh_totals(self):
+        totals = CartItem.objects.filter(cart_id=self.pk).aggregate(
+            item_count=Coalesce(Sum('quantity'), 0),
+            subtotal=Coalesce(Sum('total'), 0.0),
+        )
+        Cart.objects.filter(pk=self.pk).update(**totals)
+        self.item_count = totals['item_count']
+        self.subtotal = totals['subtotal']
 
     def __str__(self):
         return f"{self.user.username}'s Cart"
 
 
 class CartItem(models.Model):
+    class Meta:
+        constraints = [
+            # One line per product, quantities are added up (see app.cart.update_cart)
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     id = models.BigAutoField(primary_key=True)
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -122,6 +174,16 @@ class Enquiry(models.Model):
 
 
 class Order(models.Model):
+    class Meta:
+        indexes = [
+            # Order history and a customer's orders over a period
+            models.Index(fields=['user', 'date'], name='order_user_date_idx'),
+        ]
+        constraints = [
+            # Payments are verified by gateway order id. NULL (not created yet) may repeat
+            models.UniqueConstraint(fields=['razorpay_order_id'], name='unique_razorpay_order_id'),
+        ]
+
     Status = (
         ('Pending', 'Pending'),
         ('Delivered', 'Delivered'),
@@ -159,4 +221,70 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return self.product.name
-    
\ No newline at end of file
+
+
+class SalesRollup(models.Model):
+    """
+    Daily sales of one dimension value (a category, seller, product, payment
+    mode, or all sales) for orders in one status, maintained by app.analytics.
+    Orders are counted in the 'all' and 'payment_mode' rows only, order lines,
+    units and revenue in every dimension.
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key', 'day', 'status'], name='unique_sales_rollup'),
+        ]
+        indexes = [
+            # Top keys of a dimension over a date range
+            models.Index(fields=['dimension', 'day'], name='sales_rollup_dimension_day_idx'),
+        ]
+
+    Dimension = (
+        ('all', 'All'),
+        ('payment_mode', 'Payment mode'),
+        ('category', 'Category'),
+        ('seller', 'Seller'),
+        ('product', 'Product'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    dimension = models.CharField(max_length=16, choices=Dimension)
+    # Category, seller or product id, payment mode, or '' for all sales
+    key = models.CharField(max_length=255, blank=True, default='')
+    day = models.DateField()
+    status = models.CharField(max_length=255, choices=Order.Status)
+    orders = models.IntegerField(default=0)
+    lines = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.day} {self.dimension}={self.key} ({self.status})"
+
+
+class PaymentOutbox(models.Model):
+    """ Gateway orders waiting to be created by the payment worker. """
+    class Meta:
+        verbose_name_plural = "Payment outbox"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+        ]
+
+    Status = (
+        ('Pending', 'Pending'),
+        ('Processing', 'Processing'),
+        ('Done', 'Done'),
+        ('Failed', 'Failed'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    order = models.OneToOneField(Order, on_delete=models.CASCADE)
+    status = models.CharField(max_length=255, choices=Status, default='Pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Order {self.order_id} - {self.status}"
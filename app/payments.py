@@ -0,0 +1,125 @@
+# payments.py
+#
+# Payment gateway access. Requests never talk to Razorpay directly: checkout
+# writes a PaymentOutbox row in its transaction and the payment worker
+# (``manage.py run_payment_worker``) creates the gateway orders with a
+# shared, pooled client, retrying failures with exponential backoff.
+import logging
+import random
+import threading
+from datetime import timedelta
+
+import razorpay
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import Order, PaymentOutbox
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """ Process wide Razorpay client, reusing pooled keep-alive connections. """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.RAZORPAY_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _client = razorpay.Client(
+                    session=session,
+                    auth=(settings.RAZORPAY_KEY, settings.RAZORPAY_SECRET),
+                    base_url=settings.RAZORPAY_BASE_URL,
+                )
+    return _client
+
+
+def enqueue(order):
+    """ Schedule the creation of the gateway order. Call inside the checkout transaction. """
+    return PaymentOutbox.objects.create(order=order)
+
+
+def gateway_order_details(order):
+    return {
+        "amount": int(order.total * 100),  # Amount in paise (1 INR = 100 paise)
+        "currency": 'INR',
+        "receipt": f"order_rcptid_{order.id}",
+    }
+
+
+def backoff(attempts):
+    delay = min(settings.PAYMENT_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.PAYMENT_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def claim_due(limit):
+    """
+    Mark up to ``limit`` due entries as Processing and return them. Entries
+    stuck in Processing longer than the lease (a crashed worker) are
+    claimed again.
+    """
+    now = timezone.now()
+    due = Q(status='Pending', next_attempt_at__lte=now) | Q(
+        status='Processing', updated_at__lt=now - timedelta(seconds=settings.PAYMENT_CLAIM_LEASE)
+    )
+    ids = list(PaymentOutbox.objects.filter(due).order_by('next_attempt_at').values_list('id', flat=True)[:limit])
+
+    claimed = []
+    for entry in PaymentOutbox.objects.filter(id__in=ids).select_related('order'):
+        # Conditional update, only one worker wins an entry
+        won = PaymentOutbox.objects.filter(id=entry.id, status=entry.status, updated_at=entry.updated_at).update(
+            status='Processing', updated_at=now,
+        )
+        if won:
+            claimed.append(entry)
+    return claimed
+
+
+def process(entry):
+    """ Create the gateway order for one claimed outbox entry. """
+    order = entry.order
+    try:
+        razorpay_order = get_client().order.create(
+            {**gateway_order_details(order), "payment_capture": 1},  # Auto-capture the payment
+            timeout=settings.RAZORPAY_TIMEOUT,
+        )
+        razorpay_order_id = razorpay_order['id']
+    except razorpay.errors.BadRequestError as e:
+        # The gateway rejected the request itself, retrying would not help
+        fail(entry, str(e), retry=False)
+        return False
+    except (razorpay.errors.GatewayError, razorpay.errors.ServerError, requests.RequestException, ValueError) as e:
+        fail(entry, str(e) or e.__class__.__name__, retry=True)
+        return False
+    except Exception as e:
+        # Anything else, e.g. a reply without an id, is retried too
+        logger.exception("Unexpected error creating the payment order for order %s", order.pk)
+        fail(entry, repr(e), retry=True)
+        return False
+
+    with transaction.atomic():
+        Order.objects.filter(pk=order.pk).update(razorpay_order_id=razorpay_order_id)
+        PaymentOutbox.objects.filter(pk=entry.pk).update(status='Done', attempts=entry.attempts + 1, last_error='', updated_at=timezone.now())
+    return True
+
+
+def fail(entry, error, retry):
+    attempts = entry.attempts + 1
+    now = timezone.now()
+    if retry and attempts < settings.PAYMENT_MAX_ATTEMPTS:
+        status, next_attempt_at = 'Pending', now + backoff(attempts)
+    else:
+        status, next_attempt_at = 'Failed', entry.next_attempt_at
+    logger.warning("Payment order for order %s failed (attempt %s): %s", entry.order_id, attempts, error)
+    PaymentOutbox.objects.filter(pk=entry.pk).update(
+        status=status, attempts=attempts, next_attempt_at=next_attempt_at, last_error=error, updated_at=now,
+    )
@@ -0,0 +1,174 @@
+# search.py
+#
+# Full-text product search. On SQLite the index is an FTS5 table over the
+# product name and description and the category and seller names, ranked
+# with bm25. Signals keep it in sync with Product, Category and Seller
+# writes, ``manage.py rebuild_search_index`` rebuilds it from scratch.
+# The FTS5 table is created by migration 0007.
+#
+# Postgres uses its own full-text search over the product name and
+# description, ranked with ts_rank, on the GIN expression index of
+# migration 0014 (maintained by Postgres itself). Other database backends
+# have no full-text index: they match a prefix of the product name, which
+# the unique index on it serves on case-insensitive collations (MySQL).
+import re
+
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+from .models import Category, Product, Seller
+
+TABLE = 'app_product_search'
+
+# bm25 column weights: name, description, category, seller
+WEIGHTS = (10.0, 1.0, 3.0, 3.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+# Postgres text search configuration: no stemming nor stop words, as FTS5
+CONFIG = 'simple'
+
+
+def is_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def search_vector():
+    """ The document Postgres searches, also the expression of the GIN index of migration 0014. """
+    from django.contrib.postgres.search import SearchVector
+
+    return SearchVector('name', weight='A', config=CONFIG) + SearchVector('description', weight='B', config=CONFIG)
+
+
+def _reindex(where, params):
+    """ Replace the index rows of the products matching ``where`` (SQL on the product table ``p``). """
+    product, category, seller = Product._meta.db_table, Category._meta.db_table, Seller._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN (SELECT p.id FROM {product} p WHERE {where})", params)
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, name, description, category, seller) "
+            f"SELECT p.id, p.name, p.description, c.name, s.name FROM {product} p "
+            f"JOIN {category} c ON c.id = p.category_id JOIN {seller} s ON s.id = p.seller_id "
+            f"WHERE {where}",
+            params,
+        )
+
+
+def index_product(product_id):
+    if is_enabled():
+        _reindex("p.id = %s", [product_id])
+
+
+def index_category(category_id):
+    if is_enabled():
+        _reindex("p.category_id = %s", [category_id])
+
+
+def index_seller(seller_id):
+    if is_enabled():
+        _reindex("p.seller_id = %s", [seller_id])
+
+
+def remove_product(product_id):
+    if is_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild(chunk_size=10000):
+    """
+    Rebuild the whole index, ``chunk_size`` products per statement, in one
+    transaction: searches see the old index until it is done. Yields the
+    number of products indexed so far.
+    """
+    if not is_enabled():
+        return
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE}")
+
+        indexed, last_id = 0, 0
+        while True:
+            ids = list(Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            _reindex("p.id >= %s AND p.id <= %s", [ids[0], ids[-1]])
+            indexed, last_id = indexed + len(ids), ids[-1]
+            yield indexed
+
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query: every word must match and the last one
+    may be a prefix, so results show up while the user is still typing.
+    """
+    tokens = TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def matching(query):
+    """
+    The ids of every product matching ``query``, unranked and unlimited, as
+    an expression for ``id__in`` filters (SQLite only). None if ``query``
+    has no words.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return None
+    return RawSQL(f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [expression])
+
+
+def search(query, limit, after=None):
+    """
+    ``(rank, id)`` of the products best matching ``query``, best (lowest
+    rank) first, at most ``limit``. ``after`` is the ``(rank, id)`` of the
+    last result of the previous page.
+    """
+    if connection.vendor == 'postgresql':
+        return _search_postgres(query, limit, after)
+    if not is_enabled():
+        query = query.strip()
+        if not query:
+            return []
+        products = Product.objects.filter(name__istartswith=query)
+        if after is not None:
+            products = products.filter(id__gt=after[1])
+        return [(0.0, id) for id in products.order_by('id').values_list('id', flat=True)[:limit]]
+
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    weights = ', '.join(str(weight) for weight in WEIGHTS)
+    sql = f"SELECT rowid AS id, bm25({TABLE}, {weights}) AS score FROM {TABLE} WHERE {TABLE} MATCH %s"
+    params = [expression]
+    if after is not None:
+        sql = f"SELECT id, score FROM ({sql}) WHERE score > %s OR (score = %s AND id > %s)"
+        params += [after[0], after[0], after[1]]
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} ORDER BY score, id LIMIT %s", [*params, limit])
+        return [(score, id) for id, score in cursor.fetchall()]
+
+
+def _search_postgres(query, limit, after):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    # As match_expression(): every word, the last one as a prefix
+    tokens = TOKEN_RE.findall(query)
+    if not tokens:
+        return []
+    search_query = SearchQuery(' & '.join(tokens) + ':*', search_type='raw', config=CONFIG)
+    # ts_rank is a real, read as a double so the cursor's rank compares equal.
+    # Negated: the higher ts_rank, the better, as the lower bm25
+    products = Product.objects.annotate(document=search_vector()).filter(document=search_query).annotate(
+        score=-Cast(SearchRank(F('document'), search_query), FloatField()),
+    )
+    if after is not None:
+        products = products.filter(Q(score__gt=after[0]) | Q(score=after[0], id__gt=after[1]))
+    return list(products.order_by('score', 'id').values_list('score', 'id')[:limit])
@@ -0,0 +1,109 @@
+# seeding.py
+#
+# Row generators of ``manage.py seed_data``.
+#
+# Rows are generated in worker processes, chunk by chunk, and inserted by the
+# main process with bulk_create. Workers never touch the database: rows refer
+# to other rows by their position (e.g. the 3rd seller) and the main process
+# maps positions to the ids it got back from the inserts. Each chunk seeds
+# its own Faker and Random from --seed, the row kind and the chunk start, so
+# the output does not depend on the number of workers. Generated names end
+# with their position, offset by the rows already in the database so that
+# seeding again adds rows rather than clashing with unique names.
+#
+# This module does not import Django models: workers started with the spawn
+# method (the default on macOS and Windows) import it without Django set up.
+import random
+
+from django.utils.text import slugify
+from faker import Faker
+
+ORDER_HISTORY_DAYS = 2 * 365
+
+
+def chunk_generators(seed, kind, start):
+    fake = Faker()
+    fake.seed_instance(f"{seed}:{kind}:{start}")
+    return fake, random.Random(f"{seed}:{kind}:{start}")
+
+
+def generate_users(fake, rng, start, count, params, prefix=''):
+    rows = []
+    for i in range(start, start + count):
+        first_name, last_name = fake.first_name(), fake.last_name()
+        username = f"{prefix}{slugify(first_name + last_name)[:120]}{i}"
+        rows.append((username, f"{username}@{fake.free_email_domain()}", first_name, last_name))
+    return rows
+
+
+def generate_seller_users(fake, rng, start, count, params):
+    return generate_users(fake, rng, start, count, params, prefix='seller-')
+
+
+def generate_categories(fake, rng, start, count, params):
+    return [(f"{fake.word().capitalize()} {i + 1}", fake.text(max_nb_chars=200)) for i in range(start, start + count)]
+
+
+def generate_sellers(fake, rng, start, count, params):
+    return [(f"{fake.company()} {i + 1}", fake.text(max_nb_chars=200)) for i in range(start, start + count)]
+
+
+def generate_products(fake, rng, start, count, params):
+    return [
+        (
+            f"{fake.word().capitalize()} {fake.word()} {i + 1}",
+            fake.text(max_nb_chars=300),
+            rng.randrange(params['categories']),
+            rng.randrange(params['sellers']),
+            round(rng.uniform(10.0, 2500.0), 2),
+        )
+        for i in range(start, start + count)
+    ]
+
+
+def generate_addresses(fake, rng, start, count, params):
+    return [
+        (fake.street_address(), fake.city(), fake.state(), fake.country(), fake.postcode(), fake.numerify('##########'))
+        for _ in range(count)
+    ]
+
+
+def generate_carts(fake, rng, start, count, params):
+    # (user position, [(product position, quantity), ...])
+    return [
+        (i % params['users'], [(p, rng.randint(1, 5)) for p in rng.sample(range(params['products']), min(rng.randint(1, 5), params['products']))])
+        for i in range(start, start + count)
+    ]
+
+
+def generate_orders(fake, rng, start, count, params):
+    # (user position, age in seconds, status, payment mode, [(product position, quantity), ...])
+    rows = []
+    for _ in range(count):
+        items = rng.randint(1, params['items_per_order'])
+        rows.append((
+            rng.randrange(params['users']),
+            rng.randrange(ORDER_HISTORY_DAYS * 24 * 3600),
+            rng.choices(('Delivered', 'Pending', 'Cancelled'), weights=(80, 15, 5))[0],
+            rng.choice(('Online Payment', 'Cash on Delivery')),
+            [(rng.randrange(params['products']), rng.randint(1, 3)) for _ in range(items)],
+        ))
+    return rows
+
+
+GENERATORS = {
+    'users': generate_users,
+    'seller-users': generate_seller_users,
+    'categories': generate_categories,
+    'sellers': generate_sellers,
+    'products': generate_products,
+    'addresses': generate_addresses,
+    'carts': generate_carts,
+    'orders': generate_orders,
+}
+
+
+def generate_chunk(task):
+    kind, start, count, seed, params = task
+    fake, rng = chunk_generators(seed, kind, start)
+    return GENERATORS[kind](fake, rng, start, count, params)
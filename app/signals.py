@@ -1,9 +1,12 @@
 # signals.py
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, pre_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile, Cart
+from .models import Profile, Cart, CartItem, Category, Seller, Product, Order, OrderItem
 from django.core.mail import send_mail
+from . import analytics, catalog_cache, facets, images, search
+from .cart import cart_items_changed
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, **kwargs):
@@ -25,3 +28,216 @@ def create_profile(sender, instance, created, **kwargs):
 def save_profile(sender, instance, **kwargs):
     # Save the profile whenever the user is saved (in case the user profile is updated)
     instance.profile.save()
+
+
+# Catalog cache invalidation
+
+def bump_catalog(*scopes):
+    # Again after commit, in case a read cached a page of the old rows under
+    # the new versions in between
+    catalog_cache.bump(*scopes)
+    transaction.on_commit(lambda: catalog_cache.bump(*scopes))
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_product(sender, instance, **kwargs):
+    # Slug, category, seller or price may change on save: the old URLs have to
+    # be invalidated and the old facet counted out
+    instance._previous = None
+    if instance.pk:
+        instance._previous = Product.objects.filter(pk=instance.pk).values(
+            'slug', 'category__slug', 'category_id', 'seller_id', 'price',
+        ).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    scopes = [catalog_cache.PRODUCTS, catalog_cache.product_scope(instance.slug)]
+
+    category_slug = Category.objects.filter(pk=instance.category_id).values_list('slug', flat=True).first()
+    if category_slug is not None:
+        scopes.append(catalog_cache.category_scope(category_slug))
+
+    previous = getattr(instance, '_previous', None)
+    if previous:
+        scopes += [catalog_cache.product_scope(previous['slug']), catalog_cache.category_scope(previous['category__slug'])]
+
+    bump_catalog(*scopes)
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_slug(sender, instance, **kwargs):
+    instance._catalog_previous = instance._previous_name = None
+    if instance.pk:
+        previous = Category.objects.filter(pk=instance.pk).values_list('slug', 'name').first()
+        if previous:
+            instance._catalog_previous, instance._previous_name = previous
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    scopes = [catalog_cache.CATEGORIES, catalog_cache.PRODUCTS, catalog_cache.category_scope(instance.slug)]
+
+    previous = getattr(instance, '_catalog_previous', None)
+    if previous:
+        scopes.append(catalog_cache.category_scope(previous))
+
+    bump_catalog(*scopes)
+
+
+@receiver(pre_save, sender=Seller)
+def remember_seller_name(sender, instance, **kwargs):
+    instance._previous_name = None
+    if instance.pk:
+        instance._previous_name = Seller.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Seller)
+@receiver(post_delete, sender=Seller)
+def invalidate_seller(sender, instance, **kwargs):
+    scopes = [catalog_cache.PRODUCTS]
+
+    for product_slug, category_slug in Product.objects.filter(seller_id=instance.pk).values_list('slug', 'category__slug'):
+        scopes += [catalog_cache.product_scope(product_slug), catalog_cache.category_scope(category_slug)]
+
+    bump_catalog(*scopes)
+
+
+# Search index
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created, **kwargs):
+    # The category name is indexed with each of its products
+    if not created and getattr(instance, '_previous_name', None) != instance.name:
+        search.index_category(instance.pk)
+
+
+@receiver(post_save, sender=Seller)
+def index_seller_products(sender, instance, created, **kwargs):
+    if not created and getattr(instance, '_previous_name', None) != instance.name:
+        search.index_seller(instance.pk)
+
+
+# Facet counts
+
+@receiver(post_save, sender=Product)
+def count_product_facets(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    key = facets.facet_key(instance.category_id, instance.seller_id, instance.price)
+    if previous:
+        previous_key = facets.facet_key(previous['category_id'], previous['seller_id'], previous['price'])
+        if previous_key == key:
+            return
+        facets.decrement(*previous_key)
+    facets.increment(*key)
+
+
+@receiver(post_delete, sender=Product)
+def uncount_product_facets(sender, instance, **kwargs):
+    facets.decrement(*facets.facet_key(instance.category_id, instance.seller_id, instance.price))
+
+
+# Cart totals
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def update_cart_totals(sender, instance, **kwargs):
+    cart_items_changed(instance.cart_id)
+
+
+# Image variants
+
+# The image name a row was loaded with, so that saves leaving the image alone
+# (e.g. the profile saved with every user) do not look at the files
+
+@receiver(post_init, sender=Product)
+@receiver(post_init, sender=Category)
+@receiver(post_init, sender=Seller)
+@receiver(post_init, sender=Profile)
+def remember_image(sender, instance, **kwargs):
+    value = instance.__dict__.get('image')  # Never trigger a query for a deferred image
+    instance._image_name = getattr(value, 'name', value) if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Seller)
+@receiver(post_save, sender=Profile)
+def generate_image_variants(sender, instance, **kwargs):
+    if 'image' not in instance.__dict__:
+        return  # Deferred and not set, unchanged
+    name = instance.image.name
+    if name != instance._image_name:
+        # The cached catalog pages link the original until the variants exist
+        scopes = image_scopes(instance)
+        images.schedule(name, (lambda: catalog_cache.bump(*scopes)) if scopes else None)
+        instance._image_name = name
+
+
+def image_scopes(instance):
+    """ The catalog scopes of the payloads showing the image of ``instance``. """
+    if isinstance(instance, Product):
+        category_slug = Category.objects.filter(pk=instance.category_id).values_list('slug', flat=True).first()
+        return [catalog_cache.PRODUCTS, catalog_cache.product_scope(instance.slug), catalog_cache.category_scope(category_slug)]
+    if isinstance(instance, Category):
+        return [catalog_cache.CATEGORIES, catalog_cache.category_scope(instance.slug)]
+    return []
+
+
+# Sales rollups. The values an order or order line was loaded with are kept
+# (without a query) to find out what a save changes.
+
+@receiver(post_init, sender=Order)
+def remember_order_rollup_state(sender, instance, **kwargs):
+    values = instance.__dict__  # Never trigger a query for deferred fields
+    instance._rollup_state = (values['status'], values['payment_mode']) if instance.pk and 'status' in values and 'payment_mode' in values else None
+
+
+@receiver(post_save, sender=Order)
+def update_order_rollups(sender, instance, created, **kwargs):
+    state = (instance.status, instance.payment_mode)
+    if created:
+        analytics.order_created(instance)
+    elif instance._rollup_state and instance._rollup_state != state:
+        analytics.order_moved(instance, *instance._rollup_state)
+    instance._rollup_state = state
+
+
+@receiver(pre_delete, sender=Order)
+def uncount_order_rollups(sender, instance, **kwargs):
+    analytics.order_deleted(instance, *(instance._rollup_state or (instance.status, instance.payment_mode)))
+
+
+@receiver(post_init, sender=OrderItem)
+def remember_order_item_rollup_state(sender, instance, **kwargs):
+    values = instance.__dict__
+    fields = ('product_id', 'quantity', 'total')
+    instance._rollup_state = tuple(values[field] for field in fields) if instance.pk and all(field in values for field in fields) else None
+
+
+@receiver(post_save, sender=OrderItem)
+def update_order_item_rollups(sender, instance, created, **kwargs):
+    state = (instance.product_id, instance.quantity, instance.total)
+    if created:
+        analytics.item_changed(instance)
+    elif instance._rollup_state and instance._rollup_state != state:
+        analytics.item_changed(instance, previous=instance._rollup_state)
+    instance._rollup_state = state
+
+
+@receiver(pre_delete, sender=OrderItem)
+def uncount_order_item_rollups(sender, instance, **kwargs):
+    analytics.item_changed(instance, sign=-1)
+
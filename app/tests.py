@@ -1,3 +1,226 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from app import exports, payments
+from app.management.commands import check_query_plans
+from app.models import Address, Cart, CartItem, Category, Enquiry, Order, OrderItem, Product, Profile, Seller
+from app.seeding import generate_chunk
+from app_api.tests import QueryBudgetTestCase
+
+
+class SeedDataTests(TestCase):
+    SCALE = {'users': 4, 'categories': 2, 'sellers': 2, 'products': 6, 'carts': 3, 'orders': 5, 'items_per_order': 2}
+
+    def seed(self, **options):
+        call_command('seed_data', **{**self.SCALE, 'batch_size': 3, 'workers': 1, **options}, stdout=StringIO())
+
+    def counts(self):
+        models = [User, Profile, Cart, Address, Category, Seller, Product, Order]
+        return {model.__name__: model.objects.count() for model in models}
+
+    def test_seeds_the_requested_rows(self):
+        self.seed()
+        users = self.SCALE['users'] + self.SCALE['sellers']
+        self.assertEqual(self.counts(), {
+            'User': users, 'Profile': users, 'Cart': users, 'Address': self.SCALE['users'],
+            'Category': 2, 'Seller': 2, 'Product': 6, 'Order': 5,
+        })
+        self.assertEqual(Cart.objects.filter(item_count__gt=0).count(), len(set(CartItem.objects.values_list('cart', flat=True))))
+        for order in Order.objects.all():
+            self.assertEqual(round(sum(OrderItem.objects.filter(order=order).values_list('total', flat=True)), 2), order.total)
+
+    def test_seeding_again_adds_rows(self):
+        self.seed()
+        first = self.counts()
+        self.seed()
+        self.assertEqual(self.counts(), {model: count * 2 for model, count in first.items()})
+        self.assertEqual(Product.objects.values('slug').distinct().count(), 2 * self.SCALE['products'])
+
+    def test_same_seed_same_rows(self):
+        task = ('products', 0, 3, 7, self.SCALE)
+        self.assertEqual(generate_chunk(task), generate_chunk(task))
+        self.assertNotEqual(generate_chunk(task), generate_chunk(('products', 0, 3, 8, self.SCALE)))
+
+    def test_seeded_users_can_log_in(self):
+        self.seed()
+        user = User.objects.exclude(username__startswith='seller-').first()
+        response = self.client.post('/api/token/', {'username': user.username, 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+
+class StorageProfileTests(unittest.TestCase):
+    # Each test opens scratch databases of its own, so no test database is needed
+    def profile_connection(self, name):
+        """ A connection to a scratch database with the settings of SQLite profile ``name``. """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        alias = f"test-{name}"
+        connections.settings[alias] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {},
+            alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(Path(directory.name) / 'db.sqlite3'), **settings.SQLITE_PROFILES[name]},
+        })[alias]
+
+        def close():
+            connections[alias].close()
+            del connections.settings[alias]
+        self.addCleanup(close)
+        return connections[alias]
+
+    def pragmas(self, connection):
+        with connection.cursor() as cursor:
+            return {
+                pragma: cursor.execute(f"PRAGMA {pragma}").fetchone()[0]
+                for pragma in ('journal_mode', 'synchronous', 'busy_timeout')
+            }
+
+    def test_wal_profile_applies_its_pragmas(self):
+        connection = self.profile_connection('sqlite-wal')
+        # synchronous: 1 is NORMAL
+        self.assertEqual(self.pragmas(connection), {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000})
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_default_profile_keeps_sqlite_defaults(self):
+        # synchronous: 2 is FULL
+        self.assertEqual(self.pragmas(self.profile_connection('sqlite')), {'journal_mode': 'delete', 'synchronous': 2, 'busy_timeout': 5000})
+
+    def test_bench_db_writes(self):
+        out = StringIO()
+        call_command('bench_db_writes', writers=2, readers=1, transactions=5, carts=2, stdout=out)
+        rows = {line.split()[0]: line.split()[1:] for line in out.getvalue().splitlines()[3:] if line.strip()}
+        self.assertEqual(rows.keys(), settings.SQLITE_PROFILES.keys())
+        for name, (commits, failed, *timings) in rows.items():
+            with self.subTest(profile=name):
+                self.assertEqual(int(commits) + int(failed), 2 * 5)
+        self.assertEqual(int(rows['sqlite-wal'][1]), 0)
+
+        with self.assertRaises(CommandError):
+            call_command('bench_db_writes', profiles='nope', stdout=StringIO())
+
+
+class AdminChangelistTests(QueryBudgetTestCase):
+    CHANGELISTS = ['/admin/app/order/', '/admin/app/product/', '/admin/auth/user/', '/admin/app/address/', '/admin/app/enquiry/', '/admin/app/paymentoutbox/']
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password123'))
+
+    def changelist_queries(self, path):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_queries_do_not_grow_with_the_rows(self):
+        before = {path: self.changelist_queries(path) for path in self.CHANGELISTS}
+        for n in range(5):
+            user = User.objects.create_user(f'buyer{n}', f'buyer{n}@example.com', 'password123')
+            address = Address.objects.create(user=user, address='2 Main St', city='Pune', state='MH', country='IN', pincode='411001', phone='8888888888')
+            order = Order.objects.create(user=user, address=address, total=100, payment_mode='Cash on Delivery', amount_paid=0, amount_due=100, status='Pending')
+            payments.enqueue(order)
+            Enquiry.objects.create(user=user, name='Buyer', email=user.email, subject='Hello', message='Hi')
+            Product.objects.create(user=user, name=f'Boot {n}', description='Product', category=self.category, seller=self.seller, price=50)
+        after = {path: self.changelist_queries(path) for path in self.CHANGELISTS}
+        self.assertEqual(after, before)
+
+    def test_unfiltered_count_is_estimated(self):
+        with mock.patch('app.admin.estimated_count', return_value=5_000_000) as estimate:
+            response = self.client.get('/admin/app/order/')
+            self.assertEqual(response.context['cl'].result_count, 5_000_000)
+            # Filtered lists are counted
+            response = self.client.get('/admin/app/order/?status__exact=Pending')
+            self.assertEqual(response.context['cl'].result_count, self.ORDERS)
+        self.assertEqual(estimate.call_count, 1)
+
+    def test_small_tables_are_counted(self):
+        with mock.patch('app.admin.estimated_count', return_value=50):
+            response = self.client.get('/admin/app/order/')
+        self.assertEqual(response.context['cl'].result_count, self.ORDERS)
+
+    def test_search_by_username(self):
+        response = self.client.get('/admin/app/order/', {'q': 'customer'})
+        self.assertEqual(response.context['cl'].result_count, self.ORDERS)
+
+    def test_user_search_uses_indexes(self):
+        request = RequestFactory().get('/admin/')
+        queryset, _ = admin.site._registry[User].get_search_results(request, User.objects.all(), 'customer')
+        sql, params = queryset.query.sql_with_params()
+        self.assertEqual(check_query_plans.full_scans(sql, params), [])
+        response = self.client.get('/admin/auth/user/', {'q': self.user.email})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class ExportTests(QueryBudgetTestCase):
+
+    def export(self, name, format, chunk_size=2):
+        with CaptureQueriesContext(connection) as context:
+            content = ''.join(exports.lines(name, format, chunk_size=chunk_size))
+        return content, len(context)
+
+    def test_orders_csv_has_a_line_per_item(self):
+        content, queries = self.export('orders', 'csv')
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(len(rows), self.ORDERS * self.ITEMS_PER_ORDER)
+        self.assertEqual(
+            (rows[0]['username'], rows[0]['city'], rows[0]['razorpay_order_id'], rows[0]['product'], rows[0]['quantity']),
+            ('customer', 'Bengaluru', 'order_0', 'Shoe 0', '1'),
+        )
+        # The orders query, then an items query per chunk of 2 orders
+        self.assertEqual(queries, 3)
+
+    def test_orders_ndjson_nests_the_items(self):
+        content, queries = self.export('orders', 'ndjson', chunk_size=1000)
+        orders = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([order['razorpay_order_id'] for order in orders], ['order_0', 'order_1', 'order_2'])
+        self.assertEqual([item['product'] for item in orders[0]['items']], ['Shoe 0', 'Shoe 1', 'Shoe 2'])
+        self.assertEqual(queries, 2)
+
+    def test_queries_do_not_grow_with_the_rows(self):
+        content, queries = self.export('products', 'csv', chunk_size=1000)
+        self.assertEqual((content.count('\n'), queries), (self.PRODUCTS + 1, 1))
+        Product.objects.bulk_create([
+            Product(user=self.staff, name=f'Boot {i}', slug=f'boot-{i}', description='Product', category=self.category, seller=self.seller, price=50)
+            for i in range(20)
+        ])
+        content, queries = self.export('products', 'csv', chunk_size=1000)
+        self.assertEqual((content.count('\n'), queries), (self.PRODUCTS + 21, 1))
+
+    def test_enquiries_without_a_user_and_formulas(self):
+        Enquiry.objects.create(user=self.user, subject='Sizes', message='Do you have 46?')
+        Enquiry.objects.create(name='Guest', subject='=HYPERLINK("http://example.com")', message='@SUM(A1)')
+        rows = list(csv.DictReader(StringIO(self.export('enquiries', 'csv')[0])))
+        self.assertEqual([row['username'] for row in rows], ['customer', ''])
+        self.assertEqual((rows[1]['subject'], rows[1]['message']), ('\'=HYPERLINK("http://example.com")', "'@SUM(A1)"))
+        # Not in JSON, which no spreadsheet evaluates
+        self.assertEqual(json.loads(self.export('enquiries', 'ndjson')[0].splitlines()[1])['subject'], '=HYPERLINK("http://example.com")')
+
+    def test_admin_action_streams_the_selection(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password123')
+        self.client.force_login(admin_user)
+        order = Order.objects.order_by('id')[1]
+        response = self.client.post('/admin/app/order/', {'action': 'export_ndjson', '_selected_action': [order.id]})
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['order_id'] for line in lines], [order.id])
+
+    def test_command_writes_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'enquiries.csv')
+            call_command('export_data', 'enquiries', '--output', path, stderr=StringIO())
+            with open(path) as f:
+                self.assertEqual(f.readline().strip(), 'id,date,username,name,email,subject,message')
@@ -7,6 +7,13 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from rest_framework.renderers import JSONRenderer
+from django.conf import settings
+from django.views.decorators.http import require_GET
+from . import metrics
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 def home(request):
@@ -35,7 +42,6 @@ def home(request):
     return render(request, 'home.html', {'form': form})
 
 def about(request):
-    print("About")
     return render(request, 'about.html', {'name': 'MicroDegree'})
 
 def contact(request):
@@ -65,7 +71,6 @@ def sign_in(request):
     if request.method == 'POST':
         username = request.POST['username']
         password = request.POST['password']
-        print(username, password)
 
         user = authenticate(request, username=username, password=password) # Checks for valid credentials
 
@@ -73,6 +78,7 @@ def sign_in(request):
             login(request, user) # Creates login session
             return redirect('home')
         
+        logger.info("Failed sign in for %s", username)
         messages.error(request, 'Invalid username or password')
         return redirect('signin')
     return render(request, 'sign-in.html')
@@ -120,3 +126,18 @@ def profile_order_detail(request, order_id):
 
 def employee_details(request, emp_id=None):
     return HttpResponse(f"Details of employee {emp_id}")
+
+
+def metrics_allowed(request):
+    # Internal latency and query data: the scraper's bearer token, else staff
+    # users, or anyone in DEBUG when no token is configured
+    if settings.METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}")
+    return settings.DEBUG or request.user.is_staff
+
+
+@require_GET
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponse(status=401 if settings.METRICS_TOKEN else 403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
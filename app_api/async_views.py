@@ -0,0 +1,281 @@
+# async_views.py
+#
+# Async versions of the catalog, cart and order history endpoints, served
+# instead of the views in views.py when ASYNC_API is set (see urls.py). Run
+# them under ASGI (uvicorn), where a request waiting on the database or the
+# cache does not hold a thread. They return the same payloads as the sync
+# views, as JSON.
+#
+#   - Authentication, the catalog cache and the reads use the async cache and
+#     ORM APIs.
+#   - Cart writes need transactions, which the async ORM does not support:
+#     they run in a thread (sync_to_async).
+#   - Catalog listings are served from the catalog cache; on a miss the page
+#     is built by the sync view, in a thread, as its paginators and facet
+#     counts are sync.
+#
+# The payment gateway is never called while serving a request: checkout
+# queues the gateway order and the payment worker creates it.
+import json
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.urls import path
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.permissions import SAFE_METHODS
+
+from app import catalog_cache, db_router
+from app.cart import CartError
+from app.cart_store import get_store
+from app.models import Category, Order, OrderItem, Product
+from . import sparse, views
+from .authentication import CachedJWTAuthentication
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return JsonResponse(data, status=status_code, safe=False)
+
+
+def cached_response(data, hit):
+    response = json_response(data)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+async def catalog_response(request, scopes, build):
+    """ views.catalog_response() with the async cache, ``build`` is a coroutine function. """
+    key = request.build_absolute_uri()
+    versions = await catalog_cache.aget_versions(*scopes)
+    etag = catalog_cache.etag(scopes, key, versions)
+    response = views.not_modified(request, etag)
+    if response is None:
+        response = cached_response(*await catalog_cache.aget_or_build(scopes, key, build, versions, store=views.cacheable(versions)))
+    return views.with_validators(response, etag)
+
+
+def error_response(exc):
+    # Same body as DRF's exception handler
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(data, exc.status_code)
+
+
+class AsyncAPIView(View):
+    """
+    Base of the async views: JWT authentication (authenticated users only),
+    JSON bodies, DRF style errors. Set ``replica_reads`` to serve the safe
+    requests from the read replica, like views.ReplicaReadMixin.
+    """
+    authentication = CachedJWTAuthentication()
+    replica_reads = False
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Token authenticated like the DRF views, no CSRF
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            auth = await self.authentication.aauthenticate(request)
+        except APIException as e:
+            return error_response(e)
+        if auth is None:
+            response = json_response({'detail': "Authentication credentials were not provided."}, status.HTTP_401_UNAUTHORIZED)
+            response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+            return response
+        request.user, request.auth = auth
+
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or handler is None:
+            return json_response({'detail': f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        with ExitStack() as stack:
+            if request.method in SAFE_METHODS and self.replica_reads and db_router.replica_configured() and not await db_router.ais_sticky(request.user):
+                stack.enter_context(db_router.replica_reads())
+            try:
+                return await handler(request, *args, **kwargs)
+            except APIException as e:
+                return error_response(e)
+
+    def data(self, request):
+        if request.content_type == 'application/json':
+            try:
+                return json.loads(request.body or b'{}')
+            except ValueError as e:
+                raise ParseError(f"JSON parse error - {e}")
+        return request.POST.dict()
+
+    def validated(self, serializer_class, request):
+        serializer = serializer_class(data=self.data(request))
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+
+###### Catalog ##########
+
+class CategoryView(AsyncAPIView):
+    replica_reads = True
+
+    async def get(self, request):
+        async def build():
+            serializer = views.CategorySerializer(many=True, context=sparse.context(request))
+            serializer.instance = [category async for category in sparse.prune(Category.objects.all(), serializer)]
+            return serializer.data
+
+        return await catalog_response(request, [catalog_cache.CATEGORIES], build)
+
+
+class ProductView(AsyncAPIView):
+
+    async def get(self, request, category_slug, product_slug):
+        async def build():
+            product = await Product.objects.select_related('category', 'seller').aget(slug=product_slug, category__slug=category_slug)
+            return views.ProductSerializer(product, context=sparse.context(request)).data
+
+        scopes = [catalog_cache.product_scope(product_slug), catalog_cache.category_scope(category_slug)]
+        try:
+            return await catalog_response(request, scopes, build)
+        except Product.DoesNotExist:
+            return json_response({'detail': "Not found."}, status.HTTP_404_NOT_FOUND)
+
+
+class CachedListingView(AsyncAPIView):
+    """ A catalog listing: 304s and cache hits are served here, misses by ``sync_view`` in a thread. """
+    sync_view = None
+
+    def scopes(self, **kwargs):
+        raise NotImplementedError
+
+    async def get(self, request, **kwargs):
+        scopes, key = self.scopes(**kwargs), request.build_absolute_uri()
+        versions = await catalog_cache.aget_versions(*scopes)
+        etag = catalog_cache.etag(scopes, key, versions)
+        response = views.not_modified(request, etag)
+        if response is not None:
+            return views.with_validators(response, etag)
+        data = await catalog_cache.aget(scopes, key, versions)
+        if data is not None:
+            return views.with_validators(cached_response(data, True), etag)
+        return await sync_to_async(self.sync_view)(request, **kwargs)
+
+
+class ProductsView(CachedListingView):
+    replica_reads = True
+    sync_view = staticmethod(views.ProductsView.as_view())
+
+    def scopes(self):
+        return [catalog_cache.PRODUCTS]
+
+
+class CategoryProductsView(CachedListingView):
+    sync_view = staticmethod(views.CategoryProductsView.as_view())
+
+    def scopes(self, category_slug):
+        return [catalog_cache.category_scope(category_slug)]
+
+###### End of Catalog ##########
+
+
+
+####### Cart #########
+
+class CartView(AsyncAPIView):
+
+    async def get(self, request):
+        items = await get_store().aitems(request.user)
+        if items is None:
+            return json_response({"error": "Cart not found"}, status.HTTP_404_NOT_FOUND)
+        return json_response(views.CartSerializer({'cart_items': items}).data)
+
+
+class CartSummaryView(AsyncAPIView):
+
+    async def get(self, request):
+        summary = await get_store().asummary(request.user)
+        if summary is None:
+            return json_response({"error": "Cart not found"}, status.HTTP_404_NOT_FOUND)
+        return json_response(views.CartSummarySerializer({'item_count': summary[0], 'subtotal': summary[1]}).data)
+
+
+class AddToCartView(AsyncAPIView):
+
+    async def post(self, request):
+        serializer = self.validated(views.AddToCartSerializer, request)
+        try:
+            await sync_to_async(get_store().update)(request.user, [{'action': 'add', **serializer.validated_data}])
+        except CartError:
+            raise serializers.ValidationError({'product_id': ["Product does not exist"]})
+        return json_response(serializer.data)
+
+
+class CartBatchView(AsyncAPIView):
+
+    async def post(self, request):
+        serializer = self.validated(views.CartBatchSerializer, request)
+        store = get_store()
+        try:
+            await sync_to_async(store.update)(request.user, serializer.validated_data['changes'])
+        except CartError as e:
+            return json_response({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+        return json_response(views.CartSerializer({'cart_items': await store.aitems(request.user)}).data)
+
+
+class RemoveFromCartView(AsyncAPIView):
+
+    async def post(self, request):
+        serializer = self.validated(views.RemoveFromCartSerializer, request)
+        if not await sync_to_async(get_store().remove)(request.user, **serializer.validated_data):
+            raise serializers.ValidationError({'cartitem_id': ["Cart item does not exist"]})
+        return json_response(serializer.data)
+
+####### End of Cart ######
+
+
+
+######## Orders ###########
+
+class OrdersView(AsyncAPIView):
+    replica_reads = True
+    sync_view = staticmethod(views.OrdersView.as_view())
+
+    async def get(self, request):
+        # Two queries whatever the number of orders, as in views.OrdersView
+        orders = Order.objects.filter(user=request.user).prefetch_related(
+            Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product__seller'))
+        )
+        serializer = views.OrderSerializer(many=True, context=sparse.context(request))
+        serializer.instance = [order async for order in sparse.prune(orders, serializer)]
+        return json_response(serializer.data)
+
+    async def post(self, request):
+        return await sync_to_async(self.sync_view)(request)
+
+######## End of Orders ########
+
+
+# url name -> async view, replacing the sync view of the route when ASYNC_API is set
+VIEWS = {
+    'categories': CategoryView,
+    'products': ProductsView,
+    'category': CategoryProductsView,
+    'product': ProductView,
+    'cart': CartView,
+    'cart_summary': CartSummaryView,
+    'add_to_cart': AddToCartView,
+    'cart_batch': CartBatchView,
+    'remove_from_cart': RemoveFromCartView,
+    'profile_orders': OrdersView,
+}
+
+
+def replace_views(urlpatterns):
+    """ ``urlpatterns`` with the routes in VIEWS served by their async view. """
+    return [
+        path(str(pattern.pattern), VIEWS[pattern.name].as_view(), name=pattern.name) if pattern.name in VIEWS else pattern
+        for pattern in urlpatterns
+    ]
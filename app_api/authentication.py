@@ -0,0 +1,187 @@
+# authentication.py
+#
+# JWT authentication resolving users from a cache instead of loading the user
+# row on every request. Users are cached in two layers:
+#
+#   - the Django cache, for AUTH_USER_CACHE_TIMEOUT seconds, shared by the
+#     processes when the cache is,
+#   - a per-process dict, for AUTH_USER_LOCAL_TIMEOUT seconds and at most
+#     AUTH_USER_LOCAL_MAX_USERS users, so most requests do not even reach
+#     the cache backend.
+#
+# Every request gets its own copy of the user, so what a request caches on
+# it (permissions, related objects) is not seen by the others.
+#
+# Each user has a generation number, bumped by the User signals (save,
+# deactivation, password change, delete, see app_api/signals.py). Cached
+# entries of an older generation are ignored. Other processes drop their
+# per-process entries after AUTH_USER_LOCAL_TIMEOUT at the latest.
+#
+# Generations start from the clock, like the catalog cache versions: one
+# evicted from the cache never comes back with a number already handed out,
+# so they also serve as the profile's ETag.
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from app import async_cache
+
+_local = OrderedDict()  # user id -> (expires at, generation, user), in expiry order
+_local_lock = threading.Lock()
+
+
+def _user_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def _generation_key(user_id):
+    return f"auth:user-generation:{user_id}"
+
+
+def _new_generation():
+    return time.time_ns()
+
+
+def generation(user_id):
+    """ The current generation of the user's cached copies. """
+    key = _generation_key(user_id)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _new_generation(), None)
+        value = cache.get(key, 0)
+    return value
+
+
+async def ageneration(user_id):
+    key = _generation_key(user_id)
+    value = await async_cache.aget(key)
+    if value is None:
+        await async_cache.aadd(key, _new_generation(), None)
+        value = await async_cache.aget(key, 0)
+    return value
+
+
+def invalidate(user_id):
+    """ Make the cached copies of the user stale, in every process. """
+    key = _generation_key(user_id)
+    cache.add(key, _new_generation(), None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted in between
+        cache.set(key, _new_generation(), None)
+    cache.delete(_user_key(user_id))
+    with _local_lock:
+        _local.pop(str(user_id), None)
+
+
+def clear_local():
+    with _local_lock:
+        _local.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def local_user(self, user_id):
+        entry = _local.get(str(user_id))
+        if entry and entry[0] > time.monotonic():
+            return copy.copy(entry[2])
+        return None
+
+    def remember(self, user_id, generation, user):
+        """ Keep ``user`` in the per-process dict and return a copy of it for the request. """
+        now = time.monotonic()
+        with _local_lock:
+            _local[str(user_id)] = (now + settings.AUTH_USER_LOCAL_TIMEOUT, generation, user)
+            _local.move_to_end(str(user_id))
+            # Every entry lives as long, the first ones expire first
+            while _local and (len(_local) > settings.AUTH_USER_LOCAL_MAX_USERS or next(iter(_local.values()))[0] <= now):
+                _local.popitem(last=False)
+        return copy.copy(user)
+
+    def cached_user(self, user_id, cached, generation):
+        """ The user from the cache entries of ``user_id``, None if missing or of another generation. """
+        user_entry = cached.get(_user_key(user_id))
+        if user_entry and user_entry[0] == generation:
+            return user_entry[1]
+        return None
+
+    def load_user(self, user_id):
+        """ The user with ``user_id`` from the per-process dict, the cache, then the database. """
+        user = self.local_user(user_id)
+        if user is not None:
+            return user
+
+        cached = cache.get_many([_generation_key(user_id), _user_key(user_id)])
+        current = cached.get(_generation_key(user_id)) or generation(user_id)
+        user = self.cached_user(user_id, cached, current)
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            # add(): a concurrent invalidation wins over this (maybe already stale) copy
+            cache.add(_user_key(user_id), (current, user), settings.AUTH_USER_CACHE_TIMEOUT)
+
+        return self.remember(user_id, current, user)
+
+    async def aload_user(self, user_id):
+        """ load_user() with the async cache and ORM APIs. """
+        user = self.local_user(user_id)
+        if user is not None:
+            return user
+
+        cached = await async_cache.aget_many([_generation_key(user_id), _user_key(user_id)])
+        current = cached.get(_generation_key(user_id)) or await ageneration(user_id)
+        user = self.cached_user(user_id, cached, current)
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            await async_cache.aadd(_user_key(user_id), (current, user), settings.AUTH_USER_CACHE_TIMEOUT)
+
+        return self.remember(user_id, current, user)
+
+    def user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def check_user(self, validated_token, user):
+        # Same checks as JWTAuthentication.get_user
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def get_user(self, validated_token):
+        return self.check_user(validated_token, self.load_user(self.user_id(validated_token)))
+
+    async def aauthenticate(self, request):
+        """ authenticate() for async views, taking a Django request. """
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        user = await self.aload_user(self.user_id(validated_token))
+        return self.check_user(validated_token, user), validated_token
@@ -0,0 +1,121 @@
+# listing.py
+#
+# Serializer-free product listing pages. Rows are read with values_list()
+# (category and seller names joined in) and turned into payload dicts by a
+# transformer compiled once, instead of a model instance and a
+# ProductSerializer with its field objects per row. The payload has the shape
+# of views.ProductSerializer. A ``?fields=`` selection (see sparse.py) reads
+# and renders only the columns of the fields asked for. There are no
+# optional fields, an ``?include=`` of any is rejected.
+import functools
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+
+from app import images
+from . import sparse
+
+
+def compile_transformer(columns, fields):
+    """
+    A function turning a row of ``columns`` into a payload dict. ``fields``
+    are (key, column, convert) triples, ``convert`` (or None) taking the
+    column's value and the file URL function of the page (see file_urls()).
+    """
+    index = {column: n for n, column in enumerate(columns)}
+    spec = tuple((key, index[column], convert) for key, column, convert in fields)
+
+    def transform(row, url):
+        return {key: row[n] if convert is None else convert(row[n], url) for key, n, convert in spec}
+
+    return transform
+
+
+def file_urls(build_url=None):
+    """
+    A function of a stored file name to its URL, absolute with ``build_url``:
+    default_storage.url(), without its urljoin() per file for the file system
+    storage.
+    """
+    storage = default_storage
+    if isinstance(storage, FileSystemStorage):
+        prefix = build_url(storage.base_url) if build_url else storage.base_url
+        return lambda name: prefix + filepath_to_uri(name).lstrip('/')
+    if build_url:
+        return lambda name: build_url(storage.url(name))
+    return storage.url
+
+
+def image_url(name, url):
+    return url(name) if name else None
+
+
+def variant_urls(name, url):
+    return images.variant_urls(name, url=url)
+
+
+def iso_datetime(value, url):
+    # As rest_framework's DateTimeField: in the current time zone, UTC as Z
+    value = timezone.localtime(value).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+PRODUCT_FIELDS = (
+    ('id', 'id', None),
+    ('name', 'name', None),
+    ('slug', 'slug', None),
+    ('description', 'description', None),
+    ('category', 'category_id', None),
+    ('category_name', 'category__name', None),
+    ('seller', 'seller_id', None),
+    ('seller_name', 'seller__name', None),
+    ('price', 'price', None),
+    ('image', 'image', image_url),
+    ('image_variants', 'image', variant_urls),
+    ('updated_at', 'updated_at', iso_datetime),
+)
+
+# Fields ?include= can add: none, every field is in the payload by default
+OPTIONAL_FIELDS = ()
+
+# Read even when not rendered: the keyset paginators seek on them
+ORDERING_COLUMNS = ('id', 'price')
+
+
+@functools.lru_cache
+def product_transformer(keys=None):
+    """ ``(columns, transform)`` for the payload fields ``keys`` (a frozenset, None for all). """
+    fields = [field for field in PRODUCT_FIELDS if keys is None or field[0] in keys]
+    columns = tuple(dict.fromkeys(ORDERING_COLUMNS + tuple(column for key, column, convert in fields)))
+    return columns, compile_transformer(columns, fields)
+
+
+def _keys(fields):
+    if not fields:
+        return None
+    sparse.unknown_fields(fields, [key for key, column, convert in PRODUCT_FIELDS])
+    return frozenset(fields)
+
+
+def requested(request):
+    """ The ``?fields=`` tree of ``request``, a 400 for an ``?include=`` of fields listings do not have. """
+    fields, include = sparse.requested(request)
+    sparse.unknown_fields(include, OPTIONAL_FIELDS, param='include')
+    return fields
+
+
+def product_rows(queryset, fields=None):
+    """ ``queryset`` of products as the rows products() takes (named, for the keyset paginators). """
+    columns, transform = product_transformer(_keys(fields))
+    return queryset.values_list(*columns, named=True)
+
+
+def products(rows, build_url=None, fields=None):
+    """
+    The payloads of product ``rows``, image URLs made absolute with
+    ``build_url`` if given, with only ``fields`` (a sparse.parse() tree) if given.
+    """
+    columns, transform = product_transformer(_keys(fields))
+    url = file_urls(build_url)
+    return [transform(row, url) for row in rows]
@@ -0,0 +1,167 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import FloatField, IntegerField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over a unique, indexed ordering.
+
+    A page is selected with a WHERE on the last row of the previous page
+    instead of an OFFSET, and no COUNT(*) is run, so a deep page costs the
+    same as the first one. Cursors are opaque to clients.
+    """
+    ordering = ('id',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        if reverse:
+            queryset = queryset.order_by(*('-' + field for field in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if position is not None:
+            queryset = queryset.filter(self.seek(self.ordering, position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_position = self.previous_position = None
+        if rows:
+            if has_more or reverse:
+                self.next_position = self.get_position(rows[-1])
+            if position is not None and (has_more or not reverse):
+                self.previous_position = self.get_position(rows[0])
+
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.next_position, False))
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.previous_position, True))
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return [row[field] for field in self.ordering]
+        return [getattr(row, field) for field in self.ordering]
+
+    def seek(self, fields, position, reverse):
+        """
+        Rows strictly after ``position`` in ``fields`` order, written as
+        ``a >= x AND (a > x OR (b > y))`` so the leading column stays usable
+        for an index range scan.
+        """
+        op = 'lt' if reverse else 'gt'
+        first, value = fields[0], position[0]
+        if len(fields) == 1:
+            return Q(**{f'{first}__{op}': value})
+        return Q(**{f'{first}__{op}e': value}) & (
+            Q(**{f'{first}__{op}': value}) | (Q(**{first: value}) & self.seek(fields[1:], position[1:], reverse))
+        )
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        """ ``(position, reverse)`` of the request's cursor, its values converted to the ordering fields of ``model``. """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            position, reverse = payload['p'], bool(payload['r'])
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = self.convert_position(position, model)
+        except ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def convert_position(self, position, model):
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, position)]
+
+
+class ProductsPaginator(KeysetPagination):
+    ordering = ('price', 'id')
+
+
+class CategoryProductsPaginator(KeysetPagination):
+    ordering = ('id',)
+
+
+class ProductSearchPaginator(KeysetPagination):
+    """
+    Keyset pagination of ranked search results (see app/search.py), seeking
+    on the ``(rank, id)`` of the last result instead of a queryset. Pages go
+    forward only: there is no previous link.
+    """
+    ordering = ('rank', 'id')
+    position_fields = (FloatField(), IntegerField())
+
+    def paginate_results(self, fetch, request):
+        """ A page of ``(rank, id)`` results, ``fetch(limit, after)`` returning the ones after position ``after``. """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, None)
+        if reverse:
+            raise NotFound(self.invalid_cursor_message)
+
+        results = fetch(self.page_size + 1, position)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.previous_position = None
+        self.next_position = self.get_position(results[-1]) if has_more else None
+        return results
+
+    def get_position(self, row):
+        return list(row)
+
+    def convert_position(self, position, model):
+        return [field.to_python(value) for field, value in zip(self.position_fields, position)]
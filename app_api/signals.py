@@ -0,0 +1,33 @@
+# signals.py
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import authentication
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Covers profile edits, deactivation and password changes (set_password
+    # + save). Again after commit, in case a request cached the old row
+    # in between.
+    authentication.invalidate(instance.pk)
+    transaction.on_commit(lambda: authentication.invalidate(instance.pk))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    # Groups and permissions are part of the profile, whose ETag is the generation
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            authentication.invalidate(instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        for user_id in pk_set:
+            authentication.invalidate(user_id)
+    elif action == 'pre_clear':
+        # A group or permission losing its users, unknown once cleared
+        for user_id in instance.user_set.values_list('pk', flat=True):
+            authentication.invalidate(user_id)
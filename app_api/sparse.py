@@ -0,0 +1,114 @@
+# sparse.py
+#
+# Sparse fieldsets for API responses:
+#
+#   ?fields=id,total,order_items.product   only these fields (dotted paths
+#                                          select the fields of a nested one)
+#   ?include=groups                        add fields a serializer leaves out
+#                                          by default (Meta.optional_fields)
+#
+# Serializers opt in with SparseFieldsMixin and get the request's selection
+# in their context (context(request)). Views pass their querysets through
+# prune() so the fields left out are not loaded either: columns are deferred
+# and unused prefetches dropped.
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def parse(value):
+    """ 'a,b.c,b.d' -> {'a': {}, 'b': {'c': {}, 'd': {}}}, None for no value. """
+    if not value:
+        return None
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def requested(request):
+    """ The ``(fields, include)`` trees of ``request``'s query string. """
+    return parse(request.GET.get('fields')), parse(request.GET.get('include'))
+
+
+def context(request):
+    """ Serializer context carrying the selection of ``request``. """
+    return {'sparse': requested(request)}
+
+
+def unknown_fields(selected, available, param='fields'):
+    unknown = set(selected or ()) - set(available)
+    if unknown:
+        raise serializers.ValidationError({param: f"Unknown fields: {', '.join(sorted(unknown))}"})
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin dropping the fields the request did not ask for, and
+    the optional ones (Meta.optional_fields) unless included, from its output.
+    Nested sparse serializers get the dotted paths under their name.
+    """
+    sparse = None  # (fields, include) trees, set by the parent serializer when nested
+
+    def get_sparse(self):
+        if self.sparse is not None:
+            return self.sparse
+        return self.context.get('sparse') or (None, None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Writes validate every field
+        if hasattr(self.root, 'initial_data'):
+            return fields
+
+        selected, included = self.get_sparse()
+        included = included or {}
+        unknown_fields(selected, fields)
+
+        optional = getattr(self.Meta, 'optional_fields', ())
+        for name in list(fields):
+            if selected is not None and name not in selected:
+                del fields[name]
+            elif selected is None and name in optional and name not in included:
+                del fields[name]
+
+        for name, field in fields.items():
+            nested = getattr(field, 'child', field)
+            if isinstance(nested, SparseFieldsMixin):
+                nested.sparse = ((selected or {}).get(name) or None, included.get(name) or {})
+        return fields
+
+
+def _serializer(serializer):
+    return getattr(serializer, 'child', serializer)
+
+
+def prune(queryset, serializer):
+    """
+    ``queryset`` loading only what the fields of ``serializer`` (after
+    SparseFieldsMixin) read: the other columns are deferred and the
+    prefetches of relations not serialized are dropped.
+    """
+    fields = _serializer(serializer).fields.values()
+    sources = {field.source_attrs[0] for field in fields if field.source_attrs}
+    if any(not field.source_attrs for field in fields):
+        # A source='*' field may read anything
+        return queryset
+
+    model = queryset.model
+    columns = [model._meta.pk.name]
+    for source in sources:
+        try:
+            field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete and not field.many_to_many:
+            columns.append(source)
+
+    prefetches = [
+        lookup for lookup in queryset._prefetch_related_lookups
+        if getattr(lookup, 'prefetch_through', lookup).split('__')[0] in sources
+    ]
+    return queryset.prefetch_related(None).prefetch_related(*prefetches).only(*columns)
@@ -1,3 +1,1209 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import Group, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import F
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app import analytics, benchmark, cart, catalog_cache, images, metrics, payments, search
+from app.management.commands import check_query_plans
+from app.management.commands.fake_razorpay import FakeRazorpayHandler
+from app.models import Category, Seller, Product, Address, Cart, CartItem, Order, OrderItem, PaymentOutbox, SalesRollup
+from . import async_views, authentication, listing, urls, views
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Base test case to assert the number of SQL queries a request runs.
+
+    The fixture is deliberately larger than one row per table so a query
+    issued per row (N+1) shows up as a budget overflow.
+    """
+    ORDERS = 3
+    ITEMS_PER_ORDER = 3
+    PRODUCTS = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'password123', is_staff=True)
+        seller_user = User.objects.create_user('seller', 'seller@example.com', 'password123')
+        cls.seller = Seller.objects.create(user=seller_user, name='Acme', description='Seller')
+        cls.category = Category.objects.create(name='Shoes', description='Category')
+        cls.products = [
+            Product.objects.create(user=seller_user, name=f'Shoe {i}', description='Product', category=cls.category, seller=cls.seller, price=100 + i)
+            for i in range(cls.PRODUCTS)
+        ]
+        cls.address = Address.objects.create(user=cls.user, address='1 Main St', city='Bengaluru', state='KA', country='IN', pincode='560001', phone='9999999999')
+
+        cls.cart = Cart.objects.get(user=cls.user)
+        cls.cart_items = [
+            CartItem.objects.create(cart=cls.cart, product=product, quantity=2, total=product.price * 2)
+            for product in cls.products[:3]
+        ]
+
+        cls.orders = []
+        for n in range(cls.ORDERS):
+            order = Order.objects.create(
+                user=cls.user, address=cls.address, total=300, payment_mode='Online Payment', amount_paid=0,
+                amount_due=300, status='Pending', razorpay_order_id=f'order_{n}',
+            )
+            cls.orders.append(order)
+            PaymentOutbox.objects.create(order=order, status='Done', attempts=1)
+            for product in cls.products[:cls.ITEMS_PER_ORDER]:
+                OrderItem.objects.create(order=order, product=product, quantity=1, total=product.price)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def assertMaxQueries(self, budget, method, path, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data, format='json')
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context), budget,
+            f"{method.upper()} {path} ran {len(context)} queries, budget is {budget}:\n{queries}",
+        )
+        return response
+
+
+def razorpay_signature(order_id, payment_id):
+    message = f"{order_id}|{payment_id}".encode()
+    return hmac.new(settings.RAZORPAY_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+
+class EndpointQueryBudgetTests(QueryBudgetTestCase):
+    # url name -> (method, path, data, max queries). Every route in
+    # app_api/urls.py must have an entry, so new endpoints get a budget too.
+    # Path and data may be callables taking the test case, for fixture-dependent ids.
+    BUDGETS = {
+        'products': ('get', '/api/products/?price=under-500', None, 4),
+        'product_search': ('get', '/api/products/search/?q=shoe', None, 2),
+        'category': ('get', '/api/products/shoes', None, 1),
+        'product': ('get', '/api/products/shoes/shoe-1', None, 1),
+        'categories': ('get', '/api/categories/', None, 1),
+        'register': ('post', '/api/register/', {'username': 'newbie', 'email': 'newbie@example.com', 'password': 'password123'}, 5),
+        'add_to_cart': ('post', '/api/add-to-cart/', lambda test: {'product_id': test.products[0].id, 'quantity': 1}, 7),
+        'remove_from_cart': ('post', '/api/remove-from-cart/', lambda test: {'cartitem_id': test.cart_items[0].id}, 6),
+        'cart': ('get', '/api/cart/', None, 1),
+        'cart_summary': ('get', '/api/cart/summary/', None, 1),
+        'cart_batch': ('post', '/api/cart/batch/', lambda test: {'changes': [{'product_id': product.id, 'quantity': 1} for product in test.products]}, 9),
+        'checkout': ('post', '/api/checkout/', lambda test: {'address_id': test.address.id, 'payment_mode': 'Cash on Delivery'}, 14),
+        'verify_payment': ('post', '/api/verify-payment/', {'razorpay_order_id': 'order_0', 'razorpay_payment_id': 'pay_0', 'razorpay_signature': razorpay_signature('order_0', 'pay_0')}, 2),
+        'payment_status': ('get', lambda test: f'/api/payment-status/{test.orders[0].id}/', None, 1),
+        'analytics': ('get', '/api/analytics/?dimension=product&interval=week', None, 3),
+        'profile': ('get', '/api/profile/', None, 0),
+        'profile_address': ('get', '/api/profile/addresses/', None, 1),
+        'profile_orders': ('get', '/api/profile/orders/', None, 2),
+        'csrf_token': ('get', '/api/csrf-token/', None, 0),
+    }
+    # Endpoints requested as the staff user
+    STAFF_ONLY = {'analytics'}
+
+    def test_every_endpoint_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names - self.BUDGETS.keys(), set(), "Endpoints without a query budget")
+
+    def test_endpoint_query_budgets(self):
+        for name, (method, url, data, budget) in self.BUDGETS.items():
+            with self.subTest(endpoint=name), transaction.atomic():
+                cache.clear()
+                if callable(url):
+                    url = url(self)
+                if callable(data):
+                    data = data(self)
+                self.client.force_authenticate(self.staff if name in self.STAFF_ONLY else self.user)
+                response = self.assertMaxQueries(budget, method, url, data)
+                self.assertLess(response.status_code, 400, f"{method.upper()} {url}: {response.status_code} {getattr(response, 'data', '')}")
+                transaction.set_rollback(True)
+
+
+class OrdersQueryTests(QueryBudgetTestCase):
+    def test_order_history_query_count_is_constant(self):
+        for product in self.products:
+            OrderItem.objects.create(order=Order.objects.first(), product=product, quantity=1, total=product.price)
+
+        response = self.assertMaxQueries(2, 'get', '/api/profile/orders/')
+        self.assertEqual(len(response.data), self.ORDERS)
+        self.assertEqual(response.data[0]['order_items'][0]['seller'], 'Acme')
+
+
+class CatalogCacheTests(QueryBudgetTestCase):
+    def test_second_read_is_a_hit(self):
+        catalog_cache.reset_stats()
+        first = self.client.get('/api/categories/')
+        second = self.assertMaxQueries(0, 'get', '/api/categories/')
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(catalog_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_changes_invalidate_the_pages_showing_them(self):
+        for url in ('/api/products/shoes/shoe-1', '/api/products/shoes', '/api/categories/'):
+            self.client.get(url)
+
+        product = self.products[1]
+        product.price = 999
+        product.save()
+        response = self.client.get('/api/products/shoes/shoe-1')
+        self.assertEqual((response['X-Cache'], response.data['price']), ('MISS', 999))
+        self.assertEqual(self.client.get('/api/products/shoes')['X-Cache'], 'MISS')
+        # Other scopes keep their pages
+        self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'HIT')
+
+        self.category.name = 'Sneakers'
+        self.category.save()
+        response = self.client.get('/api/categories/')
+        self.assertEqual((response['X-Cache'], response.data[0]['name']), ('MISS', 'Sneakers'))
+
+    def test_pages_built_before_the_commit_are_invalidated(self):
+        scopes = [catalog_cache.PRODUCTS]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+            # A read of another connection, which still sees the old rows
+            catalog_cache.get_or_build(scopes, 'page', lambda: 'old rows')
+
+        self.assertEqual(catalog_cache.get_or_build(scopes, 'page', lambda: 'new rows'), ('new rows', False))
+
+
+class KeysetPaginationTests(QueryBudgetTestCase):
+    def pages(self, url, link):
+        names = []
+        while url:
+            data = self.client.get(url).data
+            names.append([product['name'] for product in data['results']])
+            url = data[link]
+        return names
+
+    def test_cursors_round_trip(self):
+        for listing_url in ('/api/products/?page_size=4', '/api/products/shoes?page_size=4'):
+            with self.subTest(listing=listing_url):
+                forward = self.pages(listing_url, 'next')
+                self.assertEqual(forward, [['Shoe 0', 'Shoe 1', 'Shoe 2', 'Shoe 3'], ['Shoe 4', 'Shoe 5']])
+
+                last_page = self.client.get(self.client.get(listing_url).data['next']).data
+                self.assertEqual(self.pages(last_page['previous'], 'previous'), [['Shoe 0', 'Shoe 1', 'Shoe 2', 'Shoe 3']])
+
+    def test_invalid_cursors_are_not_found(self):
+        def cursor(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        for value in ['garbage', cursor([1, 2]), cursor({'p': [1], 'r': 0}), cursor({'p': ['abc', 1], 'r': 0}), cursor({'p': [None, 1], 'r': 0})]:
+            with self.subTest(cursor=value):
+                self.assertEqual(self.client.get('/api/products/', {'cursor': value}).status_code, 404)
+        self.assertEqual(self.client.get('/api/products/shoes', {'cursor': cursor({'p': [[1]], 'r': 0})}).status_code, 404)
+
+
+class CartTests(QueryBudgetTestCase):
+    def test_cart_query_count_is_constant(self):
+        for product in self.products[3:]:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1, total=product.price)
+
+        response = self.assertMaxQueries(EndpointQueryBudgetTests.BUDGETS['cart'][3], 'get', '/api/cart/')
+        self.assertEqual(len(response.data['cart_items']), self.PRODUCTS)
+
+    def test_summary_flags_stale_prices(self):
+        Product.objects.filter(pk=self.products[0].pk).update(price=500)
+
+        summary = self.client.get('/api/cart/').data['summary']
+        self.assertTrue(summary['has_stale_prices'])
+        self.assertEqual(summary['item_count'], 6)
+        # The stored line totals, as in /api/cart/summary/
+        self.assertEqual(summary['subtotal'], 100 * 2 + 101 * 2 + 102 * 2)
+        self.assertEqual(self.client.get('/api/cart/summary/').data['subtotal'], summary['subtotal'])
+
+    def test_cart_totals_follow_item_changes(self):
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (6, 606))
+
+        self.cart_items[0].delete()
+        CartItem.objects.create(cart=self.cart, product=self.products[5], quantity=3, total=315)
+
+        response = self.client.get('/api/cart/summary/')
+        self.assertEqual(response.data, {'item_count': 7, 'subtotal': 721})
+
+    def test_add_to_cart_updates_line_total(self):
+        self.client.post('/api/add-to-cart/', {'product_id': self.products[0].id, 'quantity': 3}, format='json')
+        item = CartItem.objects.get(cart=self.cart, product=self.products[0])
+        self.assertEqual((item.quantity, item.total), (5, 500))
+        self.assertEqual(self.client.post('/api/add-to-cart/', {'product_id': 0, 'quantity': 1}, format='json').status_code, 400)
+
+    def test_batch_changes(self):
+        p = self.products
+        changes = [
+            {'product_id': p[0].id, 'action': 'add', 'quantity': 1},
+            {'product_id': p[1].id, 'action': 'set', 'quantity': 5},
+            {'product_id': p[2].id, 'action': 'remove'},
+            {'product_id': p[3].id, 'quantity': 2},
+            {'product_id': p[3].id, 'quantity': 2},
+            {'product_id': p[4].id, 'action': 'set', 'quantity': 0},
+        ]
+        response = self.client.post('/api/cart/batch/', {'changes': changes}, format='json')
+        self.assertEqual(response.status_code, 200)
+        lines = {item['product']: (item['quantity'], item['total']) for item in response.data['cart_items']}
+        self.assertEqual(lines, {p[0].id: (3, 300), p[1].id: (5, 505), p[3].id: (4, 412)})
+        self.assertEqual(response.data['summary']['item_count'], 12)
+        self.assertEqual(self.client.get('/api/cart/summary/').data, {'item_count': 12, 'subtotal': 1217})
+
+    def test_batch_query_count_is_constant(self):
+        changes = [{'product_id': product.id, 'action': 'set', 'quantity': 3} for product in self.products]
+        self.assertMaxQueries(EndpointQueryBudgetTests.BUDGETS['cart_batch'][3], 'post', '/api/cart/batch/', {'changes': changes})
+
+    def test_adds_increment_in_the_database(self):
+        product = self.products[0]
+        quantity = CartItem.objects.get(cart=self.cart, product=product).quantity
+        bulk_create = CartItem.objects.bulk_create
+
+        def concurrent_add(*args, **kwargs):
+            # Another request adding to the line after the quantities were read
+            CartItem.objects.filter(cart=self.cart, product=product).update(quantity=F('quantity') + 1)
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(CartItem.objects, 'bulk_create', side_effect=concurrent_add):
+            cart.update_cart(self.user, [
+                {'product_id': product.id, 'action': 'add', 'quantity': 2},
+                {'product_id': self.products[5].id, 'action': 'add', 'quantity': 1},
+            ])
+        line = CartItem.objects.get(cart=self.cart, product=product)
+        self.assertEqual((line.quantity, line.total), (quantity + 3, product.price * (quantity + 3)))
+
+    def test_batch_is_all_or_nothing(self):
+        changes = [{'product_id': self.products[0].id, 'action': 'remove'}, {'product_id': 0, 'quantity': 1}]
+        response = self.client.post('/api/cart/batch/', {'changes': changes}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(CartItem.objects.filter(cart=self.cart, product=self.products[0]).exists())
+
+
+class CheckoutTests(QueryBudgetTestCase):
+    def checkout(self):
+        return self.client.post('/api/checkout/', {'address_id': self.address.id, 'payment_mode': 'Cash on Delivery'}, format='json')
+
+    def test_checkout_creates_order_and_empties_cart(self):
+        Product.objects.filter(pk=self.products[0].pk).update(price=150)
+
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+
+        order = Order.objects.latest('id')
+        self.assertEqual(order.total, 150 * 2 + 101 * 2 + 102 * 2)
+        self.assertEqual(sorted(order.orderitem_set.values_list('total', flat=True)), [202, 204, 300])
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (0, 0))
+
+    def test_second_submit_finds_empty_cart(self):
+        self.assertEqual(self.checkout().status_code, 201)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Order.objects.count(), self.ORDERS + 1)
+
+    def test_checkout_query_count_does_not_grow_with_cart_lines(self):
+        for product in self.products[3:]:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1, total=product.price)
+
+        self.assertMaxQueries(EndpointQueryBudgetTests.BUDGETS['checkout'][3], 'post', '/api/checkout/', {'address_id': self.address.id, 'payment_mode': 'Cash on Delivery'})
+
+    def test_address_of_another_user_is_rejected(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password123')
+        address = Address.objects.create(user=other, address='2 Main St', city='Pune', state='MH', country='IN', pincode='411001', phone='8888888888')
+
+        response = self.client.post('/api/checkout/', {'address_id': address.id, 'payment_mode': 'Cash on Delivery'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 3)
+
+
+class PaymentOutboxTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeRazorpayHandler)
+        self.server.latency, self.server.failure_rate, self.server.verbose = 0, 0, False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        settings_override = override_settings(RAZORPAY_BASE_URL=base_url, PAYMENT_RETRY_BASE_DELAY=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        payments._client = None
+        self.addCleanup(setattr, payments, '_client', None)
+
+    def checkout(self):
+        return self.client.post('/api/checkout/', {'address_id': self.address.id, 'payment_mode': 'Online Payment'}, format='json')
+
+    def test_checkout_returns_pending_reference_and_worker_creates_gateway_order(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['payment_status'], 'Pending')
+        order_id = response.data['order_id']
+
+        status_url = f'/api/payment-status/{order_id}/'
+        self.assertEqual(self.client.get(status_url).data['payment_status'], 'Pending')
+
+        entries = payments.claim_due(10)
+        self.assertEqual([entry.order_id for entry in entries], [order_id])
+        self.assertTrue(payments.process(entries[0]))
+
+        data = self.client.get(status_url).data
+        self.assertEqual(data['payment_status'], 'Done')
+        self.assertTrue(data['razorpay_order_id'].startswith('order_'))
+        self.assertEqual(data['amount'], int(Order.objects.get(pk=order_id).total * 100))
+
+    def test_gateway_failures_are_retried_then_given_up(self):
+        self.server.failure_rate = 1
+        order_id = self.checkout().data['order_id']
+
+        with self.settings(PAYMENT_MAX_ATTEMPTS=2):
+            for attempt in range(2):
+                entries = payments.claim_due(10)
+                self.assertEqual(len(entries), 1)
+                self.assertFalse(payments.process(entries[0]))
+
+        outbox = PaymentOutbox.objects.get(order_id=order_id)
+        self.assertEqual((outbox.status, outbox.attempts), ('Failed', 2))
+        self.assertEqual(payments.claim_due(10), [])
+
+    def test_unexpected_errors_are_retried_and_do_not_stop_the_worker(self):
+        from app.management.commands.run_payment_worker import Command
+        order_id = self.checkout().data['order_id']
+
+        # A reply without an id
+        entry = payments.claim_due(10)[0]
+        with mock.patch.object(payments.get_client().order, 'create', return_value={'status': 'created'}), self.assertLogs('app.payments', 'ERROR'):
+            self.assertFalse(payments.process(entry))
+        outbox = PaymentOutbox.objects.get(order_id=order_id)
+        self.assertEqual((outbox.status, outbox.attempts), ('Pending', 1))
+        self.assertIn('KeyError', outbox.last_error)
+
+        # Any other error is logged, the worker goes on with the other entries
+        with mock.patch.object(payments, 'process', side_effect=RuntimeError('database is down')), \
+                mock.patch('app.management.commands.run_payment_worker.close_old_connections'), \
+                self.assertLogs('app.management.commands.run_payment_worker', 'ERROR'):
+            self.assertFalse(Command.process(entry))
+
+
+class ProductSearchTests(QueryBudgetTestCase):
+    def search(self, query):
+        response = self.client.get('/api/products/search/', {'q': query, 'page_size': 50})
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data['results']]
+
+    def test_ranks_name_matches_first(self):
+        Product.objects.create(user=self.user, name='Laces', description='Fits any running shoe', category=self.category, seller=self.seller, price=5)
+        Product.objects.create(user=self.user, name='Running shoe', description='Light', category=self.category, seller=self.seller, price=50)
+
+        self.assertEqual(self.search('running shoe'), ['Running shoe', 'Laces'])
+        self.assertEqual(self.search('runn'), ['Running shoe', 'Laces'])
+
+    def test_index_follows_product_category_and_seller_changes(self):
+        product = self.products[0]
+        product.name = 'Sandal'
+        product.save()
+        self.assertEqual(self.search('sandal'), ['Sandal'])
+
+        self.seller.name = 'Globex'
+        self.seller.save()
+        self.assertEqual(len(self.search('globex')), self.PRODUCTS)
+
+        product.delete()
+        self.assertEqual(self.search('sandal'), [])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/api/products/search/').status_code, 400)
+        self.assertEqual(self.search('"*'), [])
+
+    def test_pages_follow_the_ranking(self):
+        for n in range(3):
+            Product.objects.create(user=self.user, name=f'Running shoe {n}', description='Light', category=self.category, seller=self.seller, price=50)
+        ranked = self.search('shoe')
+        data = self.client.get('/api/products/search/', {'q': 'shoe', 'page_size': 4, 'fields': 'name'}).data
+        pages = [data['results']]
+        while data['next']:
+            self.assertIsNone(data['previous'])
+            data = self.client.get(data['next']).data
+            pages.append(data['results'])
+        self.assertEqual([len(page) for page in pages], [4, 4, 1])
+        self.assertEqual([product['name'] for page in pages for product in page], ranked)
+
+        self.assertEqual(self.client.get('/api/products/search/', {'q': 'shoe', 'cursor': 'nope'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/products/search/', {'q': 'shoe', 'include': 'groups'}).status_code, 400)
+
+    def test_other_backends_match_a_name_prefix(self):
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            self.assertEqual(self.search('shoe'), [product.name for product in self.products])
+            self.assertEqual(self.search('product'), [])
+
+    def test_admin_search_is_not_truncated(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password123'))
+        request = RequestFactory().get('/admin/')
+        product_admin = admin.site._registry[Product]
+        with mock.patch('app.search.search', side_effect=AssertionError("ranked and limited")):
+            queryset, _ = product_admin.get_search_results(request, Product.objects.all(), 'globex')
+            self.assertEqual(queryset.count(), 0)
+            self.assertEqual(product_admin.get_search_results(request, Product.objects.all(), '"*')[0].count(), 0)
+            self.seller.name = 'Globex'
+            self.seller.save()
+            queryset, _ = product_admin.get_search_results(request, Product.objects.all(), 'globex')
+            self.assertEqual(queryset.count(), self.PRODUCTS)
+            response = self.client.get('/admin/app/product/', {'q': 'globex'})
+        self.assertEqual(response.context['cl'].result_count, self.PRODUCTS)
+
+    def test_rebuild_is_atomic(self):
+        with mock.patch('app.search._reindex', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                list(search.rebuild())
+        # The old index is still there
+        self.assertEqual(len(self.search('shoe')), self.PRODUCTS)
+
+
+class ProductFacetTests(QueryBudgetTestCase):
+    def facets(self, **params):
+        response = self.client.get('/api/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['facets'], [product['name'] for product in response.data['results']]
+
+    def test_filters_and_counts(self):
+        other_user = User.objects.create_user('other', 'other@example.com', 'password123')
+        other = Seller.objects.create(user=other_user, name='Globex', description='Seller')
+        Product.objects.create(user=other_user, name='Boot', description='Product', category=self.category, seller=other, price=1200)
+
+        facets, names = self.facets(seller='globex')
+        self.assertEqual(names, ['Boot'])
+        # Seller counts ignore the seller filter itself
+        self.assertEqual([(row['value'], row['count']) for row in facets['seller']], [('acme', 6), ('globex', 1)])
+        self.assertEqual({row['value']: row['count'] for row in facets['price']}, {'under-500': 0, '500-1000': 0, '1000-1500': 1, '1500-plus': 0})
+        self.assertEqual(facets['category'], [{'value': 'shoes', 'label': 'Shoes', 'count': 1}])
+
+    def test_counts_follow_product_changes(self):
+        product = self.products[0]
+        product.price = 2000
+        product.save()
+        self.products[1].delete()
+
+        facets, names = self.facets(price='1500-plus')
+        self.assertEqual(names, [product.name])
+        self.assertEqual({row['value']: row['count'] for row in facets['price']}, {'under-500': 4, '500-1000': 0, '1000-1500': 0, '1500-plus': 1})
+
+    def test_unknown_price_range(self):
+        self.assertEqual(self.client.get('/api/products/', {'price': 'cheap'}).status_code, 400)
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """ Answers every request with the server's ``body``, and ``token_body`` on /api/token/. """
+
+    def reply(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        body = self.server.token_body if self.path == '/api/token/' else self.server.body
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchmarkTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAPIHandler)
+        self.server.token_body, self.server.body = b'{"access": "token"}', b'[]'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def run_benchmark(self):
+        return benchmark.run(f"http://127.0.0.1:{self.server.server_port}", [('customer', 'password123')], {'browse': 1}, 3, 0.2)
+
+    def test_setup_failures_stop_the_run(self):
+        self.server.token_body = b'<html>Bad gateway</html>'
+        errors = []
+
+        def run():
+            try:
+                self.run_benchmark()
+            except benchmark.BenchmarkError as e:
+                errors.append(str(e))
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive(), "run() deadlocked")
+        self.assertEqual(len(errors), 1)
+        self.assertIn('Could not log in as customer', errors[0])
+
+    def test_scenario_exceptions_are_errors(self):
+        # A products page that is not an object
+        with self.assertLogs('app.benchmark', 'WARNING'):
+            summary = self.run_benchmark()
+        self.assertGreater(summary['scenario_exceptions']['browse'], 0)
+        self.assertGreaterEqual(summary['errors'], summary['scenario_exceptions']['browse'])
+
+
+class RequestMetricsTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get('/api/profile/orders/')
+        self.client.get('/api/profile/orders/')
+
+        self.client.force_login(self.staff)
+        body = self.client.get('/metrics').content.decode()
+        labels = 'view="profile_orders",route="api/profile/orders/",method="GET"'
+        self.assertIn(f'http_requests_total{{{labels},status="200"}} 2', body)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', body)
+        # Two queries per request, both fall in the le="2" bucket
+        self.assertIn(f'http_request_sql_queries_bucket{{{labels},le="1"}} 0', body)
+        self.assertIn(f'http_request_sql_queries_bucket{{{labels},le="2"}} 2', body)
+
+    def test_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with override_settings(DEBUG=True):
+            self.client.logout()
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class ImageVariantTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        settings_override = override_settings(MEDIA_ROOT=media.name, IMAGE_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, size=(2000, 1200), mode='RGBA'):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new(mode, size, (200, 30, 30, 128)).save(buffer, format='PNG')
+        return SimpleUploadedFile('shoe.png', buffer.getvalue(), content_type='image/png')
+
+    def test_upload_generates_variants(self):
+        from PIL import Image
+        product = self.products[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = self.upload()
+            product.save()
+
+        for variant, box in images.VARIANTS.items():
+            for format in images.FORMATS:
+                with Image.open(os.path.join(self.media_root, images.variant_name(product.image.name, variant, format))) as image:
+                    self.assertEqual(image.format, format.upper())
+                    self.assertLessEqual(image.width, box[0])
+                    self.assertLessEqual(image.height, box[1])
+        self.assertFalse(images.needs_variants(product.image.name))
+
+        response = self.client.get(f'/api/products/{self.category.slug}/{product.slug}')
+        self.assertEqual(
+            response.data['image_variants']['thumb']['webp'],
+            f"{settings.MEDIA_URL}product_pics/variants/{os.path.splitext(os.path.basename(product.image.name))[0]}_thumb.webp",
+        )
+
+    def test_variants_are_linked_once_generated(self):
+        product = self.products[0]
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            product.image = self.upload()
+            product.save()
+        generate = [callback for callback in callbacks if callback.__qualname__.startswith('schedule.')]
+        for callback in callbacks:
+            if callback not in generate:
+                callback()
+
+        # Cached with the original in place of the variants
+        url = f'/api/products/{self.category.slug}/{product.slug}'
+        original = self.client.get(url).data['image']
+        self.assertEqual(self.client.get(url).data['image_variants']['thumb'], {'jpeg': original, 'webp': original})
+        listing_url = f'/api/products/{self.category.slug}'
+        self.assertEqual(self.client.get(listing_url).data['results'][0]['image_variants']['card']['webp'], original)
+
+        generate[0]()
+        self.assertTrue(self.client.get(url).data['image_variants']['thumb']['webp'].endswith('_thumb.webp'))
+        self.assertTrue(self.client.get(listing_url).data['results'][0]['image_variants']['card']['webp'].endswith('_card.webp'))
+
+    def test_small_images_are_not_upscaled(self):
+        from PIL import Image
+        product = self.products[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = self.upload(size=(300, 200), mode='RGB')
+            product.save()
+
+        with Image.open(os.path.join(self.media_root, images.variant_name(product.image.name, 'detail', 'jpeg'))) as image:
+            self.assertEqual(image.size, (300, 200))
+
+    def test_saves_without_a_new_image_do_not_look_at_the_files(self):
+        with mock.patch.object(images, 'needs_variants') as needs_variants:
+            self.user.first_name = 'Changed'
+            self.user.save()  # Saves the profile too
+            Product.objects.get(pk=self.products[0].pk).save()
+            Product.objects.only('name').get(pk=self.products[0].pk).save()
+        needs_variants.assert_not_called()
+
+    def test_storages_without_local_paths_are_skipped(self):
+        from django.core.files.storage import Storage
+        product = self.products[0]
+        # Like remote storages, no path()
+        with mock.patch.object(images, 'default_storage', Storage()), self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(images.local_storage())
+            product.image = 'product_pics/remote.png'
+            product.save()
+            self.assertEqual(images.variant_urls(product.image.name, url=str), {
+                variant: {format: 'product_pics/remote.png' for format in images.FORMATS} for variant in images.VARIANTS
+            })
+
+
+class SalesRollupTests(QueryBudgetTestCase):
+    def rollups(self):
+        return {
+            (row.dimension, row.key, row.day, row.status): (row.orders, row.lines, row.units, round(row.revenue, 2))
+            for row in SalesRollup.objects.all()
+            if row.orders or row.lines
+        }
+
+    def cell(self, dimension, key='', status='Pending'):
+        return self.rollups().get((dimension, str(key), analytics.day_of(timezone.now()), status))
+
+    def test_orders_are_counted_as_they_are_created_and_change_status(self):
+        # Fixture: 3 pending online orders of products 0-2, one unit each
+        self.assertEqual(self.cell('all'), (3, 9, 9, 909))
+        self.assertEqual(self.cell('product', self.products[0].id), (0, 3, 3, 300))
+
+        self.client.post('/api/checkout/', {'address_id': self.address.id, 'payment_mode': 'Cash on Delivery'}, format='json')
+        self.assertEqual(self.cell('all'), (4, 12, 15, 1515))
+        self.assertEqual(self.cell('payment_mode', 'Cash on Delivery'), (1, 3, 6, 606))
+
+        order = Order.objects.get(payment_mode='Cash on Delivery')
+        order.status = 'Delivered'
+        order.save()
+        self.assertEqual(self.cell('all'), (3, 9, 9, 909))
+        self.assertEqual(self.cell('all', status='Delivered'), (1, 3, 6, 606))
+        self.assertEqual(self.cell('category', self.category.id, status='Delivered'), (0, 3, 6, 606))
+
+        item = order.orderitem_set.first()
+        item.quantity, item.total = 1, item.total / 2
+        item.save()
+        Order.objects.exclude(pk=order.pk).first().delete()
+        self.assertEqual(self.cell('seller', self.seller.id, status='Delivered'), (0, 3, 5, 606 - item.total))
+        self.assertEqual(self.cell('all'), (2, 6, 6, 606))
+
+        incremental = self.rollups()
+        for _ in analytics.rebuild(chunk_size=2):
+            pass
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_series(self):
+        self.client.force_authenticate(self.staff)
+        today = analytics.day_of(timezone.now())
+        response = self.client.get('/api/analytics/', {'dimension': 'category', 'start': today - timedelta(days=2)})
+        self.assertEqual(response.status_code, 200)
+        [series] = response.data['series']
+        self.assertEqual(series['label'], 'Shoes')
+        self.assertEqual(series['totals'], {'orders': 0, 'lines': 9, 'units': 9, 'revenue': 909})
+        self.assertEqual([point['revenue'] for point in series['points']], [0, 0, 909])
+
+        response = self.client.get('/api/analytics/', {'status': 'Cancelled'})
+        self.assertEqual(response.data['series'], [])
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get('/api/analytics/').status_code, 403)
+
+
+@override_settings(CART_STORE='app.cart_store.CacheCartStore', CART_FLUSH_INTERVAL=3600)
+class CacheCartStoreTests(QueryBudgetTestCase):
+    def writes(self, context):
+        return [query['sql'] for query in context.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+
+    def test_changes_stay_in_the_cache_until_checkout(self):
+        p = self.products
+        self.client.get('/api/cart/')
+        with CaptureQueriesContext(connection) as context:
+            self.client.post('/api/add-to-cart/', {'product_id': p[0].id, 'quantity': 1}, format='json')
+            self.client.post('/api/add-to-cart/', {'product_id': p[4].id, 'quantity': 2}, format='json')
+            self.client.post('/api/remove-from-cart/', {'cartitem_id': self.cart_items[1].id}, format='json')
+            self.client.post('/api/cart/batch/', {'changes': [{'product_id': p[5].id, 'quantity': 1}]}, format='json')
+            cart = self.client.get('/api/cart/').data
+            summary = self.client.get('/api/cart/summary/').data
+        self.assertEqual(self.writes(context), [])
+
+        lines = {item['product']: item['quantity'] for item in cart['cart_items']}
+        self.assertEqual(lines, {p[0].id: 3, p[2].id: 2, p[4].id: 2, p[5].id: 1})
+        self.assertEqual(summary, {'item_count': 8, 'subtotal': 300 + 204 + 208 + 105})
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 3)
+
+        # Lines added in the cache have no id yet, they are removed by product
+        self.client.post('/api/remove-from-cart/', {'product_id': p[5].id}, format='json')
+
+        response = self.client.post('/api/checkout/', {'address_id': self.address.id, 'payment_mode': 'Cash on Delivery'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.latest('id')
+        self.assertEqual(sorted(order.orderitem_set.values_list('product_id', 'quantity')), [(p[0].id, 3), (p[2].id, 2), (p[4].id, 2)])
+        self.assertEqual(self.client.get('/api/cart/').data['cart_items'], [])
+
+    def test_flush_writes_each_cart_once(self):
+        from app.cart_store import get_store
+        for product in self.products:
+            self.client.post('/api/add-to-cart/', {'product_id': product.id, 'quantity': 1}, format='json')
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(get_store().flush_pending(), 1)
+        self.assertEqual(len([sql for sql in self.writes(context) if 'app_cartitem' in sql]), 1)
+        self.assertEqual(
+            sorted(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity')),
+            [(product.id, 3 if n < 3 else 1) for n, product in enumerate(self.products)],
+        )
+        self.assertEqual(get_store().flush_pending(), 0)
+
+    def test_failed_flushes_are_retried(self):
+        from app.cart_store import get_store
+        store = get_store()
+        self.client.post('/api/add-to-cart/', {'product_id': self.products[5].id, 'quantity': 1}, format='json')
+
+        with mock.patch('app.cart_store.update_cart', side_effect=DatabaseError), self.assertLogs('app.cart_store', 'ERROR'):
+            self.assertEqual(store.flush_pending(), 0)
+        self.assertEqual(store.cache.get(store.DIRTY), {self.user.pk})
+
+        self.assertEqual(store.flush_pending(), 1)
+        self.assertTrue(CartItem.objects.filter(cart=self.cart, product=self.products[5]).exists())
+
+    def test_checkout_holds_the_cart_lock(self):
+        from app.cart_store import get_store
+        store = get_store()
+        self.client.post('/api/add-to-cart/', {'product_id': self.products[5].id, 'quantity': 1}, format='json')
+        place_order = views.place_order
+
+        def locked_place_order(*args):
+            # A concurrent cart change would wait for the lock until the cached cart is gone
+            self.assertFalse(store.cache.add(f'cart:lock:{self.user.pk}', 'other', 1))
+            return place_order(*args)
+
+        with mock.patch('app_api.views.place_order', side_effect=locked_place_order) as mocked:
+            response = self.client.post('/api/checkout/', {'address_id': self.address.id, 'payment_mode': 'Cash on Delivery'}, format='json')
+        self.assertEqual((response.status_code, mocked.call_count), (201, 1))
+        self.assertIsNone(store.cache.get(store.key(self.user.pk)))
+        self.assertTrue(store.cache.add(f'cart:lock:{self.user.pk}', 'other', 1))
+
+    def test_lock_serializes_changes(self):
+        from app.cart_store import get_store
+        store = get_store()
+        store.cache.set('counter', 0)
+
+        def increment():
+            for _ in range(20):
+                with store.lock('counter'):
+                    value = store.cache.get('counter')
+                    time.sleep(0)
+                    store.cache.set('counter', value + 1)
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.cache.get('counter'), 80)
+
+    def test_load_keeps_a_state_stored_meanwhile(self):
+        from app.cart_store import get_store
+        store = get_store()
+        self.client.post('/api/add-to-cart/', {'product_id': self.products[5].id, 'quantity': 1}, format='json')
+        changed = store.cache.get(store.key(self.user.pk))
+
+        # A reader missing the entry, and a writer storing it before the reader's load is done
+        get = store.cache.get
+        with mock.patch.object(store.cache, 'get', side_effect=[None, changed]):
+            self.assertEqual(store.load(self.user), changed)
+        self.assertEqual(get(store.key(self.user.pk)), changed)
+
+
+
+class CachedJWTAuthenticationTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        authentication.clear_local()
+        self.client.force_authenticate(None)
+        self.authorize(self.user)
+
+    def authorize(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_user_is_loaded_once(self):
+        self.assertMaxQueries(2, 'get', '/api/cart/')
+        # Warm: the user comes from the cache, the catalog from the catalog cache
+        self.client.get('/api/categories/')
+        self.assertMaxQueries(0, 'get', '/api/categories/')
+        authentication.clear_local()
+        self.assertMaxQueries(1, 'get', '/api/cart/')
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'user_inactive')
+
+    def test_token_is_revoked_by_password_change(self):
+        # simplejwt does not follow override_settings
+        patcher = mock.patch.object(jwt_settings, 'CHECK_REVOKE_TOKEN', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.authorize(self.user)
+        self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        self.user.set_password('new-password456')
+        self.user.save()
+        response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'password_changed')
+
+    def test_other_process_sees_changes_through_the_generation(self):
+        self.client.get('/api/cart/')
+        # Another process changed the user: its cached copy is stale
+        User.objects.filter(pk=self.user.pk).update(email='changed@example.com')
+        authentication.invalidate(self.user.pk)
+        user = authentication.CachedJWTAuthentication().load_user(self.user.pk)
+        self.assertEqual(user.email, 'changed@example.com')
+
+    def test_each_request_gets_its_own_user(self):
+        auth = authentication.CachedJWTAuthentication()
+        first = auth.load_user(self.user.pk)
+        first._perm_cache = {'app.delete_order'}
+        second = auth.load_user(self.user.pk)
+        self.assertIsNot(second, first)
+        self.assertFalse(hasattr(second, '_perm_cache'))
+
+    def test_local_users_are_evicted(self):
+        auth = authentication.CachedJWTAuthentication()
+        with self.settings(AUTH_USER_LOCAL_MAX_USERS=2):
+            for user in User.objects.order_by('pk'):
+                auth.load_user(user.pk)
+            self.assertEqual(len(authentication._local), 2)
+
+        with mock.patch('time.monotonic', return_value=time.monotonic() + settings.AUTH_USER_LOCAL_TIMEOUT + 1):
+            auth.load_user(self.user.pk)
+        self.assertEqual(list(authentication._local), [str(self.user.pk)])
+
+
+class ReplicaRoutingTests(QueryBudgetTestCase):
+    """ Routing to a replica alias backed by a second SQLite file, a copy of the test database. """
+
+    @classmethod
+    def setUpClass(cls):
+        # Added here rather than in settings, the test runner checks the
+        # databases of every test case before setting any up
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        replica = os.path.join(cls.replica_dir.name, 'replica.sqlite3')
+        connections.settings['replica'] = {**connections['default'].settings_dict, 'NAME': replica}
+        cls.databases = {'default', 'replica'}
+
+        # A replica that has the schema but lags behind every row of the fixture
+        connections['default'].ensure_connection()
+        target = sqlite3.connect(replica)
+        connections['default'].connection.backup(target)
+        target.close()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.replica_dir.cleanup()
+
+    def category_names(self):
+        return [category['name'] for category in self.client.get('/api/categories/').data]
+
+    def test_read_only_views_read_from_the_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica, CaptureQueriesContext(connection) as default:
+            self.assertEqual(self.category_names(), [])
+            self.assertEqual(self.client.get('/api/products/').data['results'], [])
+            self.assertEqual(self.client.get('/api/profile/orders/').data, [])
+        self.assertGreater(len(replica), 0)
+        self.assertEqual(default.captured_queries, [])
+
+        # Views without the policy stay on the primary
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get('/api/cart/')
+        self.assertEqual(len(replica), 0)
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        response = self.client.post('/api/add-to-cart/', {'product_id': self.products[0].id, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.category_names(), ['Shoes'])
+        self.assertEqual(len(replica), 0)
+
+    def test_replica_pages_are_not_cached_right_after_a_change(self):
+        # The replica may not have the change yet, the page it gives is not stored
+        self.category.save()
+        self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'MISS')
+
+        with mock.patch('time.time_ns', return_value=time.time_ns() + (settings.REPLICA_STICKY_SECONDS + 1) * 10**9):
+            self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'MISS')
+            self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'HIT')
+
+
+class AsyncURLConf:
+    urlpatterns = [path('api/', include(async_views.replace_views(urls.urlpatterns)))]
+
+
+class AsyncViewTests(QueryBudgetTestCase):
+    PATHS = [
+        '/api/categories/', '/api/products/?price=under-500', '/api/products/shoes', '/api/products/shoes/shoe-1',
+        '/api/cart/', '/api/cart/summary/', '/api/profile/orders/',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        authentication.clear_local()
+        self.client.force_authenticate(None)
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def test_payloads_match_the_sync_views(self):
+        for url in self.PATHS:
+            with self.subTest(url=url):
+                cache.clear()
+                expected = self.client.get(url)
+                cache.clear()
+                with override_settings(ROOT_URLCONF=AsyncURLConf):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.json(), expected.json())
+
+    @override_settings(ROOT_URLCONF=AsyncURLConf)
+    def test_cart_writes(self):
+        p = self.products
+        response = self.client.post('/api/add-to-cart/', {'product_id': p[4].id, 'quantity': 2}, format='json')
+        self.assertEqual(response.json(), {'product_id': p[4].id, 'quantity': 2})
+        response = self.client.post('/api/add-to-cart/', {'product_id': 999, 'quantity': 2}, format='json')
+        self.assertEqual((response.status_code, response.json()), (400, {'product_id': ['Product does not exist']}))
+        self.client.post('/api/remove-from-cart/', {'cartitem_id': self.cart_items[0].id}, format='json')
+        response = self.client.post('/api/cart/batch/', {'changes': [{'product_id': p[5].id, 'action': 'set', 'quantity': 3}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        lines = {item['product']: item['quantity'] for item in response.json()['cart_items']}
+        self.assertEqual(lines, {p[1].id: 2, p[2].id: 2, p[4].id: 2, p[5].id: 3})
+
+    @override_settings(ROOT_URLCONF=AsyncURLConf)
+    async def test_requests_through_the_asgi_handler(self):
+        response = await self.async_client.get('/api/categories/')
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.get('/api/categories/', headers=self.headers)
+        self.assertEqual((response.status_code, response['X-Cache']), (200, 'MISS'))
+        response = await self.async_client.get('/api/categories/', headers=self.headers)
+        self.assertEqual((response.json()[0]['name'], response['X-Cache']), ('Shoes', 'HIT'))
+
+        response = await self.async_client.get('/api/profile/orders/', headers=self.headers)
+        self.assertEqual(len(response.json()), self.ORDERS)
+        response = await self.async_client.post(
+            '/api/add-to-cart/', {'product_id': self.products[4].id, 'quantity': 1}, content_type='application/json', headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get('/api/cart/summary/', headers=self.headers)
+        self.assertEqual(response.json()['item_count'], 7)
+
+
+class QueryPlanTests(QueryBudgetTestCase):
+
+    def test_every_endpoint_is_checked(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names - check_query_plans.ENDPOINTS.keys(), set(), "Endpoints without a query plan check")
+
+    def test_full_scans(self):
+        self.assertEqual(check_query_plans.full_scans('SELECT id FROM app_order WHERE razorpay_payment_id = %s', ['pay_0']), ['app_order'])
+        self.assertEqual(check_query_plans.full_scans('SELECT id FROM app_order WHERE razorpay_order_id = %s', ['order_0']), [])
+        self.assertEqual(check_query_plans.full_scans('SELECT U0."id" FROM "app_order" U0 WHERE U0."status" = %s', ['Pending']), ['app_order'])
+
+    def test_hot_lookups_use_indexes(self):
+        queries = [
+            Order.objects.filter(user=self.user, date__gte=timezone.now() - timedelta(days=30)).order_by('date'),
+            Order.objects.filter(razorpay_order_id='order_0'),
+            Product.objects.filter(category=self.category, price__lt=500).order_by('price', 'id'),
+            CartItem.objects.filter(cart=self.cart, product=self.products[0]),
+            Address.objects.filter(user=self.user),
+        ]
+        for queryset in queries:
+            with self.subTest(query=str(queryset.query)):
+                sql, params = queryset.query.sql_with_params()
+                self.assertEqual(check_query_plans.full_scans(sql, params), [])
+
+    def test_command_passes_on_the_api(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+
+class ConditionalGetTests(QueryBudgetTestCase):
+
+    def revalidate(self, path, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, **headers)
+        return response, len(context)
+
+    def test_catalog_not_modified(self):
+        for url in ['/api/categories/', '/api/products/?price=under-500', '/api/products/shoes', '/api/products/shoes/shoe-1']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response['Cache-Control'], 'private, no-cache')
+                self.assertNotIn('Last-Modified', response)
+                response, queries = self.revalidate(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual((response.status_code, queries), (304, 0))
+
+    def test_if_modified_since_is_not_answered(self):
+        # Whole seconds cannot tell a change in the same second apart
+        product = self.products[1]
+        self.client.get('/api/products/shoes/shoe-1')
+        product.price = 999
+        product.save()
+        response = self.client.get('/api/products/shoes/shoe-1', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['price'], 999)
+
+    def test_changes_give_a_new_etag(self):
+        response = self.client.get('/api/products/shoes/shoe-1')
+        etag = response['ETag']
+        product = self.products[1]
+        product.price = 999
+        product.save()
+        response, queries = self.revalidate('/api/products/shoes/shoe-1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['price'], 999)
+        self.assertIsNotNone(response.data['updated_at'])
+
+    def test_profile_not_modified(self):
+        response = self.client.get('/api/profile/')
+        etag = response['ETag']
+        response, queries = self.revalidate('/api/profile/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, queries), (304, 0))
+
+        self.user.groups.add(Group.objects.create(name='wholesale'))
+        response = self.client.get('/api/profile/?include=groups', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['groups']), 1)
+
+    @override_settings(ROOT_URLCONF=AsyncURLConf)
+    def test_async_views_not_modified(self):
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        for url in ['/api/categories/', '/api/products/shoes', '/api/products/shoes/shoe-1']:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual((response.status_code, response['ETag']), (304, etag))
+
+
+class ProductListingTests(QueryBudgetTestCase):
+
+    def test_payloads_match_the_serializer(self):
+        request = RequestFactory().get('/api/products/')
+        products = Product.objects.select_related('category', 'seller').order_by('id')
+        rows = listing.product_rows(Product.objects.order_by('id'))
+        self.assertEqual(listing.products(rows), views.ProductSerializer(products, many=True).data)
+        self.assertEqual(
+            listing.products(rows, request.build_absolute_uri),
+            views.ProductSerializer(products, many=True, context={'request': request}).data,
+        )
+
+    def test_listings_embed_category_and_seller_names(self):
+        for url in ['/api/products/', '/api/products/shoes', '/api/products/search/?q=shoe']:
+            with self.subTest(url=url):
+                product = self.client.get(url).data['results'][0]
+                self.assertEqual((product['category_name'], product['seller_name']), ('Shoes', 'Acme'))
+
+
+class SparseFieldsTests(QueryBudgetTestCase):
+
+    def get(self, path, budget):
+        response = self.assertMaxQueries(budget, 'get', path)
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', ''))
+        return response.data
+
+    def test_profile_relations_are_opt_in(self):
+        self.assertNotIn('groups', self.get('/api/profile/', 0))
+        profile = self.get('/api/profile/?include=groups', 1)
+        self.assertEqual((profile['groups'], 'user_permissions' in profile), ([], False))
+        self.assertEqual(self.get('/api/profile/?fields=id,username', 0), {'id': self.user.id, 'username': 'customer'})
+
+    def test_orders(self):
+        order = self.get('/api/profile/orders/', 2)[0]
+        self.assertNotIn('razorpay_signature', order)
+        self.assertEqual(self.get('/api/profile/orders/?include=razorpay_order_id', 2)[0]['razorpay_order_id'], 'order_0')
+
+        # No items prefetch, only the columns asked for
+        with CaptureQueriesContext(connection) as context:
+            orders = self.client.get('/api/profile/orders/?fields=id,total').data
+        self.assertEqual((orders[0], len(context)), ({'id': order['id'], 'total': 300}, 1))
+        self.assertNotIn('razorpay', context.captured_queries[0]['sql'])
+
+        orders = self.get('/api/profile/orders/?fields=id,order_items.product', 2)
+        self.assertEqual(orders[0]['order_items'][0], {'product': 'Shoe 0'})
+
+    def test_product_listing_columns(self):
+        for url in ['/api/products/?fields=id,name&page_size=2', '/api/products/shoes?fields=id,name&page_size=2']:
+            with self.subTest(url=url):
+                data = self.get(url, 4)
+                self.assertEqual([set(product) for product in data['results']], [{'id', 'name'}] * 2)
+                self.assertEqual(len(self.client.get(data['next']).data['results']), 2)
+
+    def test_unknown_fields(self):
+        for url in ['/api/profile/?fields=id,password', '/api/profile/orders/?fields=order_items.nope', '/api/products/?fields=secret']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('fields', response.data)
+
+    def test_product_listings_have_nothing_to_include(self):
+        for url in ['/api/products/?include=groups', '/api/products/shoes?include=secret']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('include', response.data)
+
+    @override_settings(ROOT_URLCONF=AsyncURLConf)
+    def test_async_orders(self):
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        orders = self.client.get('/api/profile/orders/?fields=id,order_items.quantity').json()
+        self.assertEqual(orders[0]['order_items'][0], {'quantity': 1})
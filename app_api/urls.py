@@ -1,11 +1,13 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 from rest_framework import routers
 router = routers.SimpleRouter()
 
 urlpatterns = [
     path('products/', views.ProductsView.as_view(), name='products'),
+    path('products/search/', views.ProductSearchView.as_view(), name='product_search'),
     path('products/<slug:category_slug>', views.CategoryProductsView.as_view(), name='category'),
     path('products/<slug:category_slug>/<slug:product_slug>', views.ProductView.as_view(), name='product'),
     path('categories/', views.CategoryView.as_view(), name='categories'),
@@ -13,8 +15,12 @@ urlpatterns = [
     path('add-to-cart/', views.AddToCartView.as_view(), name='add_to_cart'),
     path('remove-from-cart/', views.RemoveFromCartView.as_view(), name='remove_from_cart'),
     path('cart/', views.CartView.as_view(), name='cart'),
+    path('cart/summary/', views.CartSummaryView.as_view(), name='cart_summary'),
+    path('cart/batch/', views.CartBatchView.as_view(), name='cart_batch'),
     path('checkout/', views.CheckoutView.as_view(), name='checkout'),
     path('verify-payment/', views.VerifyPaymentView.as_view(), name='verify_payment'),
+    path('payment-status/<int:order_id>/', views.PaymentStatusView.as_view(), name='payment_status'),
+    path('analytics/', views.AnalyticsView.as_view(), name='analytics'),
     path('profile/', views.ProfileView.as_view(), name='profile'),
     # path('profile/update/', views.ProfileUpdate.as_view(), name="profile_update"),
     # path('profile/change-password/', views.ChangePassword.as_view(), name="profile_change_password"),
@@ -23,3 +29,7 @@ urlpatterns = [
     # path('profile/orders/<slug:order_id>', views.OrderDetails.as_view, name="profile_order_detail"),
     path('csrf-token/', views.get_csrf_token, name="csrf_token")
 ]
+
+if settings.ASYNC_API:
+    # Async catalog, cart and order history views, for ASGI servers (see async_views.py)
+    urlpatterns = async_views.replace_views(urlpatterns)
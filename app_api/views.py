@@ -3,14 +3,24 @@ from django.contrib.auth.models import User
 from rest_framework import serializers, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from app.models import Category, Product, Order, OrderItem, Address, Cart, CartItem
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny, SAFE_METHODS
+from app.models import Category, Product, Order, OrderItem, Address, CartItem, PaymentOutbox, SalesRollup
+from django.db.models import Prefetch
 import razorpay
 from django.conf import settings
 from django.middleware.csrf import get_token
 from django.http import JsonResponse
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.generics import ListAPIView
+from app import analytics, catalog_cache, db_router, facets, images, payments, search
+from contextlib import ExitStack
+from datetime import timedelta
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from app.checkout import place_order, CheckoutError
+from app.cart import CartError, MAX_BATCH_CHANGES
+from app.cart_store import get_store
+from . import authentication, listing, sparse
+from .pagination import ProductsPaginator, CategoryProductsPaginator, ProductSearchPaginator
 # from datetime import datetime
 
 # Create your views here.
@@ -19,10 +29,71 @@ def get_csrf_token(request):
     csrf_token = get_token(request)
     return JsonResponse({'csrfToken': csrf_token})
 
-class UserSerializer(serializers.ModelSerializer):
+def cached_response(data, hit):
+    response = Response(data)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+def not_modified(request, etag):
+    """ A 304 response when the request's If-None-Match matches ``etag``, else None. """
+    return get_conditional_response(request, etag=etag)
+
+def with_validators(response, etag):
+    response['ETag'] = etag
+    # Per user (authenticated) and to be revalidated on every use
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def cacheable(versions):
+    """
+    Whether a catalog page built now may be stored: not when it is read from
+    the replica shortly after a change, which the replica may not have yet.
+    """
+    return not (db_router.reading_replica() and catalog_cache.changed_within(versions, settings.REPLICA_STICKY_SECONDS))
+
+def catalog_response(request, scopes, build):
+    """
+    The catalog payload of the request, from the catalog cache or ``build()``,
+    with its ETag: 304 without building it when the client
+    has the current version.
+    """
+    key = request.build_absolute_uri()
+    versions = catalog_cache.get_versions(*scopes)
+    etag = catalog_cache.etag(scopes, key, versions)
+    response = not_modified(request, etag)
+    if response is None:
+        response = cached_response(*catalog_cache.get_or_build(scopes, key, build, versions, store=cacheable(versions)))
+    return with_validators(response, etag)
+
+class ReplicaReadMixin:
+    """
+    Serve the safe requests of the view from the read replica, once the user
+    is authenticated, unless they wrote recently (see app/db_router.py).
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with ExitStack() as self.replica_reads:
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and db_router.replica_configured() and not db_router.is_sticky(request.user):
+            self.replica_reads.enter_context(db_router.replica_reads())
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """ URLs of the precomputed thumb/card/detail variants of an image field, see app/images.py. """
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return images.variant_urls(value.name, request.build_absolute_uri if request else None)
+
+class UserSerializer(sparse.SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'date_joined', 'last_login', 'is_active', 'is_staff', 'is_superuser', 'groups', 'user_permissions')
+        # A query each, ?include=groups,user_permissions
+        optional_fields = ('groups', 'user_permissions')
 
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
@@ -30,51 +101,85 @@ class ProfileView(APIView):
 
     def get(self, request):
         user = request.user
-        serializer = UserSerializer(user)
-        return Response(serializer.data)
+        # The user's generation changes with every change to the user (app_api/signals.py)
+        etag = f'"{user.pk}.{authentication.generation(user.pk)}"'
+        response = not_modified(request, etag)
+        if response is None:
+            serializer = UserSerializer(user, context=sparse.context(request))
+            response = Response(serializer.data)
+        return with_validators(response, etag)
     
 
 
 
 ###### Categories ##########
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(sparse.SparseFieldsMixin, serializers.ModelSerializer):
+    image_variants = ImageVariantsField(source='image')
+
     class Meta:
         model = Category
-        fields = ('id', 'name', 'slug', 'description', 'image')
+        fields = ('id', 'name', 'slug', 'description', 'image', 'image_variants', 'updated_at')
 
-class CategoryView(APIView):
+class CategoryView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated]
     serializer_class = CategorySerializer
 
     def get(self, request):
-        categories = Category.objects.all()
-        serializer = CategorySerializer(categories, many=True)
-        return Response(serializer.data)
+        def build():
+            serializer = CategorySerializer(many=True, context=sparse.context(request))
+            serializer.instance = sparse.prune(Category.objects.all(), serializer)
+            return serializer.data
+
+        return catalog_response(request, [catalog_cache.CATEGORIES], build)
 
 ###### Endof Categories ##########
 
 
 
 ###### Products ##########
-class ProductsPaginator(PageNumberPagination):
-    page_size = 5
-    page_size_query_param = 'page_size'
-    max_page_size = 5
+class ProductSerializer(sparse.SparseFieldsMixin, serializers.ModelSerializer):
+    # Select the category and seller with the product. Listings use listing.py instead, same shape
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    seller_name = serializers.CharField(source='seller.name', read_only=True)
+    image_variants = ImageVariantsField(source='image')
 
-class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ('id', 'name', 'slug', 'description', 'category', 'seller', 'price', 'image')
+        fields = ('id', 'name', 'slug', 'description', 'category', 'category_name', 'seller', 'seller_name', 'price', 'image', 'image_variants', 'updated_at')
 
-class ProductsView(ListAPIView):
+class ProductsView(ReplicaReadMixin, ListAPIView):
     queryset = Product.objects.all()
     permission_classes = [IsAuthenticated]
     serializer_class = ProductSerializer
     pagination_class = ProductsPaginator
 
+    def get_filters(self):
+        params = self.request.query_params
+        filters = {name: params.get(name) or None for name in ('category', 'seller', 'price')}
+        if filters['price'] and facets.price_bucket_filter(filters['price']) is None:
+            raise serializers.ValidationError({'price': 'Unknown price range'})
+        return filters
+
+    def get_queryset(self):
+        products = super().get_queryset()
+        filters = self.get_filters()
+        if filters['category']:
+            products = products.filter(category__slug=filters['category'])
+        if filters['seller']:
+            products = products.filter(seller__slug=filters['seller'])
+        if filters['price']:
+            products = products.filter(facets.price_bucket_filter(filters['price']))
+        return products
+
     def get(self, request, *args, **kwargs):
-        response = super().get(request, *args, **kwargs)
-        return Response(response.data) 
+        def build():
+            fields = listing.requested(request)
+            page = self.paginate_queryset(listing.product_rows(self.get_queryset(), fields))
+            data = self.get_paginated_response(listing.products(page, request.build_absolute_uri, fields)).data
+            data['facets'] = facets.counts(**self.get_filters())
+            return data
+
+        return catalog_response(request, [catalog_cache.PRODUCTS], build)
 
 
 class CategoryProductsView(APIView):
@@ -82,9 +187,14 @@ class CategoryProductsView(APIView):
     serializer_class = ProductSerializer
 
     def get(self, request, category_slug):
-        products = Product.objects.filter(category__slug=category_slug)
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        def build():
+            fields = listing.requested(request)
+            products = listing.product_rows(Product.objects.filter(category__slug=category_slug), fields)
+            paginator = CategoryProductsPaginator()
+            page = paginator.paginate_queryset(products, request, view=self)
+            return paginator.get_paginated_response(listing.products(page, fields=fields)).data
+
+        return catalog_response(request, [catalog_cache.category_scope(category_slug)], build)
 
 
 class ProductView(APIView):
@@ -92,9 +202,28 @@ class ProductView(APIView):
     serializer_class = ProductSerializer
 
     def get(self, request, category_slug, product_slug):
-        product = Product.objects.get(slug=product_slug, category__slug=category_slug)
-        serializer = ProductSerializer(product)
-        return Response(serializer.data)
+        def build():
+            product = Product.objects.select_related('category', 'seller').get(slug=product_slug, category__slug=category_slug)
+            return ProductSerializer(product, context=sparse.context(request)).data
+
+        scopes = [catalog_cache.product_scope(product_slug), catalog_cache.category_scope(category_slug)]
+        return catalog_response(request, scopes, build)
+
+class ProductSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ProductSerializer
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "The q parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        fields = listing.requested(request)
+        paginator = ProductSearchPaginator()
+        results = paginator.paginate_results(lambda limit, after: search.search(query, limit, after), request)
+        ids = [id for rank, id in results]
+        products = {row.id: row for row in listing.product_rows(Product.objects.filter(id__in=ids), fields)}
+        return paginator.get_paginated_response(listing.products([products[id] for id in ids if id in products], request.build_absolute_uri, fields))
 
 ###### End of Products ##########
 
@@ -135,11 +264,6 @@ class AddToCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     quantity = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(id=value).exists():
-            raise serializers.ValidationError("Product does not exist")
-        return value
-    
     def validate_quantity(self, value):
         if value < 1:
             raise serializers.ValidationError("Quantity must be greater than 0")
@@ -155,23 +279,60 @@ class AddToCartView(APIView):
         serializer = AddToCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        if not Cart.objects.filter(user=request.user).exists():
-            cart = Cart.objects.create(user=request.user)
-        else:
-            cart = Cart.objects.get(user=request.user)
-
-        if CartItem.objects.filter(cart=cart, product_id=serializer.validated_data['product_id']).exists():
-            cart_item = CartItem.objects.get(cart=cart, product_id=serializer.validated_data['product_id'])
-            cart_item.quantity += serializer.validated_data['quantity']
-            cart_item.save()
-        else:
-            product = Product.objects.get(id=serializer.validated_data['product_id'])
-            cart_item = CartItem.objects.create(cart=cart, product_id=serializer.validated_data['product_id'], quantity=serializer.validated_data['quantity'], total= product.price * serializer.validated_data['quantity'] )
-            cart_item.save()
+        # The product is checked, and the line total recomputed, by the cart store
+        try:
+            get_store().update(request.user, [{'action': 'add', **serializer.validated_data}])
+        except CartError:
+            raise serializers.ValidationError({'product_id': ["Product does not exist"]})
 
         return Response(serializer.data)
 
 
+class CartChangeSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=['add', 'set', 'remove'], default='add')
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        if data['action'] == 'add' and data.get('quantity', 0) < 1:
+            raise serializers.ValidationError({'quantity': "Quantity must be greater than 0"})
+        if data['action'] == 'set' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': "This field is required."})
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    changes = CartChangeSerializer(many=True, allow_empty=False)
+
+    def validate_changes(self, value):
+        if len(value) > MAX_BATCH_CHANGES:
+            raise serializers.ValidationError(f"At most {MAX_BATCH_CHANGES} changes per request")
+        return value
+
+
+class CartBatchView(APIView):
+    """
+    Add, update or remove many cart lines in one request, e.g.
+    {"changes": [{"product_id": 1, "action": "add", "quantity": 2},
+                 {"product_id": 2, "action": "set", "quantity": 0}]}
+    and get the updated cart back.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = CartBatchSerializer
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        store = get_store()
+        try:
+            store.update(request.user, serializer.validated_data['changes'])
+        except CartError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(CartSerializer({'cart_items': store.items(request.user)}).data)
+
+
 ######## End of add to cart #########
 
 
@@ -179,12 +340,14 @@ class AddToCartView(APIView):
 ####### Remove from cart #########
 
 class RemoveFromCartSerializer(serializers.Serializer):
-    cartitem_id = serializers.IntegerField()
-
-    def validate_cartitem_id(self, value):
-        if not CartItem.objects.filter(id=value).exists():
-            raise serializers.ValidationError("Cart item does not exist")
-        return value
+    # Lines not written to the database yet (see CART_STORE) have no id, remove them by product
+    cartitem_id = serializers.IntegerField(required=False)
+    product_id = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if 'cartitem_id' not in data and 'product_id' not in data:
+            raise serializers.ValidationError({'cartitem_id': "This field is required."})
+        return data
     
 class RemoveFromCartView(APIView):
     permission_classes = [IsAuthenticated]
@@ -194,9 +357,8 @@ class RemoveFromCartView(APIView):
         serializer = RemoveFromCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        cart = Cart.objects.get(user=request.user)
-        cart_item = CartItem.objects.get(cart=cart, id=serializer.validated_data['cartitem_id'])
-        cart_item.delete()
+        if not get_store().remove(request.user, **serializer.validated_data):
+            raise serializers.ValidationError({'cartitem_id': ["Cart item does not exist"]})
 
         return Response(serializer.data)
     
@@ -208,17 +370,35 @@ class RemoveFromCartView(APIView):
 class CartItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_price = serializers.FloatField(source='product.price', read_only=True)  # Assuming Product model has a price field.
+    is_stale = serializers.SerializerMethodField()
 
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'product_name', 'product_price', 'quantity', 'total']
-
-class CartSerializer(serializers.ModelSerializer):
-    cart_items = CartItemSerializer(source='cartitem_set', many=True)
+        fields = ['id', 'product', 'product_name', 'product_price', 'quantity', 'total', 'is_stale']
+
+    def get_is_stale(self, cart_item):
+        # The line total was computed with a price that has changed since
+        return round(cart_item.total, 2) != round(cart_item.product.price * cart_item.quantity, 2)
+
+class CartSerializer(serializers.Serializer):
+    cart_items = CartItemSerializer(many=True)
+    summary = serializers.SerializerMethodField()
+
+    def get_summary(self, cart):
+        # Computed from the loaded items, no extra queries. The subtotal is the
+        # sum of the stored line totals, like Cart.subtotal behind
+        # /api/cart/summary/: has_stale_prices tells when checkout, at the
+        # current prices, will differ
+        items = cart['cart_items']
+        return {
+            'item_count': sum(item.quantity for item in items),
+            'subtotal': round(sum(item.total for item in items), 2),
+            'has_stale_prices': any(CartItemSerializer().get_is_stale(item) for item in items),
+        }
 
-    class Meta:
-        model = Cart
-        fields = ['cart_items']
+class CartSummarySerializer(serializers.Serializer):
+    item_count = serializers.IntegerField()
+    subtotal = serializers.FloatField()
 
 
 class CartView(APIView):
@@ -226,39 +406,57 @@ class CartView(APIView):
     serializer_class = CartSerializer
 
     def get(self, request):
-        try:
-            cart = Cart.objects.get(user=request.user)
-            serializer = CartSerializer(cart)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Cart.DoesNotExist:
+        items = get_store().items(request.user)
+        if items is None:
+            return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+        serializer = CartSerializer({'cart_items': items})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class CartSummaryView(APIView):
+    """ Cart badge/header data, read from the denormalized cart totals (or the cached cart). """
+    permission_classes = [IsAuthenticated]
+    serializer_class = CartSummarySerializer
+
+    def get(self, request):
+        summary = get_store().summary(request.user)
+        if summary is None:
             return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+        serializer = CartSummarySerializer({'item_count': summary[0], 'subtotal': summary[1]})
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
 ####### End of Cart ######
 
 
 ######## Orders ###########
 
-class OrderItemsSerializer(serializers.ModelSerializer):
+class OrderItemsSerializer(sparse.SparseFieldsMixin, serializers.ModelSerializer):
     product = serializers.CharField(source='product.name', read_only=True)
-    seller = serializers.CharField(source='product.seller.username', read_only=True)
+    seller = serializers.CharField(source='product.seller.name', read_only=True)
 
     class Meta:
         model = OrderItem
         fields = '__all__'
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(sparse.SparseFieldsMixin, serializers.ModelSerializer):
     order_items = OrderItemsSerializer(source='orderitem_set', many=True)
     class Meta:
         model = Order
         fields = '__all__'
+        # Payment gateway references, ?include=razorpay_order_id,...
+        optional_fields = ('razorpay_order_id', 'razorpay_payment_id', 'razorpay_signature')
 
-class OrdersView(APIView):
+class OrdersView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
 
     def get(self, request):
-        orders = Order.objects.filter(user=request.user)
-        serializer = OrderSerializer(orders, many=True)
+        # Two queries whatever the number of orders: the orders, then all of their items with product and seller
+        orders = Order.objects.filter(user=request.user).prefetch_related(
+            Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product__seller'))
+        )
+        serializer = OrderSerializer(many=True, context=sparse.context(request))
+        serializer.instance = sparse.prune(orders, serializer)
         return Response(serializer.data)
 
     def post(self, request):
@@ -301,78 +499,26 @@ class CheckoutView(APIView):
 
             if serializer.is_valid():
                 data = serializer.validated_data
-                user = request.user  # Assuming the user is authenticated
-                address = Address.objects.get(id=data.get('address_id'))
-
-                if not address:
-                    return Response({"error": "Select the address"}, status=status.HTTP_404_NOT_FOUND)
-                
-                cart = Cart.objects.get(user=user)
-
-                if not cart:
-                    return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
-
-                cart_items = CartItem.objects.filter(cart=cart)
-
-                if not cart_items:
-                    return Response({"error": "Cart is empty"}, status=status.HTTP_404_NOT_FOUND)
-
-                grand_total = 0
-                
-                for cart_item in cart_items:
-                    product = cart_item.product
-                    quantity = cart_item.quantity
-                    
-                    grand_total += product.price * quantity
-                    
-                # now = datetime.now()
-                # Step 2: Create a new order in the Django Order model
-                order = Order.objects.create(
-                    user=user,
-                    total=grand_total,
-                    status='Pending',  # Initial status
-                    amount_due = grand_total,
-                    amount_paid = 0,
-                    address = address,
-                    payment_mode = data['payment_mode'],
-                    # receipt_number = f"REC-{now.strftime('%Y%m%d%H%M%S%f')}"
-                )
-
-                OrderItem.objects.bulk_create([
-                    OrderItem(
-                        order=order,
-                        product=cart_item.product,
-                        quantity=cart_item.quantity,
-                        total=cart_item.total
-                    ) for cart_item in cart_items
-                ])
-
-                CartItem.objects.filter(cart=cart).delete()
-
-                if data['payment_mode'] == 'Online Payment': 
 
-                    client = razorpay.Client(auth=(settings.RAZORPAY_KEY, settings.RAZORPAY_SECRET))
-                    # Step 3: Create an order in Razorpay
-                    razorpay_order = client.order.create({
-                        "amount": int(order.total * 100),  # Amount in paise (1 INR = 100 paise)
-                        "currency": 'INR',
-                        "receipt": f"order_rcptid_{order.id}",
-                        "payment_capture": 1  # Auto-capture the payment
-                    })
+                # Step 2: Write the cart to the database if it is kept in the
+                # cache, then create the order and empty the cart in one transaction
+                try:
+                    order = get_store().checkout(
+                        request.user, lambda: place_order(request.user, data['address_id'], data['payment_mode']),
+                    )
+                except CheckoutError as e:
+                    return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
 
-                    # Step 4: Save the Razorpay order_id in the Order model
-                    order.razorpay_order_id = razorpay_order['id']
-                    order.save()
-
-                    # Step 5: Return the Razorpay order details to the client
+                if data['payment_mode'] == 'Online Payment': 
+                    # Step 3: The gateway order is created by the payment worker,
+                    # the client polls the payment status with the order id
                     response_data = {
-                        "razorpay_order_id": order.razorpay_order_id,
-                        "amount": razorpay_order['amount'],
-                        "currency": razorpay_order['currency'],
-                        "receipt": razorpay_order['receipt'],
+                        "order_id": order.id,
+                        "payment_reference": payments.gateway_order_details(order)['receipt'],
+                        "payment_status": 'Pending',
                         "order_status": order.status,
                     }
-                    return Response(response_data, status=status.HTTP_201_CREATED)
+                    return Response(response_data, status=status.HTTP_202_ACCEPTED)
                 else: 
                     return Response({"message": "COD Order created successfully"}, status=status.HTTP_201_CREATED)
 
@@ -386,6 +532,33 @@ class CheckoutView(APIView):
 
 
 
+######### Payment Status ##########
+
+class PaymentStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, order_id):
+        try:
+            outbox = PaymentOutbox.objects.select_related('order').get(order_id=order_id, order__user=request.user)
+        except PaymentOutbox.DoesNotExist:
+            return Response({"error": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        order = outbox.order
+        response_data = {
+            "order_id": order.id,
+            "payment_status": outbox.status,
+            "order_status": order.status,
+        }
+        if outbox.status == 'Done':
+            # Same shape as the gateway order details checkout used to return
+            response_data.update(payments.gateway_order_details(order), razorpay_order_id=order.razorpay_order_id)
+        return Response(response_data)
+
+
+######## End of Payment Status ########
+
+
+
 ######### Verify Payment ##########
 
 class VerifyPaymentSerializer(serializers.Serializer):
@@ -406,7 +579,7 @@ class VerifyPaymentView(APIView):
         order.razorpay_payment_id = serializer.validated_data['razorpay_payment_id']
         order.razorpay_signature = serializer.validated_data['razorpay_signature']
 
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY, settings.RAZORPAY_SECRET))
+        client = payments.get_client()
         params_dict = {
             'razorpay_order_id': order.razorpay_order_id,
             'razorpay_payment_id': order.razorpay_payment_id,
@@ -430,7 +603,7 @@ class VerifyPaymentView(APIView):
 
 ######## Addresses ##########
 
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(sparse.SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Address
         fields = ['id', 'address', 'city', 'state', 'pincode', 'phone']
@@ -448,8 +621,8 @@ class AddressesView(APIView):
     serializer_class = AddressSerializer
 
     def get(self, request):
-        addresses = Address.objects.filter(user=request.user)
-        serializer = AddressSerializer(addresses, many=True)
+        serializer = AddressSerializer(many=True, context=sparse.context(request))
+        serializer.instance = sparse.prune(Address.objects.filter(user=request.user), serializer)
         return Response(serializer.data)
 
     def post(self, request):
@@ -470,5 +643,63 @@ class AddressesView(APIView):
 ######End of Addresses #######
 
 
+######## Analytics ##########
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    dimension = serializers.ChoiceField(choices=[dimension for dimension, label in SalesRollup.Dimension], default='all')
+    key = serializers.ListField(child=serializers.CharField(), required=False)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    interval = serializers.ChoiceField(choices=analytics.INTERVALS, default='day')
+    status = serializers.ListField(child=serializers.ChoiceField(choices=[status for status, label in Order.Status]), required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+    def validate(self, data):
+        data.setdefault('end', timezone.localdate())
+        data.setdefault('start', data['end'] - timedelta(days=29))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'start': 'Must not be after end'})
+        if (data['end'] - data['start']).days > 3 * 366:
+            raise serializers.ValidationError({'start': 'At most three years can be requested'})
+        # Cancelled orders are left out unless asked for
+        data.setdefault('status', ['Pending', 'Delivered'])
+        return data
+
+
+class AnalyticsView(APIView):
+    """
+    Sales time series read from the daily rollups, e.g.
+    /api/analytics/?dimension=category&interval=week&start=2025-01-01
+    """
+    permission_classes = [IsAdminUser]
+    serializer_class = AnalyticsQuerySerializer
 
+    def get(self, request):
+        params = request.query_params.copy()
+        for name in ('key', 'status'):
+            # Accept ?status=Pending,Delivered as well as repeated parameters
+            values = [value for values in params.getlist(name) for value in values.split(',') if value]
+            params.setlist(name, values)
+            if not values:
+                del params[name]
+
+        serializer = AnalyticsQuerySerializer(data=params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+
+        series = analytics.series(
+            query['dimension'], query['start'], query['end'], query['interval'],
+            statuses=query['status'], keys=query.get('key'), limit=query['limit'],
+        )
+        return Response({
+            'dimension': query['dimension'],
+            'interval': query['interval'],
+            'start': query['start'],
+            'end': query['end'],
+            'status': query['status'],
+            'series': series,
+        })
+
+
+######## End of Analytics ########
 